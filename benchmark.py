@@ -0,0 +1,390 @@
+"""
+离线基准测试：在本地模拟接口上运行下载流程，统计吞吐量、单个物品耗时、内存峰值和系统调用次数
+
+用法:
+    python benchmark.py run --items 500 2000 --workers 3 8 --engine thread asyncio
+    python benchmark.py run --items 1000 --latency 0.05 --error-rate 0.02 --throttle-rate 0.02
+    python benchmark.py run --sink 1000          # 对比update_json_file和ResultSink写结果的开销
+    python benchmark.py compare                  # 与上一次相同场景的结果对比，出现退化时退出码为1
+
+每个场景在独立的子进程和临时目录中运行，模拟接口运行在当前进程中，统计数据只包含下载流程本身。
+结果追加到 benchmarks/results.jsonl，便于比较不同提交之间的变化。
+"""
+import argparse
+from datetime import datetime
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FILE = os.path.join(ROOT, 'benchmarks', 'results.jsonl')
+
+# compare时视为退化的变化比例
+DEFAULT_THRESHOLD = 0.10
+
+
+def percentile(values: list, percent: float):
+    """最近秩法计算百分位数，values需要已排序"""
+    if not values:
+        return None
+    rank = max(1, math.ceil(percent * len(values) / 100))
+    return values[min(rank, len(values)) - 1]
+
+
+def read_proc_io() -> dict:
+    """读取当前进程的I/O统计（Linux），不支持时返回空字典"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def scenario_key(scenario: dict) -> str:
+    """场景标识，compare时按此分组"""
+    if scenario['kind'] != 'download':
+        return f"{scenario['kind']}/items={scenario['items']}"
+    return (f"download/{scenario['engine']}/items={scenario['items']}/workers={scenario['workers']}"
+            f"/latency={scenario['latency']:g}/errors={scenario['error_rate']:g}"
+            f"/throttle={scenario['throttle_rate']:g}")
+
+
+def _finish_metrics(wall: float, count: int, latencies: list, io_before: dict) -> dict:
+    import resource
+
+    io_after = read_proc_io()
+    latencies.sort()
+    return {
+        'wall_seconds': round(wall, 3),
+        'items': count,
+        'items_per_sec': round(count / wall, 1) if wall else None,
+        'latency_p50_ms': _ms(percentile(latencies, 50)),
+        'latency_p95_ms': _ms(percentile(latencies, 95)),
+        'latency_p99_ms': _ms(percentile(latencies, 99)),
+        # Linux上ru_maxrss的单位为KB
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'read_syscalls': _delta(io_before, io_after, 'syscr'),
+        'write_syscalls': _delta(io_before, io_after, 'syscw'),
+        'bytes_written': _delta(io_before, io_after, 'wchar'),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _delta(before: dict, after: dict, key: str):
+    if key not in before or key not in after:
+        return None
+    return after[key] - before[key]
+
+
+def run_download_child(scenario: dict) -> dict:
+    """在子进程中运行一次下载，返回统计数据"""
+    from config import ITEM_CONFIG, COMMON_CONFIG
+    from cli import load_config_file
+
+    if scenario.get('config'):
+        load_config_file(scenario['config'])
+    ITEM_CONFIG['API']['BASE_URL'] = scenario['base_url']
+    ITEM_CONFIG['API']['isCash'] = None
+    COMMON_CONFIG['CONCURRENT']['ENGINE'] = scenario['engine']
+    if scenario['engine'] == 'asyncio':
+        COMMON_CONFIG['CONCURRENT']['ASYNC_CONCURRENCY'] = scenario['workers']
+    else:
+        COMMON_CONFIG['CONCURRENT']['MAX_WORKERS'] = scenario['workers']
+    COMMON_CONFIG['REQUEST']['RETRY_DELAY'] = scenario['retry_delay']
+
+    import downloader.item_download as item_download
+    latencies = []
+
+    # 包装单个物品的处理函数，记录从开始处理到得到结果的耗时
+    if scenario['engine'] == 'asyncio':
+        import downloader.async_engine as async_engine
+        process_item_async = async_engine.process_item_async
+
+        async def timed_process_item_async(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await process_item_async(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+        async_engine.process_item_async = timed_process_item_async
+    else:
+        process_single_item = item_download.process_single_item
+
+        def timed_process_single_item(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return process_single_item(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+        item_download.process_single_item = timed_process_single_item
+
+    io_before = read_proc_io()
+    start = time.perf_counter()
+    ok = item_download.start_download()
+    wall = time.perf_counter() - start
+
+    statuses = {}
+    json_files = [name for name in os.listdir('.') if name.endswith('.json')]
+    if json_files:
+        with open(json_files[0], 'r', encoding='utf-8') as f:
+            for result in json.load(f):
+                statuses[result['status']] = statuses.get(result['status'], 0) + 1
+
+    metrics = _finish_metrics(wall, statuses.get('success', 0), latencies, io_before)
+    metrics['ok'] = bool(ok)
+    metrics['statuses'] = statuses
+    return metrics
+
+
+def update_json_file(item_data, json_file: str):
+    """改用ResultSink之前写结果的方式：每条结果都读取并重写整个JSON文件，只用于对比"""
+    existing_data = []
+    if os.path.exists(json_file):
+        with open(json_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+            if content.strip():
+                existing_data = json.loads(content)
+    existing_data.append(item_data)
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump(existing_data, f, ensure_ascii=False, indent=2)
+
+
+def run_sink_child(scenario: dict) -> dict:
+    """在子进程中写入一批合成的结果，对比逐条重写JSON文件和流式写入的开销"""
+    from result_sink import ResultSink, get_jsonl_filename
+
+    results = [{'id': 1102000 + i, 'name': f"Mock Cape {i}", 'isCash': i % 2 == 0,
+                'filename': f"Mock Cape {i}.png", 'status': 'success'} for i in range(scenario['items'])]
+    latencies = []
+    io_before = read_proc_io()
+    start = time.perf_counter()
+    if scenario['kind'] == 'sink-update-json':
+        for result in results:
+            write_start = time.perf_counter()
+            update_json_file(result, 'results.json')
+            latencies.append(time.perf_counter() - write_start)
+    else:
+        sink = ResultSink(get_jsonl_filename('results.json'))
+        for result in results:
+            write_start = time.perf_counter()
+            sink.write(result)
+            latencies.append(time.perf_counter() - write_start)
+        sink.finalize('results.json')
+    wall = time.perf_counter() - start
+    metrics = _finish_metrics(wall, len(results), latencies, io_before)
+    metrics['ok'] = True
+    return metrics
+
+
+def child_main(scenario_json: str):
+    scenario = json.loads(scenario_json)
+    sys.path.insert(0, ROOT)
+    workdir = tempfile.mkdtemp(prefix='crawler-bench-')
+    try:
+        os.chdir(workdir)
+        if scenario['kind'] == 'download':
+            metrics = run_download_child(scenario)
+        else:
+            metrics = run_sink_child(scenario)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(metrics))
+
+
+def run_scenario(scenario: dict, timeout: float) -> dict:
+    """在子进程中运行一个场景，下载场景的模拟接口运行在当前进程中"""
+    server = faults = None
+    if scenario['kind'] == 'download':
+        from mock_server import MockCatalog, FaultConfig, start_server, base_url
+        faults = FaultConfig(scenario['latency'], scenario['jitter'], scenario['error_rate'],
+                             scenario['throttle_rate'], scenario['retry_after'], seed=scenario['seed'])
+        catalog = MockCatalog(scenario['items'], unique_icons=max(1, scenario['items'] // 2))
+        server = start_server(catalog, faults=faults)
+        scenario = dict(scenario, base_url=base_url(server))
+
+    try:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '_child', json.dumps(scenario)],
+            capture_output=True, text=True, timeout=timeout)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    if process.returncode != 0 or not process.stdout.strip():
+        tail = '\n'.join(process.stderr.strip().splitlines()[-10:])
+        raise RuntimeError(f"Benchmark {scenario_key(scenario)} failed:\n{tail}")
+    metrics = json.loads(process.stdout.strip().splitlines()[-1])
+    if faults is not None:
+        metrics['server'] = dict(faults.stats)
+    return metrics
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def load_results(path: str = RESULTS_FILE) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_result(record: dict, path: str = RESULTS_FILE):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def format_row(key: str, metrics: dict) -> str:
+    return (f"{key:<72} {metrics['items_per_sec'] or 0:>9.1f}/s "
+            f"p50={metrics['latency_p50_ms']}ms p95={metrics['latency_p95_ms']}ms "
+            f"p99={metrics['latency_p99_ms']}ms rss={metrics['peak_rss_mb']}MB "
+            f"writes={metrics['write_syscalls']}")
+
+
+def build_scenarios(args) -> list:
+    scenarios = []
+    for items in args.items:
+        for engine in args.engine:
+            for workers in args.workers:
+                scenarios.append({
+                    'kind': 'download', 'engine': engine, 'items': items, 'workers': workers,
+                    'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+                    'throttle_rate': args.throttle_rate, 'retry_after': args.retry_after,
+                    'retry_delay': args.retry_delay, 'seed': args.seed, 'config': args.config,
+                })
+    for items in args.sink or []:
+        for kind in ('sink-update-json', 'sink-stream'):
+            scenarios.append({'kind': kind, 'items': items})
+    return scenarios
+
+
+def cmd_run(args) -> int:
+    commit = get_commit()
+    timestamp = datetime.now().isoformat(timespec='seconds')
+    failed = 0
+    for scenario in build_scenarios(args):
+        key = scenario_key(scenario)
+        try:
+            metrics = run_scenario(scenario, args.timeout)
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            print(f"{key}: {str(e)}", file=sys.stderr)
+            failed += 1
+            continue
+        print(format_row(key, metrics))
+        if not args.no_save:
+            append_result({
+                'timestamp': timestamp, 'commit': commit, 'label': args.label,
+                'python': platform.python_version(), 'key': key,
+                'scenario': scenario, 'metrics': metrics,
+            }, args.results)
+    if not args.no_save:
+        print(f"Results appended to {args.results}")
+    return 1 if failed else 0
+
+
+def _change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def cmd_compare(args) -> int:
+    records = load_results(args.results)
+    by_key = {}
+    for record in records:
+        by_key.setdefault(record['key'], []).append(record)
+
+    regressions = 0
+    for key, runs in sorted(by_key.items()):
+        current = runs[-1]
+        if args.baseline:
+            previous = [r for r in runs[:-1] if args.baseline in (r.get('label'), r.get('commit'))]
+        else:
+            previous = runs[:-1]
+        if not previous:
+            print(f"{'new':<10} {key}")
+            continue
+        baseline = previous[-1]
+        old, new = baseline['metrics'], current['metrics']
+        throughput = _change(old['items_per_sec'], new['items_per_sec'])
+        p95 = _change(old['latency_p95_ms'], new['latency_p95_ms'])
+        rss = _change(old['peak_rss_mb'], new['peak_rss_mb'])
+        regressed = ((throughput is not None and throughput < -args.threshold)
+                     or (p95 is not None and p95 > args.threshold))
+        regressions += regressed
+        print(f"{'REGRESSION' if regressed else 'ok':<10} {key}")
+        print(f"           {baseline.get('commit')} -> {current.get('commit')}: "
+              f"items/s {old['items_per_sec']} -> {new['items_per_sec']} ({_pct(throughput)}), "
+              f"p95 {old['latency_p95_ms']} -> {new['latency_p95_ms']}ms ({_pct(p95)}), "
+              f"rss {old['peak_rss_mb']} -> {new['peak_rss_mb']}MB ({_pct(rss)})")
+    if not by_key:
+        print(f"No benchmark results in {args.results}")
+    return 1 if regressions else 0
+
+
+def _pct(change) -> str:
+    return 'n/a' if change is None else f"{change:+.1%}"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument('--results', default=RESULTS_FILE, help="结果文件")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help="运行基准测试")
+    run.add_argument('--items', type=int, nargs='+', default=[500], help="物品列表大小")
+    run.add_argument('--workers', type=int, nargs='+', default=[3],
+                     help="线程数（asyncio引擎为并发请求数）")
+    run.add_argument('--engine', nargs='+', choices=['thread', 'asyncio'], default=['thread'])
+    run.add_argument('--latency', type=float, default=0.01, help="模拟接口每个请求的延迟(秒)")
+    run.add_argument('--jitter', type=float, default=0.0, help="随机增加的最大延迟(秒)")
+    run.add_argument('--error-rate', type=float, default=0.0, help="返回500的比例")
+    run.add_argument('--throttle-rate', type=float, default=0.0, help="返回429的比例")
+    run.add_argument('--retry-after', type=float, default=1, help="429响应的Retry-After(秒)")
+    run.add_argument('--retry-delay', type=float, default=0.05, help="下载器重试退避的基础时间(秒)")
+    run.add_argument('--seed', type=int, default=1, help="故障注入的随机数种子")
+    run.add_argument('--sink', type=int, nargs='*', help="同时测试写入这么多条结果的开销")
+    run.add_argument('--config', help="传给下载器的JSON配置文件，格式同cli.py")
+    run.add_argument('--label', help="本次运行的标签，compare --baseline可以按标签选择基准")
+    run.add_argument('--timeout', type=float, default=600, help="单个场景的超时时间(秒)")
+    run.add_argument('--no-save', action='store_true', help="不保存结果")
+    run.set_defaults(handler=cmd_run)
+
+    compare = subparsers.add_parser('compare', help="与之前的结果对比")
+    compare.add_argument('--baseline', help="作为基准的标签或提交，默认为上一次运行")
+    compare.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                         help="吞吐量下降或p95上升超过该比例时视为退化")
+    compare.set_defaults(handler=cmd_compare)
+    return parser
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['_child']:
+        child_main(argv[1])
+        return 0
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,399 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from item_list import ItemRecord, batched
+
+# 物品状态
+STATUS_PENDING = 'pending'
+STATUS_SUCCESS = 'success'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    cms_version TEXT NOT NULL,
+    item_id     INTEGER NOT NULL,
+    resize      TEXT NOT NULL,
+    name        TEXT,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    result      TEXT,
+    updated_at  REAL NOT NULL,
+    PRIMARY KEY (cms_version, item_id, resize)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_key     TEXT PRIMARY KEY,
+    cms_version TEXT NOT NULL,
+    params      TEXT NOT NULL,
+    complete    INTEGER NOT NULL DEFAULT 0,
+    fetched_at  REAL NOT NULL,
+    started_at  REAL,
+    finished    INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS run_items (
+    run_key     TEXT NOT NULL,
+    position    INTEGER NOT NULL,
+    item_id     INTEGER NOT NULL,
+    name        TEXT,
+    is_cash     INTEGER,
+    PRIMARY KEY (run_key, position)
+);
+"""
+
+# 早期版本的runs表中没有的列
+_RUN_COLUMNS = (
+    ('started_at', 'REAL'),
+    ('finished', 'INTEGER NOT NULL DEFAULT 0'),
+)
+
+# 每批写入或查询的物品数
+_BATCH_SIZE = 500
+
+
+def new_counts() -> dict:
+    """创建用于统计各状态物品数的字典"""
+    return {STATUS_PENDING: 0, STATUS_SUCCESS: 0,
+            STATUS_SKIPPED: 0, STATUS_FAILED: 0, 'exhausted': 0}
+
+
+def make_run_key(cms_version: str, params: dict, is_cash) -> str:
+    """
+    根据CMS版本、查询参数和isCash过滤条件生成一次抓取任务的标识
+    """
+    payload = json.dumps([cms_version, params, is_cash],
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class CheckpointStore:
+    """
+    基于SQLite的断点续传记录
+
+    每个物品以 (CMS版本, 物品ID, resize参数) 为键记录处理状态，
+    同时保存每次抓取到的物品列表，重启后可直接从记录中恢复未完成的物品。
+    只有尚未结束的任务会被继续；任务结束后再次运行时重新开始，之前记录的状态不再用于筛选。
+    """
+
+    def __init__(self, path: str, cms_version: str, resize):
+        self.path = path
+        self.cms_version = cms_version
+        self.resize = str(resize)
+        self._lock = threading.Lock()
+        # 当前任务开始的时间，更早更新的物品状态属于已经结束的任务，筛选时视为新物品
+        self._since = 0.0
+        self._started = set()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(runs)")}
+        for name, definition in _RUN_COLUMNS:
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE runs ADD COLUMN {name} {definition}")
+        self._conn.commit()
+
+    def start_run(self, run_key: str, params: dict, fresh: bool = False) -> bool:
+        """
+        开始或继续一次抓取任务，应在获取列表和筛选物品之前调用
+
+        任务已经开始但尚未结束时继续该任务，已完成的物品不再处理；
+        任务从未开始、已经结束或fresh为True时重新开始，清空保存的列表，之前记录的状态不再用于筛选
+
+        Args:
+            run_key: make_run_key生成的任务标识
+            params: 请求物品列表的参数
+            fresh: 是否忽略尚未结束的任务，总是重新开始
+
+        Returns:
+            bool: 是否继续了尚未结束的任务
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT started_at, finished FROM runs WHERE run_key = ?", (run_key,)).fetchone()
+            resuming = row is not None and not row[1] and not fresh
+            if resuming:
+                # 早期版本记录的任务没有开始时间，之前的状态全部有效
+                self._since = row[0] or 0.0
+            else:
+                self._since = now
+                self._conn.execute("DELETE FROM run_items WHERE run_key = ?", (run_key,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, 0, ?, ?, 0)",
+                    (run_key, self.cms_version, json.dumps(params, ensure_ascii=False), now, now))
+                self._conn.commit()
+        self._started.add(run_key)
+        return resuming
+
+    def finish_runs(self, max_attempts: int) -> list:
+        """
+        将本次开始或继续的任务中已经全部完成的标记为结束，之后的运行重新开始筛选
+
+        物品列表未完整保存、或仍有未处理和可以重试的物品的任务不标记，下次运行时继续
+
+        Returns:
+            list: 标记为结束的任务标识
+        """
+        finished = []
+        for run_key in sorted(self._started):
+            if self.load_item_list(run_key) is None or self._has_pending(run_key, max_attempts):
+                continue
+            with self._lock:
+                self._conn.execute("UPDATE runs SET finished = 1 WHERE run_key = ?", (run_key,))
+                self._conn.commit()
+            finished.append(run_key)
+        return finished
+
+    def record_item_list(self, run_key: str, params: dict, items):
+        """
+        边读取边保存物品列表，列表完整读完后才标记为可复用
+
+        Args:
+            run_key: make_run_key生成的任务标识
+            params: 请求物品列表的参数
+            items: 可迭代的ItemRecord
+
+        Yields:
+            ItemRecord: 原样返回items中的每个物品
+        """
+        self.begin_item_list(run_key, params)
+        position = 0
+        for batch in batched(items, _BATCH_SIZE):
+            position = self.append_item_list(run_key, batch, position)
+            yield from batch
+        self.complete_item_list(run_key)
+
+    def begin_item_list(self, run_key: str, params: dict):
+        """开始保存新的物品列表，清空该任务之前保存的列表，任务的开始时间和是否结束不变"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM run_items WHERE run_key = ?", (run_key,))
+            self._conn.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, 0, ?, ?, 0) "
+                "ON CONFLICT (run_key) DO UPDATE SET "
+                "params = excluded.params, complete = 0, fetched_at = excluded.fetched_at",
+                (run_key, self.cms_version, json.dumps(params, ensure_ascii=False), now, now))
+            self._conn.commit()
+
+    def append_item_list(self, run_key: str, batch: list, position: int) -> int:
+        """
+        追加保存一批物品
+
+        Args:
+            run_key: 任务标识
+            batch: ItemRecord列表
+            position: 这批物品中第一个物品在列表中的位置
+
+        Returns:
+            int: 下一批物品的起始位置
+        """
+        rows = []
+        for item in batch:
+            rows.append((run_key, position, item.id, item.name, int(bool(item.is_cash))))
+            position += 1
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO run_items VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+        return position
+
+    def complete_item_list(self, run_key: str):
+        """将物品列表标记为已完整保存，之后可以复用"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET complete = 1 WHERE run_key = ?", (run_key,))
+            self._conn.commit()
+
+    def load_item_list(self, run_key: str):
+        """
+        分页读取之前完整保存的物品列表
+
+        Returns:
+            生成ItemRecord的迭代器，没有完整的记录时返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT complete FROM runs WHERE run_key = ?", (run_key,)).fetchone()
+        if not row or not row[0]:
+            return None
+        return self._iter_run_items(run_key)
+
+    def _iter_run_items(self, run_key: str):
+        position = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT position, item_id, name, is_cash FROM run_items "
+                    "WHERE run_key = ? AND position > ? ORDER BY position LIMIT ?",
+                    (run_key, position, _BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for position, item_id, name, is_cash in rows:
+                yield ItemRecord(item_id, name, bool(is_cash))
+
+    def count_items(self, run_key: str) -> int:
+        """获取保存的物品列表中的物品数"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM run_items WHERE run_key = ?", (run_key,)).fetchone()[0]
+
+    def has_unfinished(self, run_key: str, max_attempts: int) -> bool:
+        """判断任务是否尚未结束，且保存的物品列表中还有未完成或仍有重试次数的物品"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT finished FROM runs WHERE run_key = ?", (run_key,)).fetchone()
+        if row is None or row[0]:
+            return False
+        return self._has_pending(run_key, max_attempts)
+
+    def _has_pending(self, run_key: str, max_attempts: int) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM run_items r LEFT JOIN items i "
+                "ON i.cms_version = ? AND i.item_id = r.item_id AND i.resize = ? "
+                "WHERE r.run_key = ? AND (i.status IS NULL OR i.status = ? "
+                "OR (i.status = ? AND i.attempts < ?)) LIMIT 1",
+                (self.cms_version, self.resize, run_key,
+                 STATUS_PENDING, STATUS_FAILED, max_attempts)).fetchone()
+        return row is not None
+
+    def get_states(self, item_ids: list) -> dict:
+        """
+        获取当前CMS版本和resize参数下指定物品在当前任务中的状态，属于已经结束的任务的状态不返回
+
+        Returns:
+            dict: {物品ID: (状态, 已尝试次数)}
+        """
+        states = {}
+        for batch in batched(item_ids, _BATCH_SIZE):
+            placeholders = ','.join('?' * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT item_id, status, attempts FROM items "
+                    "WHERE cms_version = ? AND resize = ? AND updated_at >= ? "
+                    f"AND item_id IN ({placeholders})",
+                    (self.cms_version, self.resize, self._since, *batch)).fetchall()
+            for item_id, status, attempts in rows:
+                states[item_id] = (status, attempts)
+        return states
+
+    def select_items(self, items: list, max_attempts: int, counts: dict = None) -> list:
+        """
+        从一批物品中筛选出需要处理的物品，并将新物品登记为pending
+
+        只有pending状态、在当前任务中从未处理过、或失败次数未超过max_attempts的物品会被选中
+
+        Args:
+            items: ItemRecord列表
+            max_attempts: 失败物品最多尝试的次数
+            counts: 用于累计各状态物品数的字典，可选
+
+        Returns:
+            list: 待处理的物品
+        """
+        if counts is None:
+            counts = new_counts()
+        states = self.get_states([item.id for item in items])
+        selected = []
+        new_rows = []
+        now = time.time()
+
+        for item in items:
+            state = states.get(item.id)
+            if state is None:
+                new_rows.append((self.cms_version, item.id, self.resize,
+                                 item.name, STATUS_PENDING, 0, None, now))
+                counts[STATUS_PENDING] += 1
+                selected.append(item)
+                continue
+
+            status, attempts = state
+            if status == STATUS_FAILED and attempts >= max_attempts:
+                counts['exhausted'] += 1
+                continue
+            counts[status] = counts.get(status, 0) + 1
+            if status in (STATUS_PENDING, STATUS_FAILED):
+                selected.append(item)
+
+        if new_rows:
+            with self._lock:
+                # 之前任务留下的状态重置为pending，当前任务中已有的状态不覆盖
+                self._conn.executemany(
+                    "INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (cms_version, item_id, resize) DO UPDATE SET "
+                    "name = excluded.name, status = excluded.status, attempts = 0, result = NULL, "
+                    "updated_at = excluded.updated_at WHERE items.updated_at < ?",
+                    [row + (self._since,) for row in new_rows])
+                self._conn.commit()
+        return selected
+
+    def iter_scheduled(self, items, max_attempts: int, counts: dict):
+        """
+        按批筛选可迭代的物品，逐个返回需要处理的物品
+
+        Args:
+            items: 可迭代的ItemRecord
+            max_attempts: 失败物品最多尝试的次数
+            counts: 用于累计各状态物品数的字典
+        """
+        for batch in batched(items, _BATCH_SIZE):
+            yield from self.select_items(batch, max_attempts, counts)
+
+    def mark(self, result: dict):
+        """
+        根据处理结果更新物品状态，失败时累计尝试次数
+        """
+        status = result.get('status', STATUS_FAILED)
+        failed = 1 if status == STATUS_FAILED else 0
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (cms_version, item_id, resize) DO UPDATE SET "
+                "name = excluded.name, status = excluded.status, "
+                "attempts = items.attempts + excluded.attempts, "
+                "result = excluded.result, updated_at = excluded.updated_at",
+                (self.cms_version, result['id'], self.resize, result.get('name'),
+                 status, failed, json.dumps(result, ensure_ascii=False), time.time()))
+            self._conn.commit()
+
+    def iter_results(self, statuses=(STATUS_SUCCESS, STATUS_SKIPPED)):
+        """
+        分页读取当前CMS版本和resize参数下各物品最近一次的处理结果
+
+        Args:
+            statuses: 只返回这些状态的物品
+
+        Yields:
+            dict: 写入结果文件的单个物品结果
+        """
+        placeholders = ', '.join('?' for _ in statuses)
+        last_id = None
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT item_id, result FROM items WHERE cms_version = ? AND resize = ? "
+                    f"AND status IN ({placeholders}) AND result IS NOT NULL "
+                    f"AND (? IS NULL OR item_id > ?) ORDER BY item_id LIMIT ?",
+                    (self.cms_version, self.resize, *statuses, last_id, last_id,
+                     _BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for item_id, result in rows:
+                yield json.loads(result)
+            last_id = rows[-1][0]
+
+    def summary(self) -> dict:
+        """按状态统计当前CMS版本和resize参数下的物品数量"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM items "
+                "WHERE cms_version = ? AND resize = ? GROUP BY status",
+                (self.cms_version, self.resize)).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,458 @@
+"""
+无交互的命令行入口，适合在cron和容器中定时运行
+
+用法:
+    python cli.py download [--url URL | --url-file FILE] [--config FILE] [--engine asyncio] ...
+    python cli.py resume [--config FILE]
+    python cli.py stats [--config FILE] [--json]
+    python cli.py atlas [--config FILE] [--results FILE]
+    python cli.py shard --shards N [--shard I] [--output-dir DIR] [--config FILE] ...
+    python cli.py merge [--output-dir DIR] [--allow-partial]
+    python cli.py delta --url URL [--previous CMS/201] [--output-dir DIR] ...
+    python cli.py npc [--url URL] [--animations stand,say] [--max-frames N] [--config FILE] ...
+    python cli.py map [--url URL] [--minimap] [--chunk-size-mb N] [--config FILE] ...
+    python cli.py index {stats,get,search,missing,import} [参数 ...] [--cms-version CMS/202] [--json]
+
+配置文件为JSON，结构与config.py相同，只需要写出要覆盖的项，例如:
+    {"COMMON_CONFIG": {"CONCURRENT": {"MAX_WORKERS": 8}}, "ITEM_CONFIG": {"PATHS": {"IMAGES": "capes"}}}
+
+退出码: 0 - 成功或无事可做; 1 - 下载失败; 2 - 参数或配置错误
+"""
+import argparse
+import json
+import os
+import sys
+
+from config import COMMON_CONFIG, ITEM_CONFIG, NPC_CONFIG, MAP_CONFIG
+
+# 下载相关的模块（requests、线程池、图片存储等）只在执行下载时导入，stats和无事可做的resume可以快速返回
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+CONFIG_SECTIONS = {
+    'COMMON_CONFIG': COMMON_CONFIG,
+    'ITEM_CONFIG': ITEM_CONFIG,
+    'NPC_CONFIG': NPC_CONFIG,
+    'MAP_CONFIG': MAP_CONFIG,
+}
+
+
+def merge_config(target: dict, overrides: dict, path: str = ''):
+    """
+    将覆盖项递归合并到配置字典中，PARAMS整体替换
+
+    Raises:
+        ValueError: 覆盖项中有配置里不存在的键
+    """
+    for key, value in overrides.items():
+        if key not in target:
+            raise ValueError(f"未知的配置项: {path}{key}")
+        if isinstance(target[key], dict) and isinstance(value, dict) and key != 'PARAMS':
+            merge_config(target[key], value, f"{path}{key}.")
+        else:
+            target[key] = value
+
+
+def load_config_file(path: str):
+    """读取JSON配置文件并合并到config.py中的配置"""
+    with open(path, 'r', encoding='utf-8') as f:
+        overrides = json.load(f)
+    for section, values in overrides.items():
+        if section not in CONFIG_SECTIONS:
+            raise ValueError(f"未知的配置段: {section}")
+        merge_config(CONFIG_SECTIONS[section], values, f"{section}.")
+
+
+def apply_args(args):
+    """按 配置文件 -> 命令行参数 的顺序覆盖配置"""
+    if args.config:
+        load_config_file(args.config)
+
+    if args.command == 'npc':
+        apply_npc_args(args)
+    elif args.command == 'map':
+        apply_map_args(args)
+    else:
+        apply_item_args(args)
+    if args.engine:
+        COMMON_CONFIG['CONCURRENT']['ENGINE'] = args.engine
+    if args.workers:
+        COMMON_CONFIG['CONCURRENT']['MAX_WORKERS'] = args.workers
+    if args.metrics_port is not None:
+        COMMON_CONFIG['METRICS']['PORT'] = args.metrics_port
+    if args.log_format:
+        COMMON_CONFIG['LOGGING']['FORMAT'] = args.log_format
+    if args.item_log_sample:
+        COMMON_CONFIG['LOGGING']['ITEM_SAMPLE'] = args.item_log_sample
+    if args.fresh:
+        COMMON_CONFIG['CHECKPOINT']['FRESH'] = True
+
+
+def apply_item_args(args):
+    if args.url:
+        from utils import parse_maplestory_url_params, get_item_api
+        params, is_cash = parse_maplestory_url_params(args.url)
+        ITEM_CONFIG['API'].update(get_item_api(args.url, params, is_cash))
+    if args.is_cash is not None:
+        ITEM_CONFIG['API']['isCash'] = {'true': True, 'false': False, 'any': None}[args.is_cash]
+    if args.images_dir:
+        ITEM_CONFIG['PATHS']['IMAGES'] = args.images_dir
+    if args.checkpoint:
+        ITEM_CONFIG['PATHS']['CHECKPOINT'] = args.checkpoint
+
+
+def apply_resource_args(config: dict, args):
+    """npc和map子命令中--url、--images-dir和--checkpoint作用于对应的配置"""
+    if args.url:
+        from utils import replace_api_version
+        config['API']['BASE_URL'] = replace_api_version(config['API']['BASE_URL'], args.url)
+    if args.images_dir:
+        config['PATHS']['IMAGES'] = args.images_dir
+    if args.checkpoint:
+        config['PATHS']['CHECKPOINT'] = args.checkpoint
+
+
+def apply_npc_args(args):
+    apply_resource_args(NPC_CONFIG, args)
+    if args.animations:
+        NPC_CONFIG['API']['ANIMATIONS'] = [name.strip() for name in args.animations.split(',')
+                                           if name.strip()]
+    if args.max_frames is not None:
+        NPC_CONFIG['API']['MAX_FRAMES'] = args.max_frames
+    if args.frame_workers:
+        NPC_CONFIG['FRAMES']['WORKERS'] = args.frame_workers
+
+
+def apply_map_args(args):
+    apply_resource_args(MAP_CONFIG, args)
+    if args.minimap:
+        MAP_CONFIG['API']['RENDER'] = 'minimap'
+    if args.chunk_size_mb:
+        MAP_CONFIG['CHUNKS']['SIZE_MB'] = args.chunk_size_mb
+    if args.chunk_workers:
+        MAP_CONFIG['CHUNKS']['WORKERS'] = args.chunk_workers
+
+
+def open_existing_checkpoint():
+    """打开已存在的断点记录，文件不存在时返回None，不会创建新文件"""
+    path = ITEM_CONFIG['PATHS']['CHECKPOINT']
+    if not os.path.exists(path):
+        return None
+    from checkpoint import CheckpointStore
+    from utils import get_api_version, get_icon_resize
+    return CheckpointStore(path, get_api_version(ITEM_CONFIG['API']['BASE_URL']),
+                           get_icon_resize())
+
+
+def get_run_status(checkpoint) -> dict:
+    """获取当前配置对应任务在断点记录中的状态"""
+    from checkpoint import make_run_key
+    run_key = make_run_key(checkpoint.cms_version,
+                           ITEM_CONFIG['API']['PARAMS'], ITEM_CONFIG['API']['isCash'])
+    list_saved = checkpoint.load_item_list(run_key) is not None
+    return {
+        'run_key': run_key,
+        'list_saved': list_saved,
+        'list_items': checkpoint.count_items(run_key) if list_saved else 0,
+        'unfinished': list_saved and checkpoint.has_unfinished(
+            run_key, COMMON_CONFIG['CHECKPOINT']['MAX_ATTEMPTS']),
+    }
+
+
+def cmd_download(args) -> int:
+    if args.url_file:
+        from downloader.batch_download import start_batch_download
+        ok = start_batch_download(args.url_file, args.output_dir)
+    else:
+        from downloader.item_download import start_download
+        ok = start_download()
+    return EXIT_OK if ok else EXIT_FAILED
+
+
+def cmd_resume(args) -> int:
+    checkpoint = open_existing_checkpoint()
+    if checkpoint is None:
+        print(f"No checkpoint at {ITEM_CONFIG['PATHS']['CHECKPOINT']}, nothing to resume")
+        return EXIT_OK
+    try:
+        status = get_run_status(checkpoint)
+    finally:
+        checkpoint.close()
+    if not status['unfinished']:
+        print("No unfinished crawl for the current configuration, nothing to resume")
+        return EXIT_OK
+
+    from downloader.item_download import start_download
+    return EXIT_OK if start_download() else EXIT_FAILED
+
+
+def cmd_shard(args) -> int:
+    if args.shards < 1 or (args.shard is not None and not 0 <= args.shard < args.shards):
+        print(f"错误: 无效的分片 --shard {args.shard} --shards {args.shards}", file=sys.stderr)
+        return EXIT_USAGE
+    if args.shard is not None:
+        from downloader.shard_download import start_shard_download
+        return EXIT_OK if start_shard_download(args.shard, args.shards, args.output_dir) else EXIT_FAILED
+
+    # 未指定分片时在本机为每个分片启动一个进程，全部结束后合并
+    import subprocess
+    processes = []
+    for index in range(args.shards):
+        command = [sys.executable, os.path.abspath(__file__)] + args.argv + ['--shard', str(index)]
+        if args.metrics_port is not None:
+            command += ['--metrics-port', str(args.metrics_port + index)]
+        processes.append(subprocess.Popen(command))
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        print(f"Shards failed: {', '.join(map(str, failed))}", file=sys.stderr)
+        return EXIT_FAILED
+    if args.no_merge:
+        return EXIT_OK
+
+    from downloader.shard_download import merge_shards
+    return EXIT_OK if merge_shards(args.output_dir) else EXIT_FAILED
+
+
+def cmd_merge(args) -> int:
+    from downloader.shard_download import merge_shards
+    return EXIT_OK if merge_shards(args.output_dir, args.allow_partial) else EXIT_FAILED
+
+
+def cmd_delta(args) -> int:
+    from downloader.delta_download import start_delta_download
+    return EXIT_OK if start_delta_download(args.output_dir, args.previous) else EXIT_FAILED
+
+
+def cmd_npc(args) -> int:
+    from downloader.npc_download import start_download
+    return EXIT_OK if start_download() else EXIT_FAILED
+
+
+def cmd_map(args) -> int:
+    from downloader.map_download import start_download
+    return EXIT_OK if start_download() else EXIT_FAILED
+
+
+def cmd_stats(args) -> int:
+    checkpoint = open_existing_checkpoint()
+    if checkpoint is None:
+        stats = {'checkpoint': None}
+    else:
+        try:
+            stats = {
+                'checkpoint': checkpoint.path,
+                'cms_version': checkpoint.cms_version,
+                'resize': checkpoint.resize,
+                'items': checkpoint.summary(),
+                'run': get_run_status(checkpoint),
+            }
+        finally:
+            checkpoint.close()
+
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+    elif stats['checkpoint'] is None:
+        print(f"No checkpoint at {ITEM_CONFIG['PATHS']['CHECKPOINT']}")
+    else:
+        print(f"Checkpoint: {stats['checkpoint']} ({stats['cms_version']}, resize={stats['resize']})")
+        items = ', '.join(f"{count} {status}" for status, count in sorted(stats['items'].items()))
+        print(f"Items: {items or 'none'}")
+        run = stats['run']
+        if run['list_saved']:
+            state = 'unfinished' if run['unfinished'] else 'finished'
+            print(f"Current run: {run['list_items']} items listed, {state}")
+        else:
+            print("Current run: no saved item list")
+    return EXIT_OK
+
+
+def cmd_atlas(args) -> int:
+    from image_store import ImageStore
+    from sprite_atlas import build_configured_atlas
+    from utils import setup_logging
+
+    setup_logging()
+    checkpoint = None if args.results else open_existing_checkpoint()
+    if checkpoint is None and not args.results:
+        print(f"No checkpoint at {ITEM_CONFIG['PATHS']['CHECKPOINT']}, pass --results", file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        build_configured_atlas(ImageStore(ITEM_CONFIG['PATHS']['IMAGES']), checkpoint, args.results)
+    except (OSError, ValueError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    return EXIT_OK
+
+
+def format_index_entry(entry: dict) -> str:
+    cash = {True: 'cash', False: 'noncash', None: '-'}[entry['isCash']]
+    return (f"{entry['cms_version']}  {entry['id']}  {entry['name']}  {cash}  "
+            f"{entry['category'] or '-'}  {entry['path']}  {entry['sha256'] or '-'}")
+
+
+def load_missing_ids(index, cms_version: str) -> list:
+    """获取配置的分类的最新物品列表，返回索引中该版本还没有的物品ID"""
+    from downloader.item_download import load_items
+
+    items, _ = load_items(None)
+    if items is None:
+        raise OSError("Failed to fetch item list")
+    return index.missing((item.id for item in items), cms_version)
+
+
+def cmd_index(args) -> int:
+    from item_index import ItemIndex, get_category, import_results
+    from utils import get_api_version
+
+    path = ITEM_CONFIG['PATHS']['INDEX']
+    if args.action != 'import' and not os.path.exists(path):
+        print(f"No item index at {path}", file=sys.stderr)
+        return EXIT_FAILED
+    if args.action in ('get', 'search', 'import') and not args.terms:
+        print(f"错误: index {args.action} 需要参数", file=sys.stderr)
+        return EXIT_USAGE
+
+    index = ItemIndex(path)
+    try:
+        if args.action == 'stats':
+            output = {'index': path, 'fts': index.fts, 'items': index.summary()}
+            lines = [f"Index: {path} (full-text search: {'yes' if index.fts else 'no'})"]
+            lines += [f"{version}: {count} items" for version, count in output['items'].items()]
+        elif args.action == 'get':
+            try:
+                item_ids = [int(term) for term in args.terms]
+            except ValueError:
+                print("错误: 物品ID必须是整数", file=sys.stderr)
+                return EXIT_USAGE
+            output = [entry for item_id in item_ids for entry in index.get(item_id, args.cms_version)]
+            lines = [format_index_entry(entry) for entry in output]
+        elif args.action == 'search':
+            output = index.search(' '.join(args.terms), args.cms_version, args.limit)
+            lines = [format_index_entry(entry) for entry in output]
+        elif args.action == 'missing':
+            cms_version = args.cms_version or get_api_version(ITEM_CONFIG['API']['BASE_URL'])
+            missing = load_missing_ids(index, cms_version)
+            output = {'cms_version': cms_version, 'missing': missing}
+            lines = [str(item_id) for item_id in missing]
+            lines.append(f"{len(missing)} items not in the index for {cms_version}")
+        else:
+            category = get_category()
+            output = {}
+            for results_file in args.terms:
+                output[results_file] = import_results(
+                    index, results_file, category, ITEM_CONFIG['PATHS']['IMAGES'])
+            lines = [f"Imported {count} items from {results_file}" for results_file, count in output.items()]
+    except (OSError, ValueError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        index.close()
+
+    if args.json:
+        print(json.dumps(output, ensure_ascii=False, indent=2))
+    else:
+        for line in lines:
+            print(line)
+    return EXIT_OK
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', help="JSON配置文件，覆盖config.py中的配置")
+    common.add_argument('--url', help="maplestory.wiki物品分类链接，替代配置中的筛选参数")
+    common.add_argument('--is-cash', choices=['true', 'false', 'any'], help="按isCash筛选物品")
+    common.add_argument('--images-dir', help="图片保存目录")
+    common.add_argument('--checkpoint', help="断点记录文件")
+    common.add_argument('--fresh', action='store_true', help="不继续断点记录中未结束的任务，重新筛选所有物品")
+    common.add_argument('--engine', choices=['thread', 'asyncio'], help="下载引擎")
+    common.add_argument('--workers', type=int, help="下载线程数")
+    common.add_argument('--metrics-port', type=int, help="下载期间以Prometheus文本格式提供 /metrics 的端口")
+    common.add_argument('--log-format', choices=['text', 'json'], help="日志文件格式，json为每行一个JSON对象")
+    common.add_argument('--item-log-sample', type=int, help="每N个物品只记录一个的处理过程，警告和错误总是记录")
+
+    parser = argparse.ArgumentParser(description="冒险岛资源下载器（无交互）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    download = subparsers.add_parser('download', parents=[common], help="下载物品图标")
+    download.add_argument('--url-file', help="每行一个maplestory.wiki链接的文件，批量下载所有分类")
+    download.add_argument('--output-dir', help="批量下载的输出目录")
+    download.set_defaults(handler=cmd_download)
+
+    resume = subparsers.add_parser('resume', parents=[common],
+                                   help="继续未完成的下载，没有未完成的任务时直接退出")
+    resume.set_defaults(handler=cmd_resume)
+
+    stats = subparsers.add_parser('stats', parents=[common], help="查看断点记录中的下载进度")
+    stats.add_argument('--json', action='store_true', help="以JSON格式输出")
+    stats.set_defaults(handler=cmd_stats)
+
+    atlas = subparsers.add_parser('atlas', parents=[common], help="将已下载的图标打包为图集")
+    atlas.add_argument('--results', help="从结果文件(.json/.jsonl)读取图标，默认读取断点记录")
+    atlas.set_defaults(handler=cmd_atlas)
+
+    shard = subparsers.add_parser(
+        'shard', parents=[common],
+        help="按物品ID的哈希值分片下载，不指定--shard时在本机为每个分片启动一个进程并在结束后合并")
+    shard.add_argument('--shards', type=int, required=True, help="分片总数")
+    shard.add_argument('--shard', type=int, help="只下载这一片(从0开始)，用于在多台机器上分别运行")
+    shard.add_argument('--output-dir', help="分片下载的输出目录")
+    shard.add_argument('--no-merge', action='store_true', help="本机运行所有分片后不合并")
+    shard.set_defaults(handler=cmd_shard)
+
+    merge = subparsers.add_parser('merge', parents=[common], help="合并各分片的结果和图片")
+    merge.add_argument('--output-dir', help="分片下载的输出目录")
+    merge.add_argument('--allow-partial', action='store_true', help="缺少分片时仍然合并已有的分片")
+    merge.set_defaults(handler=cmd_merge)
+
+    delta = subparsers.add_parser(
+        'delta', parents=[common], help="与上一个CMS版本比较，只下载新增和修改的物品")
+    delta.add_argument('--previous', help="作为比较基准的旧版本，例如 CMS/201，默认为输出目录中最近的旧版本")
+    delta.add_argument('--output-dir', help="增量下载的输出目录")
+    delta.set_defaults(handler=cmd_delta)
+
+    npc = subparsers.add_parser('npc', parents=[common], help="下载NPC各个动作的全部帧")
+    npc.add_argument('--animations', help="只下载这些动作，以逗号分隔，例如 stand,say")
+    npc.add_argument('--max-frames', type=int, help="每个动作最多下载的帧数")
+    npc.add_argument('--frame-workers', type=int, help="下载帧的线程数")
+    npc.set_defaults(handler=cmd_npc)
+
+    map_parser = subparsers.add_parser(
+        'map', parents=[common], help="分块并行下载地图图片，中断后只下载缺少的块")
+    map_parser.add_argument('--minimap', action='store_true', help="下载小地图而不是完整地图")
+    map_parser.add_argument('--chunk-size-mb', type=float, help="每块的大小(MB)")
+    map_parser.add_argument('--chunk-workers', type=int, help="下载分块的线程数")
+    map_parser.set_defaults(handler=cmd_map)
+
+    index = subparsers.add_parser(
+        'index', parents=[common],
+        help="查询已下载物品的索引：stats、get ID...、search 名称、missing（与最新列表比较）、import 结果文件...")
+    index.add_argument('action', choices=['stats', 'get', 'search', 'missing', 'import'])
+    index.add_argument('terms', nargs='*', help="get的物品ID、search的名称或import的结果文件")
+    index.add_argument('--cms-version', help="只查询这个版本，例如 CMS/202；missing默认为配置中的版本")
+    index.add_argument('--limit', type=int, default=20, help="search最多返回的物品数")
+    index.add_argument('--json', action='store_true', help="以JSON格式输出")
+    index.set_defaults(handler=cmd_index)
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args = parser.parse_args(argv)
+    # shard在本机启动各分片进程时原样传递命令行参数
+    args.argv = argv
+    try:
+        apply_args(args)
+    except (OSError, ValueError) as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return EXIT_USAGE
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
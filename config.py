@@ -2,20 +2,98 @@
 COMMON_CONFIG = {
     # 请求相关配置
     'REQUEST': {
-        'MAX_RETRIES': 3,    # 请求失败最大重试次数
-        'RETRY_DELAY': 2,    # 重试间隔时间(秒)
-        'TIMEOUT': 30        # 请求超时时间(秒)
+        'MAX_RETRIES': 3,    # 单个请求最多尝试的次数
+        'RETRY_DELAY': 2,    # 重试退避的基础时间(秒)，第n次重试最多等待 RETRY_DELAY * 2^n 秒（随机抖动）
+        'MAX_RETRY_DELAY': 30,       # 单次重试最长等待时间(秒)
+        'RETRY_BUDGET_RATIO': 0.2,   # 重试预算：每个新请求可积累的重试次数
+        'RETRY_BUDGET_MIN': 10,      # 重试预算上限，也是启动时可用的重试次数
+        'TIMEOUT': 30,       # 请求超时时间(秒)
+        'CHUNK_SIZE': 65536,  # 流式下载时每次读取的字节数
+        'STREAM_LIST': True   # 边下载边解析物品列表，解析出的物品立即开始下载
     },
     # 并发配置
     'CONCURRENT': {
-        'MAX_WORKERS': 3     # 最大并发工作线程数
+        'MAX_WORKERS': 3,    # 最大并发工作线程数
+        'QUEUE_SIZE': None,  # 已提交但未完成的任务数上限，None表示下载线程数的4倍(asyncio引擎为并发请求数的2倍)
+        # 下载引擎: 'thread' - 线程池 + requests; 'asyncio' - 单线程事件循环，适合数百个并发请求
+        'ENGINE': 'thread',
+        'ASYNC_CONCURRENCY': 200,   # asyncio引擎同时进行的请求数上限
+        'ASYNC_TRANSPORT': 'auto',  # 'auto' - 已安装aiohttp时使用aiohttp，否则使用标准库实现; 'aiohttp'; 'stream'
+        'DISK_WORKERS': 4           # asyncio引擎中负责写文件的线程数
+    },
+    # 自适应并发配置 - 根据延迟和429/503/Retry-After自动调整并发数和请求速率(AIMD + 令牌桶)
+    # 启用后下载线程数取MAX_CONCURRENCY，实际同时发出的请求数由控制器决定
+    'ADAPTIVE': {
+        'ENABLED': False,
+        'MIN_CONCURRENCY': 1,      # 并发下限
+        'MAX_CONCURRENCY': 32,     # 并发上限
+        'INITIAL_CONCURRENCY': 3,  # 初始并发
+        'MAX_RATE': None,          # 请求速率上限(次/秒)，None表示只在被限流后才限制速率
+        'MIN_RATE': 1.0,           # 被限流后速率的下限(次/秒)
+        'TARGET_LATENCY': 2.0,     # 目标延迟(秒)，平均延迟超过时降低并发
+        'DECREASE_FACTOR': 0.5     # 降低并发和速率时乘以的系数
+    },
+    # 熔断配置 - 同一主机连续失败达到阈值后暂停请求，到时后放行一个探测请求
+    'CIRCUIT_BREAKER': {
+        'FAILURE_THRESHOLD': 5,  # 连续失败多少次后熔断
+        'RESET_TIMEOUT': 30      # 熔断持续时间(秒)
+    },
+    # 连接池配置 - 所有工作线程共享同一个会话和连接池
+    'CONNECTION_POOL': {
+        'POOL_SIZE': None,       # 每个主机保持的最大连接数，None表示与下载线程数一致
+        'POOL_CONNECTIONS': 10,  # 缓存的主机连接池数量
+        'POOL_BLOCK': False      # 连接池耗尽时是否阻塞等待空闲连接
+    },
+    # HTTP缓存配置 - 保存响应内容和ETag/Last-Modified，重复请求时发送条件请求
+    'HTTP_CACHE': {
+        'ENABLED': True,
+        'DIRECTORY': '.http_cache',  # 缓存目录
+        'MAX_SIZE_MB': 512           # 缓存大小上限(MB)，超出后按最近访问时间淘汰
+    },
+    # 结果输出配置 - 结果先追加写入JSON Lines文件，下载结束后再生成JSON数组文件
+    'RESULT_SINK': {
+        'BATCH_SIZE': 100,       # 每批写入的最大记录数
+        'FSYNC_INTERVAL': 5,     # fsync间隔时间(秒)
+        'FINALIZE_JSON': True    # 下载结束后是否生成原有格式的JSON数组文件
+    },
+    # 指标配置 - 记录各阶段耗时、字节数、重试和缓存命中，下载结束时输出汇总
+    'METRICS': {
+        'ENABLED': True,
+        'PORT': None,         # 以Prometheus文本格式提供 /metrics 的端口，None表示不启动
+        'HOST': '127.0.0.1'   # /metrics 监听的地址
+    },
+    # 日志配置 - 下载线程只把日志记录放入队列，由单独的线程写入日志文件和控制台
+    'LOGGING': {
+        'LEVEL': 'INFO',
+        'CONSOLE_LEVEL': 'INFO',  # 控制台输出的级别，大量并发时可设为WARNING只在日志文件中保留处理过程
+        'ITEM_LEVEL': 'INFO',     # 单个物品处理过程日志的级别，设为WARNING时只记录失败
+        'ITEM_SAMPLE': 1,         # 每N个物品只记录一个的处理过程(按ID选取)，警告和错误总是记录
+        'FORMAT': 'text',         # 日志文件格式: 'text'; 'json' - 每行一个JSON对象，含event、item_id等字段
+        'QUEUE_SIZE': 10000       # 等待写入的日志记录上限，队列已满时丢弃WARNING以下的新记录而不阻塞下载线程，警告和错误等待写入
+    },
+    # 分片配置 - 按物品ID的哈希值将物品列表分为SHARDS片，当前进程只处理第INDEX片(从0开始)
+    # cli.py shard 按参数传递各自的分片，不使用这里的配置；NPC、地图和批量下载按这里的配置只处理一片
+    'SHARDING': {
+        'SHARDS': 1,
+        'INDEX': 0
+    },
+    # 断点续传配置 - 记录每个物品的处理状态，重启后只处理未完成或失败的物品
+    'CHECKPOINT': {
+        'ENABLED': True,
+        'MAX_ATTEMPTS': 3,       # 失败物品最多尝试的次数，超过后不再自动重试
+        # 只继续尚未结束的任务，任务全部完成后下次运行重新筛选；为True时总是重新开始，不继续未结束的任务
+        'FRESH': False
     },
     # 文件处理策略
     'FILE_HANDLING': {
         # 重复文件处理策略: 'rename'(重命名) 或 'skip'(跳过) 或 'overwrite'(覆盖)
         'STRATEGY': 'rename',
         # 重命名模式，支持 {name}, {index}, {ext}
-        'RENAME_PATTERN': '{name}_{index}{ext}'
+        'RENAME_PATTERN': '{name}_{index}{ext}',
+        # 图片保存模式: 'plain'(按文件名直接保存) 或 'content'(按内容摘要去重保存到 .blobs/ 目录)
+        'STORE_MODE': 'plain',
+        # content模式下文件名的呈现方式: 'hardlink'(为每个文件名创建硬链接) 或 'manifest'(只记录到manifest.json)
+        'LINK_MODE': 'hardlink'
     }
 }
 
@@ -28,21 +106,94 @@ ITEM_CONFIG = {
             "categoryFilter": "Armor",
             "subCategoryFilter": "Cape"
         },
-        "isCash": True
+        "isCash": True,
+        "ICON_RESIZE": 4         # 图标请求的resize参数，启用VARIANTS时固定按原始尺寸(resize=1)请求
+    },
+    # 本地派生尺寸 - 每个图标只按原始尺寸下载一次，在进程池中用Pillow生成各个倍数和滤镜的版本
+    # 保存到 PATHS['VARIANTS']/<倍数>x_<滤镜>/<文件名>
+    "VARIANTS": {
+        "ENABLED": False,
+        "SIZES": [1, 2, 4],            # 相对原始尺寸的倍数
+        "FILTERS": ["nearest"],        # 重采样滤镜: nearest, box, bilinear, hamming, bicubic, lanczos
+        "PROCESSES": None              # 进程数，None表示CPU核数
+    },
+    # 重新压缩 - 下载完成后在进程池中对图标做无损PNG优化或转换为WebP/AVIF，原图保持不变
+    # 保存到 PATHS['RECOMPRESSED']/<格式>/，原图和各格式的字节数记录在该目录的 manifest.json，
+    # 并写入最终JSON结果文件中各物品的recompressed字段
+    "RECOMPRESS": {
+        "ENABLED": False,
+        "FORMATS": ["png"],            # 输出格式: png(无损优化), webp, avif
+        "WEBP_LOSSLESS": True,         # WebP是否无损
+        "WEBP_QUALITY": 90,            # 有损WebP的质量
+        "AVIF_QUALITY": 80,            # AVIF的质量
+        "PROCESSES": None              # 进程数，None表示CPU核数
+    },
+    # 物品索引 - 下载成功的物品在写入结果文件时同时写入SQLite索引(PATHS['INDEX'])，各次运行和各CMS版本共用
+    # 可按ID、名称和内容摘要查找，并与新的物品列表比较找出尚未下载的物品，见 python cli.py index
+    "INDEX": {
+        "ENABLED": True
+    },
+    # 图集 - 下载结束后将图标打包为若干张图集，生成按物品ID二分查找的索引，只重建有变化的页
+    # 保存到 PATHS['ATLAS']，读取方式见 sprite_atlas.AtlasIndex
+    "ATLAS": {
+        "ENABLED": False,
+        "MAX_SIZE": 2048,              # 单页图集的最大边长
+        "PADDING": 1,                  # 图标之间的间距
+        "PNG": True                    # 除了可内存映射的RGBA文件外，是否同时保存PNG
     },
     "PATHS": {
         "IMAGES": "cape_images",
         "LOGS": "logs",
-        "JSON_BASE": "cape_result"
+        "JSON_BASE": "cape_result",
+        "CHECKPOINT": "cape_checkpoint.db",
+        "BATCH_OUTPUT": "batch_output",  # 批量下载的输出目录，每个分类一个子目录
+        "SHARD_OUTPUT": "shard_output",  # 分片下载的输出目录，每个分片一个子目录，合并结果也保存在这里
+        "DELTA_OUTPUT": "delta_output",  # 增量下载的输出目录，每个CMS版本一个子目录
+        "VARIANTS": "cape_variants",     # 本地派生尺寸的输出目录
+        "RECOMPRESSED": "cape_optimized",  # 重新压缩的输出目录
+        "INDEX": "item_index.db",        # 物品索引，分片和增量下载也写入同一个索引
+        "ATLAS": "cape_atlas"            # 图集的输出目录
     }
 }
 
-# 游戏中NPC相关的设置
+# NPC配置 - 下载每个NPC各个动作的全部帧
 NPC_CONFIG = {
-    # TODO: 添加NPC相关配置
+    "API": {
+        "BASE_URL": "https://maplestory.io/api/CMS/202/npc/",
+        "PARAMS": {},
+        "ANIMATIONS": None,       # 下载的动作，例如 ["stand", "say"]，None表示全部
+        "MAX_FRAMES": None        # 每个动作最多下载的帧数，None表示不限制
+    },
+    # 帧下载 - 所有NPC的帧共用一个线程池，每个NPC的帧分批提交
+    "FRAMES": {
+        "WORKERS": 16,            # 下载帧的线程数，连接池大小未单独配置时为下载线程数与之的和
+        "BATCH_SIZE": 16          # 每个NPC同时下载的帧数上限
+    },
+    # 帧保存为 IMAGES/<NPC ID>_<动作>_<帧序号>.png
+    "PATHS": {
+        "IMAGES": "npc_images",
+        "JSON_BASE": "npc_result",
+        "CHECKPOINT": "npc_checkpoint.db"
+    }
 }
 
 # 地图配置 - 用于管理游戏地图相关的设置
 MAP_CONFIG = {
-    # TODO: 添加地图相关配置
+    "API": {
+        "BASE_URL": "https://maplestory.io/api/CMS/202/map/",
+        "PARAMS": {},
+        "RENDER": "render"        # 下载的图片: 'render'(完整地图) 或 'minimap'(小地图)
+    },
+    # 分块下载 - 地图按字节范围分块并行下载，每块直接写入临时文件中对应的位置，中断后只下载缺少的块
+    "CHUNKS": {
+        "SIZE_MB": 2,             # 每块的大小(MB)
+        "WORKERS": 8,             # 下载分块的线程数，所有地图共用
+        "PER_MAP": 4              # 每个地图同时下载的块数上限
+    },
+    # 地图保存为 IMAGES/<地图ID>.png，未完成的分块下载保存在 IMAGES/.ranges/
+    "PATHS": {
+        "IMAGES": "map_images",
+        "JSON_BASE": "map_result",
+        "CHECKPOINT": "map_checkpoint.db"
+    }
 }
@@ -0,0 +1,636 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import ssl
+import time
+from urllib.parse import urlsplit, urlencode
+
+from requests.structures import CaseInsensitiveDict
+
+from config import ITEM_CONFIG, COMMON_CONFIG
+from checkpoint import make_run_key, new_counts
+from item_list import JsonArrayParser, to_record
+from image_store import get_expected_length
+from rate_control import parse_retry_after, THROTTLE_STATUSES
+from retry_policy import get_retry_policy, format_retry_stats, OUTCOME_FAIL, OUTCOME_SUCCESS
+from metrics import observe_stage, stage_timer, count
+from log_queue import log_item
+from downloader.item_download import (
+    should_process_item, get_icon_url, build_result, reserve_item_filename, log_saved,
+    prepare_run, finish_run, finish_checkpoint, submit_post_processing, record_result
+)
+
+USER_AGENT = 'maplestory-wiki-crawler'
+
+# 物品列表每解析出这么多物品就写入断点记录并提交下载
+_LIST_BATCH_SIZE = 500
+
+# 没有响应体的状态码
+_NO_BODY_STATUSES = (204, 304)
+
+
+def get_async_concurrency() -> int:
+    """asyncio引擎同时进行的请求数上限"""
+    return max(1, int(COMMON_CONFIG['CONCURRENT']['ASYNC_CONCURRENCY']))
+
+
+def get_async_queue_size() -> int:
+    """已创建但未完成的任务数上限，未配置时为并发请求数的2倍"""
+    queue_size = COMMON_CONFIG['CONCURRENT']['QUEUE_SIZE']
+    if queue_size is None:
+        queue_size = get_async_concurrency() * 2
+    return max(1, int(queue_size))
+
+
+class StreamResponse:
+    """
+    StreamTransport返回的响应，响应体需要通过iter_chunks或read读取
+
+    响应体完整读完后连接放回连接池复用，提前调用close()时连接直接关闭
+    """
+
+    def __init__(self, transport, key, reader, writer, status: int, headers, keep_alive: bool):
+        self.status = status
+        self.headers = headers
+        self._transport = transport
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self._keep_alive = keep_alive
+        self._done = False
+
+    async def _read(self, size: int) -> bytes:
+        data = await asyncio.wait_for(self._reader.read(size), self._transport.timeout)
+        if not data:
+            raise ConnectionResetError("Connection closed before the response body was complete")
+        return data
+
+    async def _readline(self) -> bytes:
+        line = await asyncio.wait_for(self._reader.readline(), self._transport.timeout)
+        if not line:
+            raise ConnectionResetError("Connection closed before the response body was complete")
+        return line
+
+    async def _iter_body(self, chunk_size: int):
+        """逐块读取响应体，支持Content-Length、chunked和以关闭连接结束的响应"""
+        length = self.headers.get('Content-Length')
+
+        if self.status in _NO_BODY_STATUSES:
+            pass
+        elif 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            while True:
+                size = int((await self._readline()).split(b';')[0].strip(), 16)
+                if size == 0:
+                    # 跳过trailer直到空行
+                    while (await self._readline()).strip():
+                        pass
+                    break
+                while size:
+                    data = await self._read(min(chunk_size, size))
+                    size -= len(data)
+                    yield data
+                await self._readline()
+        elif length is not None:
+            remaining = int(length)
+            while remaining:
+                data = await self._read(min(chunk_size, remaining))
+                remaining -= len(data)
+                yield data
+        else:
+            self._keep_alive = False
+            while True:
+                data = await asyncio.wait_for(
+                    self._reader.read(chunk_size), self._transport.timeout)
+                if not data:
+                    break
+                yield data
+
+    async def iter_chunks(self, chunk_size: int):
+        """
+        逐块读取响应体
+
+        最后一块在交给调用方之前连接就已放回连接池，调用方读到最后一块后不再继续迭代时连接也能复用
+        """
+        if self._done:
+            return
+        pending = None
+        async for data in self._iter_body(chunk_size):
+            if pending is not None:
+                yield pending
+            pending = data
+        self._release()
+        if pending is not None:
+            yield pending
+
+    def _release(self):
+        self._done = True
+        writer, self._writer = self._writer, None
+        if writer is None:
+            return
+        if self._keep_alive:
+            self._transport._release(self._key, self._reader, writer)
+        else:
+            writer.close()
+
+    async def read(self) -> bytes:
+        return b''.join([chunk async for chunk in self.iter_chunks(COMMON_CONFIG['REQUEST']['CHUNK_SIZE'])])
+
+    def close(self):
+        """放弃未读完的响应体，连接无法复用，直接关闭；响应体已读完时连接已放回连接池，不做处理"""
+        self._done = True
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+
+class StreamTransport:
+    """
+    基于asyncio.open_connection的HTTP/1.1客户端，只依赖标准库
+
+    按主机保持keep-alive连接池，响应体读完后连接放回池中复用
+
+    Args:
+        limit: 每个主机保留的空闲连接数上限
+        timeout: 建立连接和每次读取的超时时间(秒)
+    """
+
+    name = 'stream'
+    # 视为网络错误、可以重试的异常
+    errors = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError)
+
+    def __init__(self, limit: int, timeout: float):
+        self.limit = limit
+        self.timeout = timeout
+        self.stats = {'requests': 0, 'connections': 0}
+        self._idle = {}
+        self._ssl = None
+
+    def _release(self, key, reader, writer):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.limit and not reader.at_eof():
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl is None:
+                self._ssl = ssl.create_default_context()
+            ssl_context = self._ssl
+        self.stats['connections'] += 1
+        with stage_timer('http_connect'):
+            return await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=ssl_context), self.timeout)
+
+    async def get(self, url: str, params: dict = None, headers: dict = None) -> StreamResponse:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        target = parts.path or '/'
+        query = parts.query
+        if params:
+            query = f"{query}&{urlencode(params)}" if query else urlencode(params)
+        if query:
+            target = f"{target}?{query}"
+
+        lines = [f"GET {target} HTTP/1.1", f"Host: {parts.netloc}", f"User-Agent: {USER_AGENT}",
+                 "Accept: */*", "Accept-Encoding: identity", "Connection: keep-alive"]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        while True:
+            idle = self._idle.get(key)
+            reused = bool(idle)
+            reader, writer = idle.pop() if reused else await self._connect(key)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not status_line:
+                    raise ConnectionResetError("Connection closed by server")
+                version, status = status_line.decode('latin-1').split(None, 2)[:2]
+                response_headers = CaseInsensitiveDict()
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), self.timeout)
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    response_headers[name.strip()] = value.strip()
+            except (OSError, asyncio.IncompleteReadError):
+                writer.close()
+                # 复用的空闲连接可能已被服务器关闭，换一个连接重发
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        self.stats['requests'] += 1
+        connection = response_headers.get('Connection', '').lower()
+        keep_alive = connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
+        return StreamResponse(self, key, reader, writer, int(status), response_headers, keep_alive)
+
+    def format_stats(self) -> str:
+        requests = self.stats['requests']
+        reused = max(0, requests - self.stats['connections'])
+        ratio = reused / requests if requests else 0.0
+        return (f"{requests} requests over {self.stats['connections']} connections, "
+                f"{reused} reused ({ratio:.1%})")
+
+    async def close(self):
+        for idle in self._idle.values():
+            for reader, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class AiohttpResponse:
+    """将aiohttp的响应包装为与StreamResponse相同的接口"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status = response.status
+        self.headers = response.headers
+
+    async def iter_chunks(self, chunk_size: int):
+        async for chunk in self._response.content.iter_chunked(chunk_size):
+            yield chunk
+        self._response.release()
+
+    async def read(self) -> bytes:
+        return await self._response.read()
+
+    def close(self):
+        self._response.release()
+
+
+class AiohttpTransport:
+    """
+    基于aiohttp的传输层，需要安装aiohttp
+
+    Args:
+        limit: 同时打开的连接数上限
+        timeout: 建立连接和每次读取的超时时间(秒)
+    """
+
+    name = 'aiohttp'
+
+    def __init__(self, limit: int, timeout: float):
+        import aiohttp
+        self._aiohttp = aiohttp
+        self.errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        self.limit = limit
+        self.timeout = timeout
+        self.stats = {'requests': 0}
+        self._session = None
+
+    async def get(self, url: str, params: dict = None, headers: dict = None) -> AiohttpResponse:
+        # 会话需要在事件循环中创建
+        if self._session is None:
+            aiohttp = self._aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout),
+                headers={'User-Agent': USER_AGENT})
+        self.stats['requests'] += 1
+        return AiohttpResponse(await self._session.get(url, params=params, headers=headers))
+
+    def format_stats(self) -> str:
+        return f"{self.stats['requests']} requests"
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def get_transport(name: str = None):
+    """
+    按配置创建asyncio引擎使用的HTTP传输层
+
+    传输层需要提供 get(url, params, headers) 协程、errors 异常元组、format_stats() 和 close() 协程，
+    get返回的响应需要有 status、headers、iter_chunks(chunk_size)、read() 和 close()
+
+    Args:
+        name: 'auto'、'aiohttp' 或 'stream'，默认读取配置
+    """
+    if name is None:
+        name = COMMON_CONFIG['CONCURRENT']['ASYNC_TRANSPORT']
+    if name == 'auto':
+        try:
+            import aiohttp  # noqa: F401
+            name = 'aiohttp'
+        except ImportError:
+            name = 'stream'
+
+    limit = get_async_concurrency()
+    timeout = COMMON_CONFIG['REQUEST']['TIMEOUT']
+    if name == 'aiohttp':
+        return AiohttpTransport(limit, timeout)
+    if name == 'stream':
+        return StreamTransport(limit, timeout)
+    raise ValueError(f"未知的传输层: {name}")
+
+
+async def async_request(transport, url: str, params: dict = None):
+    """
+    safe_request的异步版本，使用相同的重试策略（退避、重试预算、熔断器）
+
+    Returns:
+        成功(2xx)的响应，失败时返回None
+    """
+    policy = get_retry_policy()
+    breaker = policy.admit(url)
+    if breaker is None:
+        return None
+
+    # 与safe_request相同，未处理的异常和任务取消也计为一次失败
+    try:
+        for attempt in range(policy.max_attempts):
+            retry_after = status = None
+            try:
+                sent = time.perf_counter()
+                response = await transport.get(url, params=params)
+                observe_stage('http_ttfb', time.perf_counter() - sent)
+                status = response.status
+                count('responses', status=status)
+                outcome = policy.judge_status(breaker, url, status)
+                if outcome == OUTCOME_SUCCESS:
+                    return response
+
+                if status in THROTTLE_STATUSES:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.close()
+                if outcome == OUTCOME_FAIL:
+                    return None
+                error = f"HTTP {status}"
+
+            except transport.errors as e:
+                error = str(e) or type(e).__name__
+
+            delay = policy.retry_delay(attempt, breaker, url, error, status, retry_after)
+            if delay is None:
+                return None
+            await asyncio.sleep(delay)
+        return None
+    except BaseException:
+        breaker.record_failure()
+        raise
+
+
+async def process_item_async(transport, item, index, total, store, names, request_slots, disk_executor,
+                             api=None):
+    """
+    process_single_item的异步版本
+
+    图标在请求并发限制内读入内存，写文件交给disk_executor中的线程，不阻塞事件循环
+    """
+    try:
+        total = '?' if total is None else total
+
+        if not should_process_item(item, api):
+            log_item(logging.INFO,
+                     f"Skipping {index}/{total}: ID={item.id}, Name={item.name} (isCash={item.is_cash})",
+                     item.id, 'filtered')
+            return None
+
+        log_item(logging.INFO,
+                 f"Processing {index}/{total}: ID={item.id}, Name={item.name}, isCash={item.is_cash}",
+                 item.id, 'processing', index=index)
+
+        filename, reserved = reserve_item_filename(item, names)
+        if filename is None:
+            return build_result(item, 'skipped', 'File already exists')
+
+        detail_url = get_icon_url(item.id, api)
+        try:
+            async with request_slots:
+                detail_response = await async_request(transport, detail_url)
+                if detail_response is not None:
+                    start = time.perf_counter()
+                    try:
+                        chunks = [chunk async for chunk in detail_response.iter_chunks(
+                            COMMON_CONFIG['REQUEST']['CHUNK_SIZE'])]
+                    finally:
+                        detail_response.close()
+                    observe_stage('http_body', time.perf_counter() - start)
+                    count('bytes', sum(map(len, chunks)), source='icon')
+
+            if detail_response is None:
+                log_item(logging.ERROR, f"✗ Failed to fetch details for item {item.id} ({item.name})",
+                         item.id, 'failed', reason='fetch')
+                if reserved:
+                    names.release(filename)
+                return build_result(item, 'failed', 'Network error during fetch')
+
+            # 包含在disk_executor中排队的时间
+            start = time.perf_counter()
+            saved = await asyncio.get_running_loop().run_in_executor(
+                disk_executor, store.save_stream, chunks, filename,
+                get_expected_length(detail_response))
+            observe_stage('disk_write', time.perf_counter() - start)
+            log_saved(item, filename, reserved, saved)
+            return build_result(item, 'success', filename=filename,
+                                image_url=detail_url, sha256=saved['sha256'])
+
+        except Exception as e:
+            log_item(logging.ERROR, f"✗ Error saving image {item.name}: {str(e)}", item.id, 'failed',
+                     reason='save')
+            if reserved:
+                names.release(filename)
+            return build_result(item, 'failed', f'Image save error: {str(e)}')
+
+    except Exception as e:
+        log_item(logging.ERROR, f"✗ Unexpected error processing item {index}: {str(e)}",
+                 getattr(item, 'id', None), 'failed', reason='unexpected')
+        return {
+            'id': getattr(item, 'id', 'unknown'),
+            'name': getattr(item, 'name', 'unknown'),
+            'isCash': getattr(item, 'is_cash', False),
+            'status': 'failed',
+            'reason': f'Unexpected error: {str(e)}'
+        }
+
+
+async def _iter_resumed(items):
+    yield items
+
+
+async def _iter_list_batches(response, checkpoint, run_key, counts, api, executor):
+    """边下载边解析物品列表，按批写入断点记录并返回需要处理的物品，断点记录的读写在executor中执行"""
+    loop = asyncio.get_running_loop()
+    max_attempts = COMMON_CONFIG['CHECKPOINT']['MAX_ATTEMPTS']
+    parser = JsonArrayParser()
+    position = 0
+    batch = []
+
+    def flush(batch):
+        nonlocal position
+        if checkpoint is None:
+            return batch
+        position = checkpoint.append_item_list(run_key, batch, position)
+        return checkpoint.select_items(batch, max_attempts, counts)
+
+    try:
+        if checkpoint is not None:
+            await loop.run_in_executor(executor, checkpoint.begin_item_list, run_key, api['PARAMS'])
+        async for chunk in response.iter_chunks(COMMON_CONFIG['REQUEST']['CHUNK_SIZE']):
+            count('bytes', len(chunk), source='list')
+            values = parser.feed(chunk)
+            batch.extend(item for item in map(to_record, values) if should_process_item(item, api))
+            if len(batch) >= _LIST_BATCH_SIZE:
+                yield await loop.run_in_executor(executor, flush, batch)
+                batch = []
+        # 数组结束后仍读到响应末尾，连接才能放回连接池
+        batch.extend(item for item in map(to_record, parser.close()) if should_process_item(item, api))
+        if batch:
+            yield await loop.run_in_executor(executor, flush, batch)
+        if checkpoint is not None:
+            await loop.run_in_executor(executor, checkpoint.complete_item_list, run_key)
+    finally:
+        response.close()
+
+
+def _load_resumed_items(checkpoint, run_key, counts, api):
+    """
+    开始或继续断点记录中的任务，任务未结束时从保存的列表中筛选出需要处理的物品
+
+    Returns:
+        list: 需要处理的物品，需要重新获取列表时返回None
+    """
+    max_attempts = COMMON_CONFIG['CHECKPOINT']['MAX_ATTEMPTS']
+    resuming = checkpoint.start_run(run_key, api['PARAMS'], COMMON_CONFIG['CHECKPOINT']['FRESH'])
+    items = checkpoint.load_item_list(run_key) if resuming else None
+    if items is None or not checkpoint.has_unfinished(run_key, max_attempts):
+        return None
+    logging.info(
+        f"Resuming unfinished crawl, reusing {checkpoint.count_items(run_key)} items "
+        f"from {checkpoint.path}")
+    # 与重新获取列表时使用相同的筛选
+    items = (item for item in items if should_process_item(item, api))
+    return list(checkpoint.iter_scheduled(items, max_attempts, counts))
+
+
+async def load_items_async(transport, checkpoint, counts, api, executor):
+    """
+    load_items的异步版本，物品列表始终边下载边解析
+
+    断点记录的SQLite读写都在executor中执行，不阻塞事件循环
+
+    Args:
+        api: 接口配置，见should_process_item
+        executor: 执行断点记录读写的线程池，例如写文件的线程池
+
+    Returns:
+        tuple: (按批返回待处理物品列表的异步迭代器, 物品总数)，总数未知时为None；请求失败时返回 (None, None)
+    """
+    run_key = None
+    if checkpoint is not None:
+        run_key = make_run_key(checkpoint.cms_version, api['PARAMS'], api['isCash'])
+        items = await asyncio.get_running_loop().run_in_executor(
+            executor, _load_resumed_items, checkpoint, run_key, counts, api)
+        if items is not None:
+            return _iter_resumed(items), len(items)
+
+    logging.info(f"Fetching items from: {api['BASE_URL']}")
+    with stage_timer('list_fetch'):
+        response = await async_request(transport, api['BASE_URL'], params=api['PARAMS'])
+    if response is None:
+        return None, None
+
+    if api['isCash'] is not None:
+        logging.info(f"Filtering items with isCash={api['isCash']}")
+    return _iter_list_batches(response, checkpoint, run_key, counts, api, executor), None
+
+
+async def fetch_and_process_items_async(transport=None, paths: dict = None, api: dict = None):
+    """
+    asyncio引擎：单个线程中同时进行数百个请求，写文件交给独立的线程池
+
+    与线程池引擎共用断点记录、图片存储、文件名索引和结果文件，重试策略相同；
+    HTTP缓存和自适应并发控制依赖requests和线程，这个引擎中不启用，并发由ASYNC_CONCURRENCY限制
+
+    Args:
+        transport: HTTP传输层，默认按ASYNC_TRANSPORT配置创建
+        paths: 结构与ITEM_CONFIG['PATHS']相同的路径配置，默认使用ITEM_CONFIG['PATHS']
+        api: 接口配置，见should_process_item，默认使用ITEM_CONFIG['API']
+    """
+    api = api or ITEM_CONFIG['API']
+    json_filename, jsonl_filename, sink, checkpoint, store, names, post = prepare_run(paths)
+    counts = new_counts()
+    if transport is None:
+        transport = get_transport()
+    logging.info(f"Using asyncio engine with {transport.name} transport, "
+                 f"{get_async_concurrency()} concurrent requests")
+
+    loop = asyncio.get_running_loop()
+    request_slots = asyncio.Semaphore(get_async_concurrency())
+    # 限制已创建但未完成的任务数，列表边解析边提交，内存占用不随物品数增长
+    task_slots = asyncio.Semaphore(get_async_queue_size())
+    disk_executor = ThreadPoolExecutor(
+        max_workers=COMMON_CONFIG['CONCURRENT']['DISK_WORKERS'], thread_name_prefix='disk')
+    pending = set()
+
+    async def run_item(item, index, total, submitted):
+        started = time.perf_counter()
+        observe_stage('queue_wait', started - submitted)
+        try:
+            result = await process_item_async(
+                transport, item, index, total, store, names, request_slots, disk_executor, api)
+            observe_stage('item_total', time.perf_counter() - started)
+            if result:
+                await loop.run_in_executor(disk_executor, record_result, result, sink, checkpoint)
+                # 处理队列已满时submit会阻塞，放到线程中等待
+                await loop.run_in_executor(disk_executor, submit_post_processing, post, store, result)
+        except Exception as e:
+            logging.error(f"Error processing task: {str(e)}")
+        finally:
+            task_slots.release()
+
+    try:
+        batches, total_items = await load_items_async(transport, checkpoint, counts, api, disk_executor)
+        if batches is None:
+            logging.error("Failed to fetch initial items list")
+            return False
+
+        if total_items is not None:
+            logging.info(f"Found {total_items} items to process")
+        else:
+            logging.info("Streaming items list, downloads start as items arrive")
+
+        scheduled = 0
+        async for batch in batches:
+            for item in batch:
+                await task_slots.acquire()
+                scheduled += 1
+                task = asyncio.create_task(
+                    run_item(item, scheduled, total_items, time.perf_counter()))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+
+        logging.info(f"All tasks completed! {scheduled} items scheduled")
+        await loop.run_in_executor(disk_executor, finish_checkpoint, checkpoint, counts)
+        logging.info(f"Transport: {transport.format_stats()}")
+        logging.info(f"Retries: {format_retry_stats()}")
+        logging.info(f"Image store: {store.format_stats()}")
+        return True
+
+    except Exception as e:
+        logging.error(f"Critical error in main process: {str(e)}")
+        logging.error(
+            f"Program will exit, but processed items have been saved to {jsonl_filename}")
+        return False
+
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        await transport.close()
+        disk_executor.shutdown(wait=True)
+        finish_run(json_filename, jsonl_filename, sink, checkpoint, store, post, paths)
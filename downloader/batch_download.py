@@ -0,0 +1,283 @@
+from datetime import datetime
+import json
+import logging
+import os
+import re
+import threading
+
+from config import ITEM_CONFIG, COMMON_CONFIG
+from utils import (
+    setup_logging, ensure_directory, parse_maplestory_url_params, detect_config_type,
+    get_api_version, get_item_api
+)
+from http_client import format_pool_stats
+from http_cache import format_cache_stats
+from result_sink import ResultSink, get_jsonl_filename
+from image_store import ImageStore
+from filename_index import FilenameIndex
+from item_index import open_index_writer
+from checkpoint import new_counts
+from rate_control import format_limiter_stats
+from retry_policy import format_retry_stats
+from metrics import reset_metrics, start_metrics_server, stop_metrics_server, log_metrics_summary
+from downloader.item_download import (
+    open_checkpoint, load_items, process_single_item, run_bounded, record_result, open_post_processors,
+    submit_post_processing
+)
+
+BATCH_MANIFEST_FILE = 'batch_manifest.json'
+
+_UNSAFE_CHARS = re.compile(r'[^\w.-]+')
+
+
+def read_url_file(path: str) -> list:
+    """
+    读取URL列表文件，每行一个URL，忽略空行和以#开头的注释
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith('#')]
+
+
+def get_category_name(api: dict) -> str:
+    """根据筛选参数生成分类目录名，例如 Armor_Cape_cash"""
+    params = api['PARAMS']
+    parts = [params.get('categoryFilter'), params.get('subCategoryFilter')]
+    name = '_'.join(part for part in parts if part) or 'items'
+    if api['isCash'] is not None:
+        name += '_cash' if api['isCash'] else '_noncash'
+    return _UNSAFE_CHARS.sub('-', name).strip('-')
+
+
+class Category:
+    """
+    批量下载中的单个分类，拥有独立的图片目录、文件名索引、图片清单和结果文件
+
+    Args:
+        url: 分类对应的wiki链接
+        api: 结构与ITEM_CONFIG['API']相同的接口配置
+        directory: 分类的输出目录
+        timestamp: 结果文件名中的时间戳
+    """
+
+    def __init__(self, url: str, api: dict, directory: str, timestamp: str):
+        self.url = url
+        self.api = api
+        self.name = os.path.basename(directory)
+        self.directory = directory
+        self.images_dir = os.path.join(directory, 'images')
+        self.json_filename = os.path.join(directory, f'result_{timestamp}.json')
+        self.jsonl_filename = get_jsonl_filename(self.json_filename)
+        self.counts = new_counts()
+        self.results = {}
+        self.scheduled = 0
+        self.duplicates = 0
+        self.list_failed = False
+        self.sink = self.store = self.names = self.post = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        ensure_directory(self.images_dir)
+        self.sink = ResultSink(self.jsonl_filename,
+                               listeners=[open_index_writer(self.api, self.images_dir)])
+        self.store = ImageStore(self.images_dir)
+        self.store.cleanup_partials()
+        self.names = FilenameIndex(self.images_dir, self.store.names())
+        self.post = open_post_processors(self.directory)
+
+    def record(self, result: dict, checkpoint=None):
+        record_result(result, self.sink, checkpoint)
+        submit_post_processing(self.post, self.store, result)
+        with self._lock:
+            self.results[result['status']] = self.results.get(result['status'], 0) + 1
+
+    def close(self):
+        if self.sink is None:
+            return
+        if self.post is not None:
+            self.post.close()
+        self.store.close()
+        if COMMON_CONFIG['RESULT_SINK']['FINALIZE_JSON']:
+            self.sink.finalize(self.json_filename, self.post.annotate if self.post is not None else None)
+        else:
+            self.sink.close()
+
+    def summary(self) -> dict:
+        return {
+            'name': self.name,
+            'url': self.url,
+            'params': self.api['PARAMS'],
+            'isCash': self.api['isCash'],
+            'directory': self.directory,
+            'results': self.json_filename if COMMON_CONFIG['RESULT_SINK']['FINALIZE_JSON']
+            else self.jsonl_filename,
+            'list_failed': self.list_failed,
+            'scheduled': self.scheduled,
+            'duplicates': self.duplicates,
+            'statuses': self.results,
+            'checkpoint': self.counts
+        }
+
+
+def resolve_categories(urls: list, output_dir: str, timestamp: str) -> list:
+    """
+    解析wiki链接，生成需要下载的分类；暂不支持的类型和无法解析的链接写入日志后跳过
+    """
+    categories = []
+    used_names = set()
+    for url in urls:
+        try:
+            config_type = detect_config_type(url)
+            if config_type != 'item':
+                logging.warning(f"Skipping {url}: {config_type} downloads are not supported yet")
+                continue
+            params, is_cash = parse_maplestory_url_params(url)
+        except ValueError as e:
+            logging.error(f"Skipping {url}: {str(e)}")
+            continue
+
+        api = get_item_api(url, params, is_cash)
+        name = base_name = get_category_name(api)
+        index = 1
+        while name in used_names:
+            index += 1
+            name = f"{base_name}_{index}"
+        used_names.add(name)
+        categories.append(Category(url, api, os.path.join(output_dir, name), timestamp))
+    return categories
+
+
+def write_batch_manifest(output_dir: str, timestamp: str, categories: list):
+    """在输出目录写入本次批量下载的分类清单"""
+    manifest = {
+        'timestamp': timestamp,
+        'categories': [category.summary() for category in categories]
+    }
+    path = os.path.join(output_dir, BATCH_MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _skip_seen(items, seen_ids: set, category: Category):
+    """跳过前面的分类中已经出现过的物品"""
+    for item in items:
+        if item.id in seen_ids:
+            category.duplicates += 1
+            continue
+        seen_ids.add(item.id)
+        yield item
+
+
+def _process_category_item(category, checkpoint, item, index, total):
+    """在下载线程中处理一个分类中的物品，结果连同所属分类一起返回"""
+    result = process_single_item(item, index, total, category.store, category.names, category.api)
+    return (category, checkpoint, result) if result else None
+
+
+def _record_category_result(task_result):
+    category, checkpoint, result = task_result
+    category.record(result, checkpoint)
+
+
+def fetch_categories(categories: list, output_dir: str):
+    """
+    所有分类共用一个线程池、连接池和断点记录，按顺序获取各分类的物品列表并提交下载；
+    列表边解析边提交，前一个分类的图标下载与后一个分类的列表请求同时进行。
+    多个分类中出现的同一物品只在第一个分类中下载。
+    """
+    checkpoints = {}
+    checkpoint_path = os.path.join(output_dir, ITEM_CONFIG['PATHS']['CHECKPOINT'])
+    max_attempts = COMMON_CONFIG['CHECKPOINT']['MAX_ATTEMPTS']
+    seen_ids = set()
+
+    def iter_tasks():
+        for category in categories:
+            logging.info(f"=== Category {category.name}: {category.url} ===")
+            category.open()
+
+            # 断点记录按CMS版本区分，不同版本的分类使用各自的记录
+            version = get_api_version(category.api['BASE_URL'])
+            if version not in checkpoints:
+                checkpoints[version] = open_checkpoint(checkpoint_path, category.api)
+            checkpoint = checkpoints[version]
+
+            items, total = load_items(checkpoint, category.api)
+            if items is None:
+                logging.error(f"Failed to fetch items list for {category.name}")
+                category.list_failed = True
+                continue
+            items = _skip_seen(items, seen_ids, category)
+            if checkpoint is not None:
+                items = checkpoint.iter_scheduled(items, max_attempts, category.counts)
+
+            for item in items:
+                category.scheduled += 1
+                yield category, checkpoint, item, category.scheduled, total
+            if category.duplicates:
+                logging.info(
+                    f"{category.duplicates} items in {category.name} already scheduled "
+                    f"by earlier categories")
+
+    try:
+        run_bounded(iter_tasks(), _process_category_item, _record_category_result)
+        for checkpoint in checkpoints.values():
+            if checkpoint is not None:
+                checkpoint.finish_runs(max_attempts)
+    finally:
+        for category in categories:
+            category.close()
+        for checkpoint in checkpoints.values():
+            if checkpoint is not None:
+                checkpoint.close()
+
+
+def start_batch_download(url_file: str, output_dir: str = None) -> bool:
+    """
+    批量下载URL列表文件中的所有分类
+
+    每个分类的图片和结果文件保存在 <输出目录>/<分类名>/ 下，输出目录中另有batch_manifest.json记录各分类的统计
+
+    Args:
+        url_file: 每行一个maplestory.wiki链接的文本文件
+        output_dir: 输出目录，默认为ITEM_CONFIG['PATHS']['BATCH_OUTPUT']
+
+    Returns:
+        bool: 没有可下载的分类、有分类的物品列表获取失败或出现严重错误时为False
+    """
+    setup_logging()
+    output_dir = output_dir or ITEM_CONFIG['PATHS']['BATCH_OUTPUT']
+    ensure_directory(output_dir)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    categories = resolve_categories(read_url_file(url_file), output_dir, timestamp)
+    if not categories:
+        logging.error(f"No supported URLs found in {url_file}")
+        return False
+    logging.info(f"Batch download of {len(categories)} categories into {output_dir}")
+    reset_metrics()
+    start_metrics_server()
+
+    ok = True
+    try:
+        fetch_categories(categories, output_dir)
+    except Exception as e:
+        logging.error(f"Critical error in batch download: {str(e)}")
+        ok = False
+    finally:
+        manifest = write_batch_manifest(output_dir, timestamp, categories)
+
+    for category in categories:
+        statuses = ', '.join(f"{count} {status}" for status, count in sorted(category.results.items()))
+        logging.info(f"{category.name}: {category.scheduled} scheduled, "
+                     f"{category.duplicates} duplicates ({statuses or 'no results'})")
+    logging.info(f"Connection pool: {format_pool_stats()}")
+    logging.info(f"HTTP cache: {format_cache_stats()}")
+    logging.info(f"Rate control: {format_limiter_stats()}")
+    logging.info(f"Retries: {format_retry_stats()}")
+    log_metrics_summary()
+    stop_metrics_server()
+    logging.info(f"Batch manifest saved to {manifest}")
+    return ok and not any(category.list_failed for category in categories)
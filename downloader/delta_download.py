@@ -0,0 +1,353 @@
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from config import ITEM_CONFIG, COMMON_CONFIG
+from utils import safe_request, get_api_version, get_icon_resize
+from result_sink import iter_jsonl
+from checkpoint import (
+    CheckpointStore, make_run_key, new_counts, STATUS_SUCCESS, STATUS_SKIPPED, STATUS_FAILED
+)
+from item_list import iter_json_array, to_record
+from image_store import ImageStore
+from metrics import ChunkTimer, stage_timer
+from downloader.item_download import (
+    should_process_item, get_icon_url, build_result, prepare_run, finish_run, process_single_item,
+    run_bounded, record_result, submit_post_processing, log_checkpoint_counts
+)
+
+SNAPSHOT_PREFIX = 'snapshot_'
+CHANGES_PREFIX = 'changes_'
+
+
+def get_list_key(api: dict = None) -> str:
+    """与CMS版本无关的物品列表标识，同一筛选条件在不同版本中的快照使用相同的标识"""
+    api = api or ITEM_CONFIG['API']
+    return make_run_key('', api['PARAMS'], api['isCash'])[:16]
+
+
+def get_version_dir(output_dir: str, cms_version: str) -> str:
+    """某个CMS版本的输出目录，例如 delta_output/CMS_202"""
+    return os.path.join(output_dir, cms_version.replace('/', '_'))
+
+
+def get_snapshot_path(version_dir: str, list_key: str) -> str:
+    return os.path.join(version_dir, f"{SNAPSHOT_PREFIX}{list_key}.jsonl")
+
+
+def version_sort_key(cms_version: str) -> tuple:
+    """按区服和数字版本号排序，例如 CMS/99 < CMS/202"""
+    region, _, number = cms_version.partition('/')
+    return (region, int(number) if number.isdigit() else -1, number)
+
+
+def fingerprint(item: dict) -> str:
+    """物品元数据的摘要，字段顺序不影响结果"""
+    payload = json.dumps(item, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def find_previous_version(output_dir: str, cms_version: str, list_key: str):
+    """
+    查找同一区服、同一筛选条件下最近的一个旧版本快照
+
+    Returns:
+        str: 旧版本，例如 'CMS/201'；没有时返回None
+    """
+    if not os.path.isdir(output_dir):
+        return None
+    region = cms_version.partition('/')[0]
+    current = version_sort_key(cms_version)
+    candidates = []
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            version = entry.name.replace('_', '/', 1)
+            if (entry.is_dir() and version.partition('/')[0] == region
+                    and version_sort_key(version) < current
+                    and os.path.exists(get_snapshot_path(entry.path, list_key))):
+                candidates.append(version)
+    return max(candidates, key=version_sort_key) if candidates else None
+
+
+def load_snapshot(path: str) -> dict:
+    """
+    读取快照
+
+    Returns:
+        dict: 物品ID -> 快照记录 {'id', 'name', 'isCash', 'fingerprint', 'item', 'status', 'filename', 'sha256'}
+    """
+    return {entry['id']: entry for entry in iter_jsonl(path)}
+
+
+def fetch_item_list(api: dict = None):
+    """
+    获取完整的物品列表，保留每个物品的全部元数据，只返回符合筛选条件的物品
+
+    Returns:
+        list: API返回的物品字典；请求失败时返回None
+    """
+    api = api or ITEM_CONFIG['API']
+    logging.info(f"Fetching items from: {api['BASE_URL']}")
+    with stage_timer('list_fetch'):
+        response = safe_request(api['BASE_URL'], params=api['PARAMS'], stream=True)
+    if response is None:
+        return None
+    with response:
+        chunks = ChunkTimer(response.iter_content(COMMON_CONFIG['REQUEST']['CHUNK_SIZE']),
+                            'list', 'list_body')
+        return [item for item in iter_json_array(chunks, response.encoding or 'utf-8')
+                if should_process_item(to_record(item), api)]
+
+
+def diff_items(previous: dict, items: list) -> dict:
+    """
+    按物品ID比较新旧两个版本的物品列表
+
+    名称或任意元数据不同的物品视为已修改；旧版本中下载失败的未修改物品需要重新下载，归入retry
+
+    Returns:
+        dict: {'added': [物品], 'changed': [(物品, 变化的字段)], 'unchanged': [物品],
+               'retry': [物品], 'removed': [旧快照记录]}
+    """
+    diff = {'added': [], 'changed': [], 'unchanged': [], 'retry': [], 'removed': []}
+    seen = set()
+    for item in items:
+        seen.add(item['id'])
+        old = previous.get(item['id'])
+        if old is None:
+            diff['added'].append(item)
+        elif old['fingerprint'] != fingerprint(item):
+            fields = sorted(key for key in set(old['item']) | set(item)
+                            if old['item'].get(key) != item.get(key))
+            diff['changed'].append((item, fields))
+        elif old.get('status') != STATUS_SUCCESS:
+            diff['retry'].append(item)
+        else:
+            diff['unchanged'].append(item)
+    diff['removed'] = [entry for item_id, entry in previous.items() if item_id not in seen]
+    return diff
+
+
+def link_unchanged(items: list, previous: dict, previous_version: str, previous_store,
+                   store, names, checkpoint, sink, post) -> tuple:
+    """
+    将未修改物品的图标从旧版本以硬链接（或复制）带到新版本，保留原来的文件名
+
+    Returns:
+        tuple: (旧版本中找不到图标文件、需要重新下载的物品, 链接的物品数)
+    """
+    missing = []
+    linked = 0
+    for item in items:
+        old = previous[item['id']]
+        source = previous_store.path_of(old['filename'])
+        if not os.path.exists(source):
+            missing.append(item)
+            continue
+
+        filename = old['filename']
+        target = os.path.join(store.directory, filename)
+        # 续传时文件名可能已经在上次运行中链接过来
+        if not names.claim(filename) and not (
+                os.path.exists(target) and os.path.samefile(source, target)):
+            filename, _ = names.reserve(os.path.splitext(filename)[0])
+            if filename is None:
+                missing.append(item)
+                continue
+        saved = store.import_file(source, filename, old.get('sha256'))
+        result = build_result(to_record(item), STATUS_SUCCESS, filename=filename,
+                              image_url=get_icon_url(item['id']), sha256=saved['sha256'],
+                              linked_from=previous_version)
+        record_result(result, sink, checkpoint)
+        submit_post_processing(post, store, result)
+        linked += 1
+    return missing, linked
+
+
+def download_items(items: list, store, names, checkpoint, sink, post) -> dict:
+    """
+    用线程池下载物品图标
+
+    Returns:
+        dict: 各结果状态的物品数
+    """
+    statuses = {}
+    lock = threading.Lock()
+
+    def handle_result(result):
+        record_result(result, sink, checkpoint)
+        submit_post_processing(post, store, result)
+        with lock:
+            statuses[result['status']] = statuses.get(result['status'], 0) + 1
+
+    run_bounded(((to_record(item), index, len(items), store, names)
+                 for index, item in enumerate(items, 1)),
+                process_single_item, handle_result)
+    return statuses
+
+
+def write_snapshot(path: str, items: list, checkpoint):
+    """
+    写入当前版本的快照：完整的物品元数据，以及断点记录中各物品最近一次的下载结果
+    """
+    results = {result['id']: result for result in checkpoint.iter_results(
+        statuses=(STATUS_SUCCESS, STATUS_SKIPPED, STATUS_FAILED))}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for item in items:
+            result = results.get(item['id'], {})
+            entry = {
+                'id': item['id'],
+                'name': item.get('name'),
+                'isCash': item.get('isCash', False),
+                'fingerprint': fingerprint(item),
+                'item': item,
+                'status': result.get('status'),
+                'filename': result.get('filename'),
+                'sha256': result.get('sha256'),
+            }
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def write_change_report(version_dir: str, previous_version, cms_version: str,
+                        diff: dict, counts: dict) -> str:
+    """写入版本间的变化报告，返回报告路径"""
+    name = (previous_version or 'none').replace('/', '_')
+    path = os.path.join(version_dir, f"{CHANGES_PREFIX}{name}_to_{cms_version.replace('/', '_')}.json")
+    report = {
+        'previous_version': previous_version,
+        'cms_version': cms_version,
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'counts': counts,
+        'added': [{'id': item['id'], 'name': item.get('name')} for item in diff['added']],
+        'changed': [{'id': item['id'], 'name': item.get('name'), 'fields': fields}
+                    for item, fields in diff['changed']],
+        'removed': [{'id': entry['id'], 'name': entry.get('name')} for entry in diff['removed']],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def get_version_paths(output_dir: str, cms_version: str) -> tuple:
+    """
+    创建版本目录，生成图片、结果文件、断点记录、派生尺寸、重新压缩和图集都在版本目录下的路径配置
+
+    Returns:
+        tuple: (版本目录, 结构与ITEM_CONFIG['PATHS']相同的路径配置)
+    """
+    version_dir = get_version_dir(output_dir, cms_version)
+    paths = dict(ITEM_CONFIG['PATHS'])
+    for key in ('IMAGES', 'JSON_BASE', 'CHECKPOINT', 'VARIANTS', 'RECOMPRESSED', 'ATLAS'):
+        paths[key] = os.path.join(version_dir, os.path.basename(paths[key]))
+    os.makedirs(version_dir, exist_ok=True)
+    return version_dir, paths
+
+
+def start_delta_download(output_dir: str = None, previous_version: str = None) -> bool:
+    """
+    增量下载：与上一个CMS版本的快照比较，只下载新增和修改过的物品，未修改物品的图标直接从旧版本链接过来
+
+    每个版本的图片、结果、断点记录和快照保存在 <输出目录>/<区服>_<版本>/ 下，
+    同时生成 changes_<旧版本>_to_<新版本>.json 变化报告。没有旧版本快照时下载全部物品。
+    修改的判断依据是物品列表中的名称和元数据，只换了图标而元数据不变的物品不会被发现。
+
+    Args:
+        output_dir: 输出目录，默认为ITEM_CONFIG['PATHS']['DELTA_OUTPUT']
+        previous_version: 作为比较基准的旧版本，例如 'CMS/201'，默认为输出目录中最近的旧版本
+
+    Returns:
+        bool: 物品列表获取失败、旧版本快照不存在或出现严重错误时为False
+    """
+    output_dir = output_dir or ITEM_CONFIG['PATHS']['DELTA_OUTPUT']
+    api = ITEM_CONFIG['API']
+    cms_version = get_api_version(api['BASE_URL'])
+    list_key = get_list_key(api)
+    previous_dir = None
+    if previous_version is None:
+        previous_version = find_previous_version(output_dir, cms_version, list_key)
+    if previous_version is not None:
+        previous_dir = get_version_dir(output_dir, previous_version)
+        if not os.path.exists(get_snapshot_path(previous_dir, list_key)):
+            logging.error(f"No snapshot for {previous_version} in {previous_dir}")
+            return False
+
+    images_name = os.path.basename(ITEM_CONFIG['PATHS']['IMAGES'])
+    version_dir, paths = get_version_paths(output_dir, cms_version)
+    json_filename, jsonl_filename, sink, checkpoint, store, names, post = prepare_run(paths)
+    if checkpoint is None:
+        # 增量下载依赖断点记录汇总各物品的结果，未启用断点续传时也使用版本目录中的记录
+        checkpoint = CheckpointStore(paths['CHECKPOINT'], cms_version, get_icon_resize())
+    counts = new_counts()
+    max_attempts = COMMON_CONFIG['CHECKPOINT']['MAX_ATTEMPTS']
+
+    try:
+        items = fetch_item_list(api)
+        if items is None:
+            logging.error("Failed to fetch initial items list")
+            return False
+
+        previous = {}
+        if previous_version is not None:
+            previous = load_snapshot(get_snapshot_path(previous_dir, list_key))
+            logging.info(f"Comparing {len(items)} items of {cms_version} "
+                         f"with {len(previous)} items of {previous_version}")
+        else:
+            logging.info(f"No earlier snapshot in {output_dir}, downloading all {len(items)} items")
+        diff = diff_items(previous, items)
+
+        linked = 0
+        to_download = diff['added'] + [item for item, _ in diff['changed']] + diff['retry']
+        to_download = _select(checkpoint, to_download, max_attempts, counts)
+        if diff['unchanged']:
+            previous_store = ImageStore(os.path.join(previous_dir, images_name))
+            unchanged = _select(checkpoint, diff['unchanged'], max_attempts, counts)
+            # 需要重新下载的未修改物品已经在上面筛选和计数过，直接加入下载列表
+            missing, linked = link_unchanged(unchanged, previous, previous_version, previous_store,
+                                             store, names, checkpoint, sink, post)
+            to_download += missing
+
+        logging.info(f"Delta {previous_version or 'none'} -> {cms_version}: "
+                     f"{len(diff['added'])} added, {len(diff['changed'])} changed, "
+                     f"{len(diff['removed'])} removed, {len(diff['unchanged'])} unchanged; "
+                     f"{len(to_download)} to download")
+        statuses = download_items(to_download, store, names, checkpoint, sink, post)
+        log_checkpoint_counts(counts)
+        logging.info(f"Linked {linked} unchanged icons from {previous_version}, "
+                     f"downloaded {statuses.get(STATUS_SUCCESS, 0)}, "
+                     f"{statuses.get(STATUS_FAILED, 0)} failed")
+
+        # 本次运行的链接和下载数，续传时不包含之前运行中完成的物品
+        report_counts = {
+            'added': len(diff['added']),
+            'changed': len(diff['changed']),
+            'removed': len(diff['removed']),
+            'unchanged': len(diff['unchanged']),
+            'linked': linked,
+            'downloaded': statuses.get(STATUS_SUCCESS, 0),
+            'failed': statuses.get(STATUS_FAILED, 0),
+        }
+        write_snapshot(get_snapshot_path(version_dir, list_key), items, checkpoint)
+        report = write_change_report(version_dir, previous_version, cms_version, diff, report_counts)
+        logging.info(f"Change report saved to {report}")
+        return True
+
+    except Exception as e:
+        logging.error(f"Critical error in delta download: {str(e)}")
+        logging.error(
+            f"Program will exit, but processed items have been saved to {jsonl_filename}")
+        return False
+
+    finally:
+        finish_run(json_filename, jsonl_filename, sink, checkpoint, store, post, paths)
+
+
+def _select(checkpoint, items: list, max_attempts: int, counts: dict) -> list:
+    """从物品字典中筛选出断点记录中尚未完成的物品"""
+    by_id = {item['id']: item for item in items}
+    selected = checkpoint.select_items([to_record(item) for item in items], max_attempts, counts)
+    return [by_id[record.id] for record in selected]
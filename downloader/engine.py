@@ -0,0 +1,556 @@
+"""
+线程池下载引擎，物品、NPC和地图下载共用
+
+提供有界的任务提交、分批并发的子任务、列表获取与断点复用、
+图片流式写入、结果文件和运行统计，具体下载什么由各下载器决定。
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from config import COMMON_CONFIG
+from utils import setup_logging, ensure_directory, get_json_filename, safe_request, get_shard, get_api_version
+from http_client import format_pool_stats, session_with_pool_size
+from http_cache import format_cache_stats
+from result_sink import ResultSink, get_jsonl_filename
+from checkpoint import CheckpointStore, make_run_key, new_counts
+from item_list import iter_items, to_record, batched
+from image_store import ImageStore, get_expected_length
+from rate_control import get_max_workers, format_limiter_stats
+from retry_policy import format_retry_stats
+from metrics import (
+    ChunkTimer, record_download, observe_stage, stage_timer, count,
+    reset_metrics, start_metrics_server, stop_metrics_server, log_metrics_summary
+)
+
+
+def get_queue_size() -> int:
+    """已提交但未完成的任务数上限，未配置时为下载线程数的4倍"""
+    queue_size = COMMON_CONFIG['CONCURRENT']['QUEUE_SIZE']
+    if queue_size is None:
+        queue_size = get_max_workers() * 4
+    return max(1, int(queue_size))
+
+
+def in_current_shard(record, sharding: dict = None) -> bool:
+    """
+    分片下载时判断记录是否属于当前分片，未分片时总是为True
+
+    Args:
+        sharding: 结构与COMMON_CONFIG['SHARDING']相同的分片配置，默认使用COMMON_CONFIG['SHARDING']
+    """
+    sharding = sharding or COMMON_CONFIG['SHARDING']
+    return sharding['SHARDS'] <= 1 or get_shard(record.id, sharding['SHARDS']) == sharding['INDEX']
+
+
+@contextmanager
+def size_pool_for(sub_workers: int):
+    """
+    子任务由另外的线程池请求时，连接池未单独配置则在with块内按下载线程数与子任务线程数之和设置，
+    所有线程同时请求时连接才能被复用，不会因连接池已满而被丢弃；配置本身不做修改
+    """
+    if COMMON_CONFIG['CONNECTION_POOL']['POOL_SIZE'] is not None:
+        yield
+        return
+    with session_with_pool_size(get_max_workers() + sub_workers):
+        yield
+
+
+def build_result(record, status: str, reason: str = None, **fields) -> dict:
+    """生成写入结果文件的单个结果，fields依次写在id和name之后"""
+    result = {'id': record.id, 'name': record.name}
+    result.update(fields)
+    result['status'] = status
+    if reason is not None:
+        result['reason'] = reason
+    return result
+
+
+def open_run_checkpoint(path: str, api: dict, resize):
+    """
+    打开断点续传记录，未启用时返回None
+
+    Args:
+        path: 断点记录文件
+        api: 含BASE_URL的接口配置，CMS版本从中取得
+        resize: 区分同一列表不同下载任务的参数，例如物品图标的resize
+    """
+    if not COMMON_CONFIG['CHECKPOINT']['ENABLED']:
+        return None
+    return CheckpointStore(path, get_api_version(api['BASE_URL']), resize)
+
+
+def run_timed(submitted: float, func, *args):
+    """
+    在下载线程中执行单个任务，记录任务在队列中等待的时间和处理的总耗时
+
+    Args:
+        submitted: 提交任务时的time.perf_counter()
+        func: 处理单个任务的函数
+        args: func的参数
+    """
+    started = time.perf_counter()
+    observe_stage('queue_wait', started - submitted)
+    try:
+        return func(*args)
+    finally:
+        observe_stage('item_total', time.perf_counter() - started)
+
+
+def record_result(result: dict, sink, checkpoint):
+    """写入单个结果并更新断点记录，同时记录耗时和结果计数"""
+    count('items', status=result.get('status'))
+    with stage_timer('sink_append'):
+        sink.write(result)
+    if checkpoint is not None:
+        with stage_timer('checkpoint_mark'):
+            checkpoint.mark(result)
+
+
+def run_bounded(tasks, func, on_result, max_workers: int = None, queue_size: int = None) -> int:
+    """
+    在线程池中处理可迭代的任务，已提交但未完成的任务数不超过queue_size，
+    任务边产生边提交，内存占用不随任务总数增长
+
+    Args:
+        tasks: 可迭代的参数元组，每个元组调用一次func
+        func: 处理单个任务的函数，在下载线程中执行
+        on_result: 接收func返回值的回调，返回值为空时不调用
+        max_workers: 下载线程数，默认为get_max_workers()
+        queue_size: 已提交但未完成的任务数上限，默认为get_queue_size()
+
+    Returns:
+        int: 提交的任务数
+    """
+    slots = threading.BoundedSemaphore(queue_size or get_queue_size())
+
+    def handle_result(future):
+        try:
+            result = future.result()
+            if result:
+                on_result(result)
+        except Exception as e:
+            logging.error(f"Error processing task: {str(e)}")
+        finally:
+            slots.release()
+
+    scheduled = 0
+    with ThreadPoolExecutor(max_workers=max_workers or get_max_workers()) as executor:
+        for args in tasks:
+            slots.acquire()
+            future = executor.submit(run_timed, time.perf_counter(), func, *args)
+            future.add_done_callback(handle_result)
+            scheduled += 1
+    return scheduled
+
+
+def fan_out(executor, func, tasks, batch_size: int):
+    """
+    将一个任务拆分的子任务分批交给共享的线程池，一批全部完成后再提交下一批，
+    同一任务同时进行的子任务数不超过batch_size
+
+    Args:
+        executor: 共享的线程池
+        func: 处理单个子任务的函数
+        tasks: 可迭代的参数元组
+        batch_size: 每批的子任务数
+
+    Yields:
+        func的返回值，顺序与tasks相同
+    """
+    for batch in batched(tasks, max(1, batch_size)):
+        futures = [executor.submit(func, *args) for args in batch]
+        for future in futures:
+            yield future.result()
+
+
+def save_response(response, store, filename: str, source: str) -> dict:
+    """
+    将响应内容流式写入图片存储，分别记录等待网络和写文件的耗时
+
+    Args:
+        response: 以stream=True发出的请求的响应
+        store: ImageStore
+        filename: 文件名
+        source: 指标中字节数的来源标签，例如 'icon'
+
+    Returns:
+        dict: 与ImageStore.save_stream相同
+    """
+    chunks = ChunkTimer(response.iter_content(COMMON_CONFIG['REQUEST']['CHUNK_SIZE']),
+                        source, 'http_body')
+    start = time.perf_counter()
+    with response:
+        saved = store.save_stream(chunks, filename, get_expected_length(response))
+    record_download(chunks, time.perf_counter() - start)
+    return saved
+
+
+def iter_response_items(response):
+    """
+    边读取边解析列表响应，读到末尾后关闭响应；提前停止迭代时也会关闭
+
+    Yields:
+        ItemRecord
+    """
+    with response:
+        yield from iter_items(
+            ChunkTimer(response.iter_content(COMMON_CONFIG['REQUEST']['CHUNK_SIZE']),
+                       'list', 'list_body'),
+            response.encoding or 'utf-8')
+
+
+def load_list(checkpoint, api: dict, accept=None):
+    """
+    获取列表，断点记录中有未结束的同一任务时继续该任务，直接复用记录中的列表
+
+    任务已经结束或CHECKPOINT['FRESH']为True时重新开始，之前记录的状态不再用于筛选
+
+    启用STREAM_LIST时边下载边解析列表，返回的是生成器，总数未知
+
+    Args:
+        checkpoint: 断点记录，未启用时为None
+        api: 含BASE_URL和PARAMS的接口配置，物品列表还含isCash
+        accept: 判断是否处理某条记录的函数，None表示全部处理
+
+    Returns:
+        tuple: (可迭代的ItemRecord, 总数)，总数未知时为None；请求失败时返回 (None, None)
+    """
+    run_key = None
+    max_attempts = COMMON_CONFIG['CHECKPOINT']['MAX_ATTEMPTS']
+    if checkpoint is not None:
+        run_key = make_run_key(checkpoint.cms_version, api['PARAMS'], api.get('isCash'))
+        resuming = checkpoint.start_run(run_key, api['PARAMS'], COMMON_CONFIG['CHECKPOINT']['FRESH'])
+        records = checkpoint.load_item_list(run_key) if resuming else None
+        if records is not None and checkpoint.has_unfinished(run_key, max_attempts):
+            total = checkpoint.count_items(run_key)
+            logging.info(
+                f"Resuming unfinished crawl, reusing {total} entries from {checkpoint.path}")
+            if accept is not None:
+                # 与重新获取列表时使用相同的筛选，筛选后的数量在读完之前未知
+                return (record for record in records if accept(record)), None
+            return records, total
+
+    stream = COMMON_CONFIG['REQUEST']['STREAM_LIST']
+    logging.info(f"Fetching list from: {api['BASE_URL']}")
+    with stage_timer('list_fetch'):
+        response = safe_request(api['BASE_URL'], params=api['PARAMS'], stream=stream)
+    if response is None:
+        return None, None
+
+    if stream:
+        records = iter_response_items(response)
+        if accept is not None:
+            records = (record for record in records if accept(record))
+        total = None
+    else:
+        with stage_timer('list_body'):
+            records = [to_record(record) for record in response.json()]
+        count('bytes', len(response.content), source='list')
+        if accept is not None:
+            records = [record for record in records if accept(record)]
+        total = len(records)
+
+    if checkpoint is not None:
+        records = checkpoint.record_item_list(run_key, api['PARAMS'], records)
+    return records, total
+
+
+def schedule(records, total, checkpoint, counts: dict):
+    """
+    按断点记录筛选需要处理的记录
+
+    Returns:
+        tuple: (可迭代的记录, 总数)，列表已完整载入时先筛选，日志中的进度总数才准确
+    """
+    if checkpoint is not None:
+        records = checkpoint.iter_scheduled(
+            records, COMMON_CONFIG['CHECKPOINT']['MAX_ATTEMPTS'], counts)
+        if total is not None:
+            records = list(records)
+            total = len(records)
+    return records, total
+
+
+def prepare_outputs(images_dir: str, json_base: str = None, listeners=None, log_dir: str = None):
+    """
+    开始一次抓取：初始化日志和指标，创建图片目录、结果文件和图片存储
+
+    Args:
+        images_dir: 图片目录
+        json_base: 结果文件名前缀，默认为ITEM_CONFIG['PATHS']['JSON_BASE']
+        listeners: 同时接收写入结果的对象，见ResultSink
+        log_dir: 日志目录，默认为ITEM_CONFIG['PATHS']['LOGS']
+
+    Returns:
+        tuple: (json文件名, jsonl文件名, ResultSink, ImageStore)
+    """
+    setup_logging(log_dir)
+    reset_metrics()
+    start_metrics_server()
+    ensure_directory(images_dir)
+    logging.info(f"Ensured directory: {images_dir}")
+    json_filename = get_json_filename(json_base)
+    jsonl_filename = get_jsonl_filename(json_filename)
+    logging.info(f"Results will be streamed to: {jsonl_filename}")
+
+    sink = ResultSink(jsonl_filename, listeners=listeners)
+    store = ImageStore(images_dir)
+    store.cleanup_partials()
+    return json_filename, jsonl_filename, sink, store
+
+
+def finish_outputs(json_filename: str, jsonl_filename: str, sink, store, annotate=None) -> str:
+    """
+    关闭图片存储，生成最终的结果文件
+
+    Args:
+        annotate: 生成JSON结果文件时补充单个结果的函数，见ResultSink.finalize
+
+    Returns:
+        str: 最终的结果文件
+    """
+    store.close()
+    if COMMON_CONFIG['RESULT_SINK']['FINALIZE_JSON']:
+        written = sink.finalize(json_filename, annotate)
+        logging.info(f"Saved {written} results to {json_filename}")
+        return json_filename
+    sink.close()
+    logging.info(f"Saved {sink.written} results to {jsonl_filename}")
+    return jsonl_filename
+
+
+def close_run(checkpoint):
+    """关闭断点记录，输出各阶段耗时的汇总并关闭 /metrics"""
+    try:
+        if checkpoint is not None:
+            checkpoint.close()
+    finally:
+        log_metrics_summary()
+        stop_metrics_server()
+
+
+def log_checkpoint_counts(counts: dict):
+    logging.info(
+        f"Checkpoint: {counts['success']} done, {counts['skipped']} skipped, "
+        f"{counts['failed']} retried, {counts['exhausted']} out of retries")
+
+
+def finish_checkpoint(checkpoint, counts: dict):
+    """
+    下载结束后输出断点统计，并将已全部完成的任务标记为结束，下次运行时重新开始筛选
+
+    Args:
+        checkpoint: 断点记录，未启用时为None
+        counts: 筛选时累计的各状态物品数
+    """
+    if checkpoint is None:
+        return
+    log_checkpoint_counts(counts)
+    if checkpoint.finish_runs(COMMON_CONFIG['CHECKPOINT']['MAX_ATTEMPTS']):
+        logging.info("Checkpoint: crawl finished, the next run starts a fresh selection")
+
+
+def log_run_stats(store):
+    """输出连接池、HTTP缓存、速率控制、重试和图片存储的统计"""
+    logging.info(f"Connection pool: {format_pool_stats()}")
+    logging.info(f"HTTP cache: {format_cache_stats()}")
+    logging.info(f"Rate control: {format_limiter_stats()}")
+    logging.info(f"Retries: {format_retry_stats()}")
+    logging.info(f"Image store: {store.format_stats()}")
+
+
+def run_resource_download(cfg: dict, process_func, resize, sub_workers: int, sub_name: str,
+                          noun: str) -> bool:
+    """
+    线程池引擎下载一类资源的共用流程，NPC和地图下载共用：
+    获取列表、按断点记录筛选、逐个交给process_func处理并写入结果，最后生成结果文件并关闭断点记录
+
+    每个资源拆分出的子任务（NPC的帧、地图的分块）交给共用的子任务线程池，
+    运行期间连接池按两个线程池的大小之和设置。只使用线程池引擎。
+
+    Args:
+        cfg: 含API和PATHS的资源配置，例如NPC_CONFIG
+        process_func: 处理单个资源的函数，参数为 (记录, 序号, 总数, ImageStore, 子任务线程池, api)，返回结果
+        resize: 断点记录中区分下载任务的参数，见open_run_checkpoint
+        sub_workers: 子任务线程数
+        sub_name: 子任务线程的名称前缀
+        noun: 日志中资源的名称，例如 'NPC'
+
+    Returns:
+        bool: 列表获取失败或下载过程中出现严重错误时为False
+    """
+    if COMMON_CONFIG['CONCURRENT']['ENGINE'] != 'thread':
+        logging.info(f"Downloading {noun}s always uses the thread engine")
+    with size_pool_for(sub_workers):
+        return _download_resources(cfg, process_func, resize, sub_workers, sub_name, noun)
+
+
+def _download_resources(cfg: dict, process_func, resize, sub_workers: int, sub_name: str, noun: str) -> bool:
+    api = cfg['API']
+    json_filename, jsonl_filename, sink, store = prepare_outputs(
+        cfg['PATHS']['IMAGES'], cfg['PATHS']['JSON_BASE'])
+    checkpoint = open_run_checkpoint(cfg['PATHS']['CHECKPOINT'], api, resize)
+    counts = new_counts()
+    sub_executor = ThreadPoolExecutor(max_workers=sub_workers, thread_name_prefix=sub_name)
+    try:
+        records, total = load_list(checkpoint, api, in_current_shard)
+        if records is None:
+            logging.error(f"Failed to fetch {noun} list")
+            return False
+
+        records, total = schedule(records, total, checkpoint, counts)
+        if total is not None:
+            logging.info(f"Found {total} {noun}s to process")
+        else:
+            logging.info(f"Streaming {noun} list, downloads start as {noun}s arrive")
+
+        scheduled = run_bounded(
+            ((record, index, total, store, sub_executor, api) for index, record in enumerate(records, 1)),
+            process_func, lambda result: record_result(result, sink, checkpoint))
+
+        logging.info(f"All tasks completed! {scheduled} {noun}s scheduled")
+        finish_checkpoint(checkpoint, counts)
+        log_run_stats(store)
+        return True
+
+    except Exception as e:
+        logging.error(f"Critical error in main process: {str(e)}")
+        logging.error(
+            f"Program will exit, but processed {noun}s have been saved to {jsonl_filename}")
+        return False
+
+    finally:
+        sub_executor.shutdown()
+        try:
+            finish_outputs(json_filename, jsonl_filename, sink, store)
+        finally:
+            close_run(checkpoint)
+
+
+class PostProcessors:
+    """
+    下载后处理，将保存好的图片依次交给各个处理器，例如派生尺寸和重新压缩
+
+    Args:
+        processors: [(日志中的名称, 处理器)]，处理器提供submit(路径, 文件名)、close()、format_stats()
+                    和annotate(结果)
+    """
+
+    def __init__(self, processors):
+        self.processors = list(processors)
+
+    def submit(self, source_path: str, filename: str):
+        for _, processor in self.processors:
+            processor.submit(source_path, filename)
+
+    def close(self):
+        """等待各处理器完成并输出统计，一个处理器出错不影响其余处理器关闭"""
+        for name, processor in self.processors:
+            try:
+                processor.close()
+                logging.info(f"{name}: {processor.format_stats()}")
+            except Exception as e:
+                logging.error(f"✗ Failed to finish {name.lower()}: {str(e)}")
+
+    def annotate(self, result: dict) -> dict:
+        """生成最终结果文件时将各处理器的输出写入单个结果，应在close()之后调用"""
+        for _, processor in self.processors:
+            processor.annotate(result)
+        return result
+
+
+class PooledPostProcessor:
+    """
+    在进程池中处理下载好的图片，与下载线程互不占用CPU，派生尺寸和重新压缩共用
+
+    已提交但未完成的任务数有上限，处理跟不上下载时submit会阻塞，避免积压占用内存。
+    输出目录下的 manifest.json 记录 文件名 -> worker的返回值，重复运行时在已有的清单上更新。
+    子类提供action、record()和format_stats()，并在调用__init__前设置含failed计数的stats。
+
+    Args:
+        output_dir: 输出的根目录
+        worker: 在工作进程中处理单个图片的模块级函数，参数为 (路径, 文件名, output_dir, *worker_args)
+        worker_args: worker的其余参数
+        processes: 进程数，None表示CPU核数
+    """
+
+    # 日志中处理失败时的动作，例如 'recompress'
+    action = 'process'
+    # 最终结果文件中记录清单内容的字段，None表示不写入
+    result_field = None
+
+    def __init__(self, output_dir: str, worker, worker_args=(), processes: int = None):
+        self.output_dir = output_dir
+        self.processes = processes or os.cpu_count() or 1
+        self.manifest_path = os.path.join(output_dir, 'manifest.json')
+        self._worker = worker
+        self._worker_args = tuple(worker_args)
+        self._manifest = self._load_manifest()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.processes * 4)
+        # 下载线程仍在运行时fork子进程不安全，使用spawn启动工作进程
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=multiprocessing.get_context('spawn'))
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _load_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Ignoring unreadable manifest {self.manifest_path}: {str(e)}")
+            return {}
+
+    def submit(self, source_path: str, filename: str):
+        """提交一个已保存的图片，处理队列已满时阻塞"""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(
+                self._worker, source_path, filename, self.output_dir, *self._worker_args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(partial(self._handle_done, filename))
+
+    def record(self, outputs):
+        """在持有锁时更新统计，outputs为worker的返回值"""
+
+    def _handle_done(self, filename: str, future):
+        try:
+            outputs = future.result()
+            with self._lock:
+                self._manifest[filename] = outputs
+                self.record(outputs)
+        except Exception as e:
+            logging.error(f"✗ Failed to {self.action} {filename}: {str(e)}")
+            with self._lock:
+                self.stats['failed'] += 1
+        finally:
+            self._slots.release()
+
+    def annotate(self, result: dict):
+        """将清单中该图片的记录写入下载成功的结果的result_field字段"""
+        if self.result_field is None or result.get('status') != 'success':
+            return
+        with self._lock:
+            outputs = self._manifest.get(result.get('filename'))
+        if outputs is not None:
+            result[self.result_field] = outputs
+
+    def close(self):
+        """等待所有任务完成，并写入清单"""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            tmp_path = f"{self.manifest_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.manifest_path)
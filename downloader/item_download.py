@@ -1,164 +1,302 @@
-import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
-import json
 
 from config import ITEM_CONFIG, COMMON_CONFIG
-from utils import (
-    setup_logging, ensure_directory, get_json_filename,
-    get_unique_filename, update_json_file, safe_request
+from utils import safe_request, get_icon_resize
+from checkpoint import new_counts
+from filename_index import FilenameIndex
+from log_queue import log_item
+from icon_variants import open_variant_processor
+from recompress import open_recompress_processor
+from item_index import open_index_writer
+from sprite_atlas import build_configured_atlas
+from downloader import engine
+from downloader.engine import (
+    in_current_shard, open_run_checkpoint, run_bounded, record_result, save_response, load_list, schedule,
+    prepare_outputs, finish_outputs, close_run, finish_checkpoint, log_checkpoint_counts, log_run_stats,
+    PostProcessors
 )
 
 
-def should_process_item(item):
-    if ITEM_CONFIG['API']['isCash'] is None:
+def should_process_item(item, api=None):
+    """
+    判断物品是否符合isCash筛选条件，分片下载时还要求物品属于当前分片
+
+    Args:
+        item: ItemRecord
+        api: 结构与ITEM_CONFIG['API']相同的接口配置，默认使用ITEM_CONFIG['API']；
+             可另含SHARDING，结构与COMMON_CONFIG['SHARDING']相同，默认使用COMMON_CONFIG['SHARDING']
+    """
+    api = api or ITEM_CONFIG['API']
+    if not in_current_shard(item, api.get('SHARDING')):
+        return False
+    if api['isCash'] is None:
         return True
-    item_is_cash = item.get('isCash', False)
-    return item_is_cash == ITEM_CONFIG['API']['isCash']
+    return item.is_cash == api['isCash']
+
+
+def get_icon_url(item_id, api=None) -> str:
+    api = api or ITEM_CONFIG['API']
+    return f'{api["BASE_URL"]}{item_id}/icon?resize={get_icon_resize(api)}'
+
+
+def build_result(item, status: str, reason: str = None, **fields) -> dict:
+    """生成写入结果文件的单个物品结果，比NPC和地图的结果多isCash"""
+    return engine.build_result(item, status, reason, isCash=item.is_cash, **fields)
+
+
+def reserve_item_filename(item, names):
+    """
+    按文件处理策略为物品预留文件名
+
+    Returns:
+        tuple: (文件名, 是否需要在失败时归还)，策略为skip且文件已存在时文件名为None
+    """
+    base_filename = f"{item.name}.png"
+    filename, existed = names.reserve(item.name)
+    if filename is None:
+        log_item(logging.INFO, f"⚠ Skipping existing file: {base_filename}", item.id, 'skipped')
+        return None, False
+    if filename != base_filename:
+        log_item(logging.INFO, f"Renamed to: {filename}", item.id, 'renamed', filename=filename)
+    # 新分配的文件名在下载失败时需要归还
+    return filename, filename != base_filename or not existed
+
+
+def log_saved(item, filename: str, reserved: bool, saved: dict):
+    strategy = COMMON_CONFIG['FILE_HANDLING']['STRATEGY']
+    base_filename = f"{item.name}.png"
+    if not reserved and strategy == 'overwrite' and filename == base_filename:
+        log_item(logging.INFO, f"✓ Overwritten: {filename}", item.id, 'saved', filename=filename)
+    elif strategy == 'rename' and filename != base_filename:
+        log_item(logging.INFO, f"✓ Renamed and saved as: {filename}", item.id, 'saved',
+                 filename=filename)
+    elif saved['deduplicated']:
+        log_item(logging.INFO, f"✓ Saved: {filename} (deduplicated)", item.id, 'saved',
+                 filename=filename, deduplicated=True)
+    else:
+        log_item(logging.INFO, f"✓ Saved: {filename}", item.id, 'saved', filename=filename)
 
 
-def process_single_item(item, index, total):
+def process_single_item(item, index, total, store, names, api=None):
     try:
-        item_id = item['id']
-        name = item['name']
-        is_cash = item.get('isCash', False)
+        total = '?' if total is None else total
 
-        if not should_process_item(item):
-            logging.info(
-                f"Skipping {index}/{total}: ID={item_id}, Name={name} (isCash={is_cash})")
+        if not should_process_item(item, api):
+            log_item(logging.INFO,
+                     f"Skipping {index}/{total}: ID={item.id}, Name={item.name} (isCash={item.is_cash})",
+                     item.id, 'filtered')
             return None
 
-        logging.info(
-            f"Processing {index}/{total}: ID={item_id}, Name={name}, isCash={is_cash}")
-
-        base_filename = f"{name}.png"
-        file_path = os.path.join(ITEM_CONFIG['PATHS']['IMAGES'], base_filename)
-        strategy = COMMON_CONFIG['FILE_HANDLING']['STRATEGY']
-
-        if os.path.exists(file_path):
-            if strategy == 'skip':
-                logging.info(f"⚠ Skipping existing file: {base_filename}")
-                return {
-                    'id': item_id,
-                    'name': name,
-                    'isCash': is_cash,
-                    'status': 'skipped',
-                    'reason': 'File already exists'
-                }
-            elif strategy == 'rename':
-                filename = get_unique_filename(name)
-                file_path = os.path.join(
-                    ITEM_CONFIG['PATHS']['IMAGES'], filename)
-                logging.info(f"Renamed to: {filename}")
-            # strategy == 'overwrite' 的情况下继续使用原文件名和路径
-
-        detail_url = f'{ITEM_CONFIG["API"]["BASE_URL"]}{item_id}/icon?resize=4'
-        detail_response = safe_request(detail_url)
+        log_item(logging.INFO,
+                 f"Processing {index}/{total}: ID={item.id}, Name={item.name}, isCash={item.is_cash}",
+                 item.id, 'processing', index=index)
+
+        filename, reserved = reserve_item_filename(item, names)
+        if filename is None:
+            return build_result(item, 'skipped', 'File already exists')
+
+        detail_url = get_icon_url(item.id, api)
+        detail_response = safe_request(detail_url, stream=True)
 
         if detail_response is None:
-            logging.error(f"✗ Failed to fetch details for item {
-                          item_id} ({name})")
-            return {
-                'id': item_id,
-                'name': name,
-                'isCash': is_cash,
-                'status': 'failed',
-                'reason': 'Network error during fetch'
-            }
+            log_item(logging.ERROR, f"✗ Failed to fetch details for item {item.id} ({item.name})",
+                     item.id, 'failed', reason='fetch')
+            if reserved:
+                names.release(filename)
+            return build_result(item, 'failed', 'Network error during fetch')
 
         try:
-            with open(file_path, 'wb') as f:
-                f.write(detail_response.content)
-
-            filename = os.path.basename(file_path)
-            if os.path.exists(file_path):
-                if strategy == 'overwrite' and filename == base_filename:
-                    logging.info(f"✓ Overwritten: {filename}")
-                elif strategy == 'rename' and filename != base_filename:
-                    logging.info(f"✓ Renamed and saved as: {filename}")
-                else:
-                    logging.info(f"✓ Saved: {filename}")
-            else:
-                logging.info(f"✓ Saved: {filename}")
-
-            return {
-                'id': item_id,
-                'name': name,
-                'isCash': is_cash,
-                'filename': filename,
-                'image_url': detail_url,
-                'status': 'success'
-            }
+            saved = save_response(detail_response, store, filename, 'icon')
+            log_saved(item, filename, reserved, saved)
+            return build_result(item, 'success', filename=filename,
+                                image_url=detail_url, sha256=saved['sha256'])
 
         except Exception as e:
-            logging.error(f"✗ Error saving image {name}: {str(e)}")
-            return {
-                'id': item_id,
-                'name': name,
-                'isCash': is_cash,
-                'status': 'failed',
-                'reason': f'Image save error: {str(e)}'
-            }
+            log_item(logging.ERROR, f"✗ Error saving image {item.name}: {str(e)}", item.id, 'failed',
+                     reason='save')
+            if reserved:
+                names.release(filename)
+            return build_result(item, 'failed', f'Image save error: {str(e)}')
 
     except Exception as e:
-        logging.error(f"✗ Unexpected error processing item {index}: {str(e)}")
+        log_item(logging.ERROR, f"✗ Unexpected error processing item {index}: {str(e)}",
+                 getattr(item, 'id', None), 'failed', reason='unexpected')
         return {
-            'id': item.get('id', 'unknown'),
-            'name': item.get('name', 'unknown'),
-            'isCash': item.get('isCash', False),
+            'id': getattr(item, 'id', 'unknown'),
+            'name': getattr(item, 'name', 'unknown'),
+            'isCash': getattr(item, 'is_cash', False),
             'status': 'failed',
             'reason': f'Unexpected error: {str(e)}'
         }
 
 
-def fetch_and_process_items():
-    setup_logging()
-    ensure_directory(ITEM_CONFIG['PATHS']['IMAGES'])
-    logging.info(f"Ensured directory: {ITEM_CONFIG['PATHS']['IMAGES']}")
-    json_filename = get_json_filename()
-    logging.info(f"Results will be saved to: {json_filename}")
+def open_checkpoint(path=None, api=None):
+    """
+    打开当前物品配置对应的断点续传记录，未启用时返回None
+
+    Args:
+        path: 断点记录文件，默认为ITEM_CONFIG['PATHS']['CHECKPOINT']
+        api: 结构与ITEM_CONFIG['API']相同的接口配置，默认使用ITEM_CONFIG['API']
+    """
+    api = api or ITEM_CONFIG['API']
+    return open_run_checkpoint(path or ITEM_CONFIG['PATHS']['CHECKPOINT'], api, get_icon_resize(api))
+
+
+def load_items(checkpoint, api=None):
+    """
+    获取物品列表，断点记录中有未完成的同一任务时直接复用记录中的列表
 
-    with open(json_filename, 'w', encoding='utf-8') as f:
-        json.dump([], f)
+    启用STREAM_LIST时边下载边解析列表，返回的是生成器，物品总数未知
 
+    Args:
+        checkpoint: 断点记录，未启用时为None
+        api: 结构与ITEM_CONFIG['API']相同的接口配置，默认使用ITEM_CONFIG['API']
+
+    Returns:
+        tuple: (可迭代的ItemRecord, 物品总数)，总数未知时为None；请求失败时返回 (None, None)
+    """
+    api = api or ITEM_CONFIG['API']
+    if api['isCash'] is not None:
+        logging.info(f"Filtering items with isCash={api['isCash']}")
+    return load_list(checkpoint, api, lambda item: should_process_item(item, api))
+
+
+def open_post_processors(directory: str = None, paths: dict = None):
+    """
+    按配置创建下载后处理：派生尺寸和重新压缩，都未启用时返回None
+
+    Args:
+        directory: 输出目录，处理结果分别保存到其中的 variants/ 和 optimized/，
+                   默认为paths中的VARIANTS和RECOMPRESSED
+        paths: 结构与ITEM_CONFIG['PATHS']相同的路径配置，默认使用ITEM_CONFIG['PATHS']
+    """
+    paths = paths or ITEM_CONFIG['PATHS']
+    processors = []
+    variants = open_variant_processor(
+        os.path.join(directory, 'variants') if directory else paths['VARIANTS'])
+    if variants is not None:
+        processors.append(('Icon variants', variants))
     try:
-        logging.info(f"Fetching items from: {ITEM_CONFIG['API']['BASE_URL']}")
-        response = safe_request(
-            ITEM_CONFIG['API']['BASE_URL'], params=ITEM_CONFIG['API']['PARAMS'])
-        if response is None:
-            logging.error("Failed to fetch initial items list")
-            return
+        recompress = open_recompress_processor(
+            os.path.join(directory, 'optimized') if directory else paths['RECOMPRESSED'])
+    except BaseException:
+        if variants is not None:
+            variants.close()
+        raise
+    if recompress is not None:
+        processors.append(('Recompression', recompress))
+    return PostProcessors(processors) if processors else None
 
-        items = response.json()
-        total_items = len(items)
-        logging.info(f"Found {total_items} items to process")
 
-        if ITEM_CONFIG['API']['isCash'] is not None:
-            logging.info(f"Filtering items with isCash={
-                         ITEM_CONFIG['API']['isCash']}")
+def prepare_run(paths: dict = None):
+    """
+    准备一次抓取共用的输出：结果文件（同时写入物品索引）、断点记录、图片存储、文件名索引和下载后处理
 
-        with ThreadPoolExecutor(max_workers=COMMON_CONFIG['CONCURRENT']['MAX_WORKERS']) as executor:
-            future_to_item = {
-                executor.submit(process_single_item, item, index + 1, total_items): item
-                for index, item in enumerate(items)
-            }
+    Args:
+        paths: 结构与ITEM_CONFIG['PATHS']相同的路径配置，默认使用ITEM_CONFIG['PATHS']
 
-            for future in concurrent.futures.as_completed(future_to_item):
-                try:
-                    result = future.result()
-                    if result:
-                        update_json_file(result, json_filename)
-                except Exception as e:
-                    logging.error(f"Error processing task: {str(e)}")
+    Returns:
+        tuple: (json文件名, jsonl文件名, ResultSink, CheckpointStore或None, ImageStore, FilenameIndex,
+                PostProcessors或None)
+    """
+    paths = paths or ITEM_CONFIG['PATHS']
+    json_filename, jsonl_filename, sink, store = prepare_outputs(
+        paths['IMAGES'], paths['JSON_BASE'], listeners=[open_index_writer(images_dir=paths['IMAGES'])],
+        log_dir=paths['LOGS'])
+    checkpoint = open_checkpoint(paths['CHECKPOINT'])
+    names = FilenameIndex(paths['IMAGES'], store.names())
+    post = open_post_processors(paths=paths)
+    return json_filename, jsonl_filename, sink, checkpoint, store, names, post
 
-        logging.info(f"All tasks completed! Results saved to {json_filename}")
+
+def submit_post_processing(post, store, result: dict):
+    """将下载成功的图标交给下载后处理，处理队列已满时阻塞"""
+    if post is not None and result.get('status') == 'success':
+        post.submit(store.path_of(result['filename']), result['filename'])
+
+
+def finish_run(json_filename, jsonl_filename, sink, checkpoint, store, post=None, paths: dict = None):
+    """
+    等待下载后处理完成，关闭图片存储，生成最终的结果文件，按配置构建图集后关闭断点记录，
+    最后输出各阶段耗时的汇总并关闭 /metrics
+
+    Args:
+        paths: 与prepare_run相同的路径配置，其中ATLAS为None时不构建图集
+    """
+    paths = paths or ITEM_CONFIG['PATHS']
+    if post is not None:
+        post.close()
+    results_file = finish_outputs(json_filename, jsonl_filename, sink, store,
+                                  post.annotate if post is not None else None)
+
+    try:
+        if ITEM_CONFIG['ATLAS']['ENABLED'] and paths['ATLAS']:
+            build_configured_atlas(store, checkpoint, results_file, paths['ATLAS'])
+    except Exception as e:
+        logging.error(f"✗ Failed to build atlas: {str(e)}")
+    finally:
+        close_run(checkpoint)
+
+
+def fetch_and_process_items(paths: dict = None, api: dict = None):
+    api = api or ITEM_CONFIG['API']
+    json_filename, jsonl_filename, sink, checkpoint, store, names, post = prepare_run(paths)
+    counts = new_counts()
+
+    def handle_result(result):
+        record_result(result, sink, checkpoint)
+        submit_post_processing(post, store, result)
+
+    try:
+        items, total_items = load_items(checkpoint, api)
+        if items is None:
+            logging.error("Failed to fetch initial items list")
+            return False
+
+        items, total_items = schedule(items, total_items, checkpoint, counts)
+        if total_items is not None:
+            logging.info(f"Found {total_items} items to process")
+        else:
+            logging.info("Streaming items list, downloads start as items arrive")
+
+        # 列表边解析边提交，内存占用不随物品数增长
+        scheduled = run_bounded(
+            ((item, index, total_items, store, names, api) for index, item in enumerate(items, 1)),
+            process_single_item, handle_result)
+
+        logging.info(f"All tasks completed! {scheduled} items scheduled")
+        finish_checkpoint(checkpoint, counts)
+        log_run_stats(store)
+        return True
 
     except Exception as e:
         logging.error(f"Critical error in main process: {str(e)}")
-        logging.error(f"Program will exit, but processed items have been saved to {
-                      json_filename}")
+        logging.error(
+            f"Program will exit, but processed items have been saved to {jsonl_filename}")
+        return False
+
+    finally:
+        finish_run(json_filename, jsonl_filename, sink, checkpoint, store, post, paths)
+
+
+def start_download(paths: dict = None, api: dict = None) -> bool:
+    """
+    按CONCURRENT['ENGINE']选择的引擎下载物品图标
 
+    Args:
+        paths: 结构与ITEM_CONFIG['PATHS']相同的路径配置，默认使用ITEM_CONFIG['PATHS']
+        api: 接口配置，见should_process_item，默认使用ITEM_CONFIG['API']
 
-def start_download():
-    fetch_and_process_items()
+    Returns:
+        bool: 物品列表获取失败或下载过程中出现严重错误时为False
+    """
+    engine = COMMON_CONFIG['CONCURRENT']['ENGINE']
+    if engine == 'asyncio':
+        import asyncio
+        from downloader.async_engine import fetch_and_process_items_async
+        return asyncio.run(fetch_and_process_items_async(paths=paths, api=api))
+    elif engine == 'thread':
+        return fetch_and_process_items(paths, api)
+    else:
+        raise ValueError(f"未知的下载引擎: {engine}")
@@ -0,0 +1,139 @@
+import logging
+import os
+
+from config import MAP_CONFIG
+from utils import safe_request
+from log_queue import log_item
+from range_download import RangeDownload, ContentChangedError, RANGES_DIR
+from downloader.engine import build_result, fan_out, save_response, run_resource_download
+
+
+def get_render_url(map_id, api=None) -> str:
+    api = api or MAP_CONFIG['API']
+    return f"{api['BASE_URL']}{map_id}/{api['RENDER']}"
+
+
+def get_map_filename(map_id) -> str:
+    return f"{map_id}.png"
+
+
+def get_chunk_size() -> int:
+    return max(1, int(MAP_CONFIG['CHUNKS']['SIZE_MB'] * 1024 * 1024))
+
+
+def get_chunk_workers() -> int:
+    return max(1, int(MAP_CONFIG['CHUNKS']['WORKERS']))
+
+
+def fetch_chunk(download, index: int) -> tuple:
+    """
+    在分块下载线程中下载一块
+
+    Returns:
+        tuple: (块序号, 异常)，成功时异常为None
+    """
+    try:
+        return download.fetch(index), None
+    except Exception as e:
+        return index, e
+
+
+def process_single_map(map_record, index, total, store, chunk_executor, api=None):
+    """
+    下载一张地图
+
+    第一块的请求同时确定文件大小和服务器是否支持Range，之后的块分批提交到共享的分块下载线程池，
+    同一地图同时下载的块数不超过CHUNKS['PER_MAP']。上次中断留下的块会被复用。
+    """
+    try:
+        total = '?' if total is None else total
+        log_item(logging.INFO, f"Processing {index}/{total}: ID={map_record.id}, Name={map_record.name}",
+                 map_record.id, 'processing', index=index)
+
+        filename = get_map_filename(map_record.id)
+        if store.exists(os.path.join(store.directory, filename)):
+            log_item(logging.INFO, f"⚠ Skipping existing file: {filename}", map_record.id, 'skipped')
+            return build_result(map_record, 'skipped', 'File already exists', filename=filename)
+
+        url = get_render_url(map_record.id, api)
+        download = RangeDownload(url, os.path.join(store.directory, RANGES_DIR), filename,
+                                 get_chunk_size(), 'map')
+        if download.load():
+            log_item(logging.INFO, f"Resuming {filename}: {len(download.done)}/{download.chunks} chunks on disk",
+                     map_record.id, 'resumed', chunks_done=len(download.done))
+        else:
+            response = safe_request(url, stream=True,
+                                    headers={'Range': f"bytes=0-{download.chunk_size - 1}"})
+            if response is None:
+                log_item(logging.ERROR, f"✗ Failed to fetch map {map_record.id} ({map_record.name})",
+                         map_record.id, 'failed', reason='fetch')
+                return build_result(map_record, 'failed', 'Network error during fetch')
+            if response.status_code != 206:
+                # 服务器不支持Range，整个文件流式写入，中断后需要重新下载
+                saved = save_response(response, store, filename, 'map')
+                log_item(logging.INFO, f"✓ Saved: {filename} ({saved['size']} bytes, no range support)",
+                         map_record.id, 'saved', size=saved['size'])
+                return build_result(map_record, 'success', filename=filename, image_url=url,
+                                    size=saved['size'], chunks=1, sha256=saved['sha256'])
+            download.start(response)
+
+        errors = []
+        for chunk, error in fan_out(chunk_executor, fetch_chunk,
+                                    ((download, chunk) for chunk in download.pending()),
+                                    MAP_CONFIG['CHUNKS']['PER_MAP']):
+            if error is None:
+                download.mark_done(chunk)
+            else:
+                errors.append(error)
+
+        if any(isinstance(error, ContentChangedError) for error in errors):
+            download.discard()
+            log_item(logging.ERROR, f"✗ Map {map_record.id} changed during download, discarded partial file",
+                     map_record.id, 'failed', reason='changed')
+            return build_result(map_record, 'failed', 'Map changed on server during download')
+        if errors:
+            log_item(logging.ERROR, f"✗ {len(errors)}/{download.chunks} chunks failed for {filename}: "
+                     f"{str(errors[0])}", map_record.id, 'failed', reason='chunks')
+            return build_result(
+                map_record, 'failed',
+                f'{len(errors)} of {download.chunks} chunks failed: {str(errors[0])}',
+                chunks=download.chunks, chunks_done=len(download.done))
+
+        try:
+            download.check_png()
+        except ValueError:
+            download.discard()
+            raise
+        chunks = download.chunks
+        saved = store.import_file(download.part_path, filename)
+        download.discard()
+        log_item(logging.INFO, f"✓ Saved: {filename} ({saved['size']} bytes in {chunks} chunks, "
+                 f"{download.resumed} resumed)", map_record.id, 'saved', size=saved['size'])
+        return build_result(map_record, 'success', filename=filename, image_url=url,
+                            size=saved['size'], chunks=chunks,
+                            resumed_chunks=download.resumed, sha256=saved['sha256'])
+
+    except Exception as e:
+        log_item(logging.ERROR, f"✗ Unexpected error processing map {index}: {str(e)}",
+                 getattr(map_record, 'id', None), 'failed', reason='unexpected')
+        return {
+            'id': getattr(map_record, 'id', 'unknown'),
+            'name': getattr(map_record, 'name', 'unknown'),
+            'status': 'failed',
+            'reason': f'Unexpected error: {str(e)}'
+        }
+
+
+def start_download() -> bool:
+    """
+    下载地图列表中每张地图的图片
+
+    地图由下载线程池逐个处理，各地图的分块交给共用的分块下载线程池，
+    每块边下载边写入临时文件中对应的位置，内存占用与地图大小无关。
+    地图下载只使用线程池引擎。
+
+    Returns:
+        bool: 地图列表获取失败或下载过程中出现严重错误时为False
+    """
+    return run_resource_download(MAP_CONFIG, process_single_map, MAP_CONFIG['API']['RENDER'],
+                                 get_chunk_workers(), 'map-chunk', 'map')
@@ -0,0 +1,147 @@
+import logging
+import os
+
+from config import NPC_CONFIG
+from utils import safe_request
+from log_queue import log_item
+from downloader.engine import build_result, fan_out, save_response, run_resource_download
+
+# NPC的帧没有resize参数，断点记录中以此代替
+CHECKPOINT_RESIZE = 'frames'
+
+
+def get_npc_url(npc_id, api=None) -> str:
+    api = api or NPC_CONFIG['API']
+    return f"{api['BASE_URL']}{npc_id}"
+
+
+def get_frame_url(npc_id, animation: str, frame: int, api=None) -> str:
+    api = api or NPC_CONFIG['API']
+    return f"{api['BASE_URL']}{npc_id}/render/{animation}/{frame}"
+
+
+def get_frame_filename(npc_id, animation: str, frame: int) -> str:
+    return f"{npc_id}_{animation}_{frame}.png"
+
+
+def get_frame_workers() -> int:
+    return max(1, int(NPC_CONFIG['FRAMES']['WORKERS']))
+
+
+def get_framebooks(detail: dict, api=None) -> dict:
+    """
+    从NPC详情中取出要下载的动作及其帧数，按ANIMATIONS和MAX_FRAMES筛选
+
+    Returns:
+        dict: {动作: 帧数}
+    """
+    api = api or NPC_CONFIG['API']
+    animations = api['ANIMATIONS']
+    max_frames = api['MAX_FRAMES']
+    framebooks = {}
+    for animation, frames in (detail.get('framebooks') or {}).items():
+        if animations is not None and animation not in animations:
+            continue
+        # 帧数，部分版本的接口返回帧的列表
+        if isinstance(frames, (list, dict)):
+            frames = len(frames)
+        frames = int(frames or 0)
+        if max_frames is not None:
+            frames = min(frames, max_frames)
+        if frames > 0:
+            framebooks[animation] = frames
+    return framebooks
+
+
+def iter_frames(npc_id, framebooks: dict):
+    for animation, frames in framebooks.items():
+        for frame in range(frames):
+            yield npc_id, animation, frame
+
+
+def download_frame(store, npc_id, animation: str, frame: int, api=None):
+    """
+    下载一帧并流式写入图片目录，之前已下载的帧不再请求
+
+    Returns:
+        tuple: (文件名, 失败原因)，成功时失败原因为None
+    """
+    filename = get_frame_filename(npc_id, animation, frame)
+    if store.exists(os.path.join(store.directory, filename)):
+        return filename, None
+
+    response = safe_request(get_frame_url(npc_id, animation, frame, api), stream=True)
+    if response is None:
+        return filename, 'Network error during fetch'
+    try:
+        save_response(response, store, filename, 'frame')
+        return filename, None
+    except Exception as e:
+        return filename, f'Image save error: {str(e)}'
+
+
+def process_single_npc(npc, index, total, store, frame_executor, api=None):
+    """
+    下载一个NPC的全部帧
+
+    帧分批提交到共享的帧下载线程池，同一NPC同时下载的帧数不超过FRAMES['BATCH_SIZE']，
+    每一帧都流式写入文件，单个NPC占用的内存不随帧数增长
+    """
+    try:
+        total = '?' if total is None else total
+        log_item(logging.INFO, f"Processing {index}/{total}: ID={npc.id}, Name={npc.name}", npc.id,
+                 'processing', index=index)
+
+        response = safe_request(get_npc_url(npc.id, api))
+        if response is None:
+            log_item(logging.ERROR, f"✗ Failed to fetch details for NPC {npc.id} ({npc.name})", npc.id,
+                     'failed', reason='fetch')
+            return build_result(npc, 'failed', 'Network error during fetch')
+        framebooks = get_framebooks(response.json(), api)
+        if not framebooks:
+            log_item(logging.INFO, f"⚠ No frames to download for NPC {npc.id} ({npc.name})", npc.id,
+                     'skipped')
+            return build_result(npc, 'skipped', 'No frames', animations={})
+
+        failed = []
+        for filename, reason in fan_out(
+                frame_executor, download_frame,
+                ((store,) + frame + (api,) for frame in iter_frames(npc.id, framebooks)),
+                NPC_CONFIG['FRAMES']['BATCH_SIZE']):
+            if reason is not None:
+                log_item(logging.ERROR, f"✗ Failed to download frame {filename}: {reason}", npc.id,
+                         'frame_failed', filename=filename)
+                failed.append({'filename': filename, 'reason': reason})
+
+        frames = sum(framebooks.values())
+        if failed:
+            return build_result(npc, 'failed', f'{len(failed)} of {frames} frames failed',
+                                animations=framebooks, frames=frames, failed_frames=failed)
+        log_item(logging.INFO, f"✓ Saved {frames} frames for NPC {npc.id} ({npc.name})", npc.id,
+                 'saved', frames=frames)
+        return build_result(npc, 'success', animations=framebooks, frames=frames)
+
+    except Exception as e:
+        log_item(logging.ERROR, f"✗ Unexpected error processing NPC {index}: {str(e)}",
+                 getattr(npc, 'id', None), 'failed', reason='unexpected')
+        return {
+            'id': getattr(npc, 'id', 'unknown'),
+            'name': getattr(npc, 'name', 'unknown'),
+            'status': 'failed',
+            'reason': f'Unexpected error: {str(e)}'
+        }
+
+
+def start_download() -> bool:
+    """
+    下载NPC列表中每个NPC各个动作的全部帧
+
+    NPC由下载线程池逐个处理，各NPC的帧交给共用的帧下载线程池，
+    与物品下载共用同一个连接池、结果文件格式、断点续传和指标。
+    NPC下载只使用线程池引擎。
+
+    Returns:
+        bool: NPC列表获取失败或下载过程中出现严重错误时为False
+    """
+    return run_resource_download(NPC_CONFIG, process_single_npc, CHECKPOINT_RESIZE,
+                                 get_frame_workers(), 'npc-frame', 'NPC')
@@ -0,0 +1,276 @@
+from datetime import datetime
+import json
+import logging
+import os
+import shutil
+
+from config import ITEM_CONFIG, COMMON_CONFIG
+from utils import setup_logging, ensure_directory, get_api_version, get_icon_resize
+from result_sink import iter_jsonl, write_json_array
+from image_store import ImageStore
+from filename_index import FilenameIndex
+from sprite_atlas import build_configured_atlas
+from http_cache import cache_in_directory
+from downloader.item_download import start_download
+
+SHARD_MANIFEST_FILE = 'shard_manifest.json'
+MERGE_MANIFEST_FILE = 'merge_manifest.json'
+# 合并时先写入临时目录，完成后再替换原有的合并结果
+_MERGING_SUFFIX = '.merging'
+
+
+def get_shard_dir(output_dir: str, index: int, shards: int) -> str:
+    """分片的输出目录，例如 shard_output/shard_001_of_004"""
+    return os.path.join(output_dir, f"shard_{index:03d}_of_{shards:03d}")
+
+
+def configure_shard(index: int, shards: int, output_dir: str) -> tuple:
+    """
+    生成只处理一个分片的路径和接口配置，全局配置不做修改
+
+    图片、结果文件、断点记录、日志和HTTP缓存都放到分片目录下，多个分片进程可以在同一台机器上同时运行。
+    图集在合并后统一构建，分片中不构建。
+
+    Returns:
+        tuple: (分片目录, 结构与ITEM_CONFIG['PATHS']相同的路径配置, 含SHARDING的接口配置, HTTP缓存目录)
+
+    Raises:
+        ValueError: 分片编号或分片总数无效
+    """
+    if shards < 1 or not 0 <= index < shards:
+        raise ValueError(f"无效的分片: {index}/{shards}")
+
+    shard_dir = get_shard_dir(output_dir, index, shards)
+    paths = dict(ITEM_CONFIG['PATHS'])
+    for key in ('IMAGES', 'LOGS', 'JSON_BASE', 'CHECKPOINT', 'VARIANTS', 'RECOMPRESSED'):
+        paths[key] = os.path.join(shard_dir, os.path.basename(paths[key]))
+    paths['ATLAS'] = None
+    api = dict(ITEM_CONFIG['API'], SHARDING={'SHARDS': shards, 'INDEX': index})
+    cache_dir = os.path.join(shard_dir, os.path.basename(COMMON_CONFIG['HTTP_CACHE']['DIRECTORY']))
+    return shard_dir, paths, api, cache_dir
+
+
+def get_run_info() -> dict:
+    """用于确认各分片属于同一次抓取的信息"""
+    api = ITEM_CONFIG['API']
+    return {
+        'cms_version': get_api_version(api['BASE_URL']),
+        'params': api['PARAMS'],
+        'isCash': api['isCash'],
+        'resize': get_icon_resize(api),
+    }
+
+
+def list_result_files(shard_dir: str) -> list:
+    """分片目录中的结果文件（JSON Lines），按文件名中的时间戳排序"""
+    prefix = f"{os.path.basename(ITEM_CONFIG['PATHS']['JSON_BASE'])}_"
+    return sorted(name for name in os.listdir(shard_dir)
+                  if name.startswith(prefix) and name.endswith('.jsonl'))
+
+
+def write_shard_manifest(shard_dir: str, index: int, shards: int, ok: bool) -> str:
+    """
+    写入分片清单，记录分片编号、抓取参数、图片目录和所有结果文件
+
+    同一分片重复运行（例如续传）时结果文件会有多个，合并时同一物品以最后一个文件中的结果为准
+    """
+    manifest = {
+        'shard': index,
+        'shards': shards,
+        'run': get_run_info(),
+        'images': os.path.basename(ITEM_CONFIG['PATHS']['IMAGES']),
+        'store_mode': COMMON_CONFIG['FILE_HANDLING']['STORE_MODE'],
+        'link_mode': COMMON_CONFIG['FILE_HANDLING']['LINK_MODE'],
+        'results': list_result_files(shard_dir),
+        'ok': ok,
+        'updated_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    path = os.path.join(shard_dir, SHARD_MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def start_shard_download(index: int, shards: int, output_dir: str = None) -> bool:
+    """
+    下载一个分片的物品，可以在不同进程或不同机器上分别运行各个分片
+
+    Args:
+        index: 分片编号，从0开始
+        shards: 分片总数
+        output_dir: 输出目录，默认为ITEM_CONFIG['PATHS']['SHARD_OUTPUT']
+
+    Returns:
+        bool: 与start_download相同
+    """
+    output_dir = output_dir or ITEM_CONFIG['PATHS']['SHARD_OUTPUT']
+    shard_dir, paths, api, cache_dir = configure_shard(index, shards, output_dir)
+    ensure_directory(shard_dir)
+    with cache_in_directory(cache_dir):
+        ok = start_download(paths, api)
+    path = write_shard_manifest(shard_dir, index, shards, ok)
+    logging.info(f"Shard {index}/{shards} manifest saved to {path}")
+    return ok
+
+
+def load_shard_manifests(output_dir: str) -> list:
+    """读取输出目录下所有分片的清单，按分片编号排序"""
+    manifests = []
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            path = os.path.join(entry.path, SHARD_MANIFEST_FILE)
+            if not entry.is_dir() or not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            manifest['directory'] = entry.path
+            manifests.append(manifest)
+    return sorted(manifests, key=lambda manifest: manifest['shard'])
+
+
+def check_shards(manifests: list, allow_partial: bool = False) -> int:
+    """
+    检查各分片是否齐全且属于同一次抓取
+
+    Returns:
+        int: 分片总数
+
+    Raises:
+        ValueError: 没有分片、分片总数或抓取参数不一致，或缺少分片且不允许部分合并
+    """
+    if not manifests:
+        raise ValueError("没有找到分片清单")
+    shards = {manifest['shards'] for manifest in manifests}
+    if len(shards) != 1:
+        raise ValueError(f"分片总数不一致: {sorted(shards)}")
+    shards = shards.pop()
+    runs = {json.dumps(manifest['run'], sort_keys=True) for manifest in manifests}
+    if len(runs) != 1:
+        raise ValueError("各分片的CMS版本或筛选参数不一致")
+
+    missing = sorted(set(range(shards)) - {manifest['shard'] for manifest in manifests})
+    if missing:
+        message = f"缺少分片: {', '.join(map(str, missing))} (共{shards}片)"
+        if not allow_partial:
+            raise ValueError(message)
+        logging.warning(message)
+    return shards
+
+
+def collect_results(manifests: list) -> dict:
+    """
+    读取各分片的结果，同一物品以分片中最后一次运行的结果为准，但已成功的结果不会被之后失败或跳过的结果覆盖
+
+    Returns:
+        dict: 物品ID -> (结果, 分片的ImageStore)
+    """
+    results = {}
+    for manifest in manifests:
+        store = ImageStore(os.path.join(manifest['directory'], manifest['images']),
+                           manifest['store_mode'], manifest['link_mode'])
+        for name in manifest['results']:
+            for result in iter_jsonl(os.path.join(manifest['directory'], name)):
+                previous = results.get(result['id'])
+                if (previous is None or result['status'] == 'success'
+                        or previous[0]['status'] != 'success'):
+                    results[result['id']] = (result, store)
+    return results
+
+
+def _replace_dir(staging: str, target: str):
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.replace(staging, target)
+
+
+def merge_shards(output_dir: str = None, allow_partial: bool = False) -> bool:
+    """
+    将各分片的结果合并为一份结果文件和一个图片目录
+
+    物品按ID排序后依次分配文件名，同名物品按FILE_HANDLING的策略处理，
+    无论分片数量和各分片完成的先后，同一组结果合并后的文件名总是相同。
+    plain模式下图片以硬链接导入，不复制内容。
+
+    输出目录下生成:
+        <IMAGES>/                  合并后的图片
+        <JSON_BASE>_merged.json    合并后的结果
+        merge_manifest.json        合并统计和重命名记录
+
+    Args:
+        output_dir: 分片下载的输出目录，默认为ITEM_CONFIG['PATHS']['SHARD_OUTPUT']
+        allow_partial: 缺少分片时是否仍然合并已有的分片
+
+    Returns:
+        bool: 分片不齐全或不一致时为False
+    """
+    setup_logging()
+    output_dir = output_dir or ITEM_CONFIG['PATHS']['SHARD_OUTPUT']
+    manifests = load_shard_manifests(output_dir) if os.path.isdir(output_dir) else []
+    try:
+        shards = check_shards(manifests, allow_partial)
+    except ValueError as e:
+        logging.error(f"Cannot merge shards in {output_dir}: {str(e)}")
+        return False
+
+    results = collect_results(manifests)
+    logging.info(f"Merging {len(results)} results from {len(manifests)}/{shards} shards")
+
+    images_dir = os.path.join(output_dir, os.path.basename(ITEM_CONFIG['PATHS']['IMAGES']))
+    staging = f"{images_dir}{_MERGING_SUFFIX}"
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    ensure_directory(staging)
+    store = ImageStore(staging)
+    names = FilenameIndex(staging)
+
+    merged = []
+    renamed = []
+    counts = {}
+    # 处理异常时的结果ID可能是'unknown'，排在最后
+    for item_id in sorted(results, key=lambda item_id: (isinstance(item_id, str), item_id)):
+        result, shard_store = results[item_id]
+        if result['status'] == 'success':
+            filename, _ = names.reserve(result['name'])
+            if filename is None:
+                result = {'id': result['id'], 'name': result['name'], 'isCash': result['isCash'],
+                          'status': 'skipped', 'reason': 'File already exists'}
+            else:
+                store.import_file(shard_store.path_of(result['filename']), filename,
+                                  result.get('sha256'))
+                if filename != result['filename']:
+                    renamed.append({'id': item_id, 'from': result['filename'], 'to': filename})
+                    result = dict(result, filename=filename)
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        merged.append(result)
+    store.close()
+    _replace_dir(staging, images_dir)
+
+    json_filename = os.path.join(
+        output_dir, f"{os.path.basename(ITEM_CONFIG['PATHS']['JSON_BASE'])}_merged.json")
+    write_json_array(merged, json_filename)
+    manifest_path = os.path.join(output_dir, MERGE_MANIFEST_FILE)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'shards': shards,
+            'merged_shards': [manifest['shard'] for manifest in manifests],
+            'run': manifests[0]['run'],
+            'results': os.path.basename(json_filename),
+            'counts': counts,
+            'renamed': renamed,
+            'merged_at': datetime.now().isoformat(timespec='seconds'),
+        }, f, ensure_ascii=False, indent=2)
+
+    statuses = ', '.join(f"{count} {status}" for status, count in sorted(counts.items()))
+    logging.info(f"Saved {len(merged)} merged results to {json_filename} ({statuses or 'no results'})")
+    logging.info(f"Merged images in {images_dir}, {len(renamed)} renamed to resolve collisions")
+
+    if ITEM_CONFIG['ATLAS']['ENABLED']:
+        try:
+            build_configured_atlas(
+                ImageStore(images_dir), results_file=json_filename,
+                output_dir=os.path.join(output_dir, os.path.basename(ITEM_CONFIG['PATHS']['ATLAS'])))
+        except Exception as e:
+            logging.error(f"✗ Failed to build atlas: {str(e)}")
+    return True
@@ -0,0 +1,95 @@
+import os
+import threading
+
+from config import COMMON_CONFIG
+
+
+class FilenameIndex:
+    """
+    图片目录的内存文件名索引
+
+    每次下载开始时扫描一次目录，之后由索引在内存中分配文件名，
+    不再逐个调用os.path.exists探测，多个线程同时分配也不会拿到相同的文件名。
+    """
+
+    def __init__(self, directory: str, extra_names=(), strategy: str = None, pattern: str = None):
+        file_config = COMMON_CONFIG['FILE_HANDLING']
+        self.directory = directory
+        self.strategy = strategy or file_config['STRATEGY']
+        self.pattern = pattern or file_config['RENAME_PATTERN']
+        self._lock = threading.Lock()
+        self._taken = set(extra_names)
+        # 每个基础文件名下一个待尝试的序号
+        self._next_index = {}
+
+        if os.path.isdir(directory):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.name.startswith('.'):
+                        self._taken.add(entry.name)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._taken)
+
+    def __contains__(self, filename: str) -> bool:
+        with self._lock:
+            return filename in self._taken
+
+    def _format(self, name: str, index: int, ext: str) -> str:
+        return self.pattern.format(name=name, index=index, ext=ext)
+
+    def reserve(self, name: str, original_ext: str = '.png') -> tuple:
+        """
+        按配置策略为文件分配文件名
+
+        Args:
+            name: 原始文件名（不含扩展名）
+            original_ext: 文件扩展名，默认为.png
+
+        Returns:
+            tuple: (文件名, 原始文件名是否已存在)
+                策略为skip且文件已存在时文件名为None
+        """
+        ext = original_ext if original_ext.startswith('.') else f'.{original_ext}'
+        filename = f"{name}{ext}"
+
+        with self._lock:
+            if filename not in self._taken:
+                self._taken.add(filename)
+                return filename, False
+
+            if self.strategy == 'skip':
+                return None, True
+            if self.strategy == 'overwrite':
+                return filename, True
+            if self.strategy != 'rename':
+                return None, True
+
+            key = (name, ext)
+            index = self._next_index.get(key, 1)
+            new_name = self._format(name, index, ext)
+            while new_name in self._taken:
+                index += 1
+                new_name = self._format(name, index, ext)
+            self._taken.add(new_name)
+            self._next_index[key] = index + 1
+            return new_name, True
+
+    def claim(self, filename: str) -> bool:
+        """
+        占用指定的文件名，不按策略改名
+
+        Returns:
+            bool: 文件名之前未被占用时为True
+        """
+        with self._lock:
+            if filename in self._taken:
+                return False
+            self._taken.add(filename)
+            return True
+
+    def release(self, filename: str):
+        """下载失败时归还未写入的文件名"""
+        with self._lock:
+            self._taken.discard(filename)
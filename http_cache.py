@@ -0,0 +1,350 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from config import COMMON_CONFIG
+
+# 需要随缓存一起保存的响应头；缓存保存的是解压后的内容，Content-Length改为解压后的字节数
+_STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key           TEXT PRIMARY KEY,
+    url           TEXT NOT NULL,
+    etag          TEXT,
+    last_modified TEXT,
+    headers       TEXT NOT NULL,
+    size          INTEGER NOT NULL,
+    last_access   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+"""
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class HttpCache:
+    """
+    本地HTTP缓存
+
+    响应内容按请求地址的哈希保存在缓存目录中，ETag/Last-Modified等校验信息保存在SQLite索引里。
+    再次请求时发送条件请求，服务器返回304时直接使用本地内容。
+    缓存总大小超过上限时按最近访问时间淘汰（LRU）。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(directory, 'index.db'), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._total_size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        # 缓存上限调小后，启动时先淘汰超出的部分
+        with self._lock:
+            self._evict()
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(url: str, params: dict = None) -> str:
+        """根据请求地址和参数生成缓存键"""
+        if params:
+            url = f"{url}?{urlencode(sorted(params.items()))}"
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def body_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def lookup(self, key: str):
+        """
+        查找缓存条目
+
+        Returns:
+            dict: 缓存条目，不存在或内容文件丢失时返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, etag, last_modified, headers, size FROM entries WHERE key = ?",
+                (key,)).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(self.body_path(key)):
+            self._delete(key, row[4])
+            return None
+        return {
+            'key': key,
+            'url': row[0],
+            'etag': row[1],
+            'last_modified': row[2],
+            'headers': json.loads(row[3]),
+            'size': row[4]
+        }
+
+    @staticmethod
+    def conditional_headers(entry) -> dict:
+        """根据缓存条目生成条件请求头"""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def hit(self, entry, not_modified: requests.Response, stream: bool = False) -> requests.Response:
+        """
+        服务器返回304时，用缓存内容构造一个200响应
+
+        Args:
+            entry: lookup返回的缓存条目
+            not_modified: 服务器返回的304响应
+            stream: 为True时响应内容按需从缓存文件中读取，不一次性载入内存
+
+        Returns:
+            requests.Response: 内容来自本地缓存的响应，from_cache属性为True；
+            缓存内容在lookup之后已被淘汰时返回None，调用方需要重新发送不带条件的请求
+        """
+        not_modified.close()
+        try:
+            body = _CachedBody(self.body_path(entry['key']))
+        except FileNotFoundError:
+            return None
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.headers['Content-Length'] = str(entry['size'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = not_modified.url
+        response.request = not_modified.request
+        response.elapsed = not_modified.elapsed
+        response.raw = body
+        if not stream:
+            response.content
+        response.from_cache = True
+
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?",
+                (time.time(), entry['key']))
+            self._conn.commit()
+            self.stats['hits'] += 1
+        return response
+
+    def store(self, key: str, response: requests.Response, stream: bool = False):
+        """
+        保存带有ETag或Last-Modified的200响应，没有校验信息的响应无法重新验证，不做缓存
+
+        Args:
+            key: 缓存键
+            response: 服务器返回的响应
+            stream: 为True时不读取响应内容，而是在调用方读取响应时同步写入缓存
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        with self._lock:
+            self.stats['misses'] += 1
+        if response.status_code != 200 or not (etag or last_modified):
+            return
+
+        path = self.body_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+
+        if stream:
+            response.raw = _CachingReader(
+                response.raw, tmp_path,
+                lambda size: self._commit(key, response, tmp_path, size))
+            return
+
+        content = response.content
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+        except OSError as e:
+            logging.warning(f"Failed to cache {response.url}: {str(e)}")
+            return
+        self._commit(key, response, tmp_path, len(content))
+
+    def _commit(self, key: str, response: requests.Response, tmp_path: str, size: int):
+        try:
+            os.replace(tmp_path, self.body_path(key))
+        except OSError as e:
+            logging.warning(f"Failed to cache {response.url}: {str(e)}")
+            return
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        headers = {name: response.headers[name]
+                   for name in _STORED_HEADERS if name in response.headers}
+        headers['Content-Length'] = str(size)
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, response.url, etag, last_modified,
+                 json.dumps(headers), size, time.time()))
+            self._total_size += size - (old[0] if old else 0)
+            self.stats['stores'] += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # 调用方需持有self._lock
+        while self._total_size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                try:
+                    os.remove(self.body_path(key))
+                except OSError:
+                    pass
+                self._total_size -= size
+                self.stats['evictions'] += 1
+                if self._total_size <= self.max_bytes:
+                    break
+
+    def _delete(self, key: str, size: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._conn.commit()
+            self._total_size -= size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _CachedBody:
+    """缓存文件的读取器，读到末尾后自动关闭文件"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+
+    def read(self, amt=None):
+        if self._file.closed:
+            return b''
+        chunk = self._file.read(-1 if amt is None else amt)
+        if not chunk:
+            self._file.close()
+        return chunk
+
+    def close(self):
+        self._file.close()
+
+
+class _CachingReader:
+    """
+    包装响应的原始数据流，调用方读取内容时同步写入缓存临时文件，
+    完整读到末尾后才提交到缓存，中途关闭则丢弃临时文件
+    """
+
+    def __init__(self, raw, tmp_path: str, on_complete):
+        self._raw = raw
+        self._tmp_path = tmp_path
+        self._on_complete = on_complete
+        self._file = open(tmp_path, 'wb')
+        self._size = 0
+
+    def read(self, amt=None):
+        chunk = self._raw.read(amt, decode_content=True)
+        if self._file is None:
+            return chunk
+        if chunk:
+            self._file.write(chunk)
+            self._size += len(chunk)
+        else:
+            self._file.close()
+            self._file = None
+            self._on_complete(self._size)
+        return chunk
+
+    def close(self):
+        self._raw.close()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+
+    def release_conn(self):
+        self._raw.release_conn()
+
+
+def get_max_bytes() -> int:
+    return int(COMMON_CONFIG['HTTP_CACHE']['MAX_SIZE_MB'] * 1024 * 1024)
+
+
+def get_http_cache():
+    """
+    获取进程内共享的HTTP缓存，未启用时返回None
+    """
+    global _cache
+    if not COMMON_CONFIG['HTTP_CACHE']['ENABLED']:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = HttpCache(COMMON_CONFIG['HTTP_CACHE']['DIRECTORY'], get_max_bytes())
+    return _cache
+
+
+@contextmanager
+def cache_in_directory(directory: str):
+    """
+    在with块内使用保存在指定目录的共享缓存，结束后关闭，之后的请求按配置重新创建缓存；
+    未启用缓存时不做处理，配置本身不做修改
+
+    Args:
+        directory: 缓存目录，例如分片目录下的 .http_cache
+    """
+    global _cache
+    if not COMMON_CONFIG['HTTP_CACHE']['ENABLED']:
+        yield
+        return
+    with _cache_lock:
+        previous, _cache = _cache, HttpCache(directory, get_max_bytes())
+    if previous is not None:
+        previous.close()
+    try:
+        yield
+    finally:
+        with _cache_lock:
+            cache, _cache = _cache, None
+        if cache is not None:
+            cache.close()
+
+
+def format_cache_stats() -> str:
+    """将缓存统计格式化为日志文本"""
+    if _cache is None:
+        return "disabled"
+    stats = _cache.stats
+    total = stats['hits'] + stats['misses']
+    ratio = stats['hits'] / total if total else 0.0
+    return (f"{stats['hits']} hits (304), {stats['misses']} misses ({ratio:.1%} hit rate), "
+            f"{stats['stores']} stored, {stats['evictions']} evicted")
@@ -0,0 +1,194 @@
+from contextlib import contextmanager
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config import COMMON_CONFIG
+from metrics import stage_timer
+from rate_control import get_max_workers
+
+# 进程内共享的会话，所有工作线程复用同一个连接池
+_session = None
+_session_lock = threading.Lock()
+_request_count = 0
+_request_count_lock = threading.Lock()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """记录建立连接耗时的连接"""
+
+    def connect(self):
+        with stage_timer('http_connect'):
+            super().connect()
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """记录建立连接（含TLS握手）耗时的连接"""
+
+    def connect(self):
+        with stage_timer('http_connect'):
+            super().connect()
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """新建连接时记录http_connect阶段耗时的适配器"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+def get_pool_size() -> int:
+    """
+    获取连接池大小，未单独配置时与下载线程数保持一致
+    """
+    pool_size = COMMON_CONFIG['CONNECTION_POOL']['POOL_SIZE']
+    if pool_size is None:
+        pool_size = get_max_workers()
+    return max(1, int(pool_size))
+
+
+def create_session(pool_size: int = None) -> requests.Session:
+    """
+    创建带连接池的会话，重试统一由safe_request的重试策略处理，连接层不再重试
+
+    Args:
+        pool_size: 每个主机保持的最大连接数，默认读取配置
+
+    Returns:
+        requests.Session: 新建的会话
+    """
+    if pool_size is None:
+        pool_size = get_pool_size()
+
+    session = requests.Session()
+    adapter = TimedHTTPAdapter(
+        pool_connections=COMMON_CONFIG['CONNECTION_POOL']['POOL_CONNECTIONS'],
+        pool_maxsize=pool_size,
+        pool_block=COMMON_CONFIG['CONNECTION_POOL']['POOL_BLOCK'],
+        max_retries=0,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    获取进程内共享的会话，首次调用时创建（线程安全）
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def record_request():
+    """记录一次经由共享会话发出的请求，用于统计连接复用情况"""
+    global _request_count
+    with _request_count_lock:
+        _request_count += 1
+
+
+def close_session():
+    """
+    关闭共享会话并重置统计，下次调用get_session时会重新创建
+    """
+    global _session, _request_count
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+    with _request_count_lock:
+        _request_count = 0
+
+
+@contextmanager
+def session_with_pool_size(pool_size: int):
+    """
+    在with块内使用按指定连接池大小创建的共享会话，结束后关闭，之后的请求按配置重新创建会话
+
+    Args:
+        pool_size: 每个主机保持的最大连接数
+    """
+    global _session
+    with _session_lock:
+        previous, _session = _session, create_session(pool_size)
+    if previous is not None:
+        previous.close()
+    try:
+        yield
+    finally:
+        close_session()
+
+
+def get_pool_stats() -> dict:
+    """
+    获取共享连接池的连接复用统计
+
+    Returns:
+        dict: 例如 {
+            'requests': 120,        # 经由共享会话发出的请求数
+            'connections': 3,       # 实际新建的连接数
+            'reused': 117,          # 复用已有连接的请求数
+            'hosts': {'maplestory.io': {'connections': 3, 'requests': 120}}
+        }
+    """
+    hosts = {}
+    total_connections = 0
+    pool_requests = 0
+
+    session = _session
+    if session is not None:
+        seen = set()
+        for adapter in session.adapters.values():
+            if id(adapter) in seen:
+                continue
+            seen.add(id(adapter))
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host_stats = hosts.setdefault(
+                    pool.host, {'connections': 0, 'requests': 0})
+                host_stats['connections'] += pool.num_connections
+                host_stats['requests'] += pool.num_requests
+                total_connections += pool.num_connections
+                pool_requests += pool.num_requests
+
+    with _request_count_lock:
+        request_count = _request_count
+
+    total_requests = max(request_count, pool_requests)
+    return {
+        'requests': total_requests,
+        'connections': total_connections,
+        'reused': max(0, total_requests - total_connections),
+        'hosts': hosts
+    }
+
+
+def format_pool_stats(stats: dict = None) -> str:
+    """将连接池统计格式化为日志文本"""
+    if stats is None:
+        stats = get_pool_stats()
+    ratio = stats['reused'] / stats['requests'] if stats['requests'] else 0.0
+    return (f"{stats['requests']} requests over {stats['connections']} connections, "
+            f"{stats['reused']} reused ({ratio:.1%})")
@@ -0,0 +1,112 @@
+import os
+
+from config import ITEM_CONFIG
+from downloader.engine import PooledPostProcessor
+
+# Pillow支持的重采样滤镜，对应Image.Resampling中的同名成员
+RESAMPLING_FILTERS = ('nearest', 'box', 'bilinear', 'hamming', 'bicubic', 'lanczos')
+
+
+def get_variant_dir(scale, resample: str) -> str:
+    """派生尺寸所在的子目录，例如 2x_nearest"""
+    return f"{scale:g}x_{resample}"
+
+
+def derive_variants(source_path: str, filename: str, output_dir: str, sizes, filters) -> list:
+    """
+    从原始尺寸的图标生成各个倍数和重采样滤镜的版本，在工作进程中执行
+
+    比原图新的已有版本直接跳过，重复运行时只处理新下载或更新过的图标
+
+    Args:
+        source_path: 原始尺寸图标的路径
+        filename: 图标文件名，派生版本使用相同的文件名
+        output_dir: 派生版本的根目录
+        sizes: 相对原始尺寸的倍数，例如 [1, 2, 4]
+        filters: 重采样滤镜名称，例如 ['nearest', 'lanczos']
+
+    Returns:
+        list: 各版本相对output_dir的路径
+    """
+    from PIL import Image
+
+    source_mtime = os.stat(source_path).st_mtime
+    outputs = []
+    with Image.open(source_path) as image:
+        image.load()
+        for scale in sizes:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            for resample in filters:
+                relative = os.path.join(get_variant_dir(scale, resample), filename)
+                outputs.append(relative)
+                path = os.path.join(output_dir, relative)
+                if os.path.exists(path) and os.stat(path).st_mtime >= source_mtime:
+                    continue
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if size == image.size:
+                    variant = image
+                else:
+                    variant = image.resize(size, getattr(Image.Resampling, resample.upper()))
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                try:
+                    variant.save(tmp_path, format='PNG')
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+    return outputs
+
+
+class VariantProcessor(PooledPostProcessor):
+    """
+    在进程池中为下载好的图标生成多个尺寸，与下载线程互不占用CPU
+
+    输出目录下的 manifest.json 记录 文件名 -> 各版本路径。
+
+    Args:
+        output_dir: 派生版本的根目录
+        sizes: 相对原始尺寸的倍数
+        filters: 重采样滤镜名称
+        processes: 进程数，None表示CPU核数
+    """
+
+    action = 'derive icon sizes for'
+
+    def __init__(self, output_dir: str, sizes, filters, processes: int = None):
+        unknown = [name for name in filters if name not in RESAMPLING_FILTERS]
+        if unknown:
+            raise ValueError(f"未知的重采样滤镜: {', '.join(unknown)}")
+        if not sizes or any(scale <= 0 for scale in sizes):
+            raise ValueError(f"无效的图标倍数: {sizes}")
+
+        self.sizes = list(sizes)
+        self.filters = list(filters)
+        self.stats = {'sources': 0, 'variants': 0, 'failed': 0}
+        super().__init__(output_dir, derive_variants, (self.sizes, self.filters), processes)
+
+    def record(self, outputs: list):
+        self.stats['sources'] += 1
+        self.stats['variants'] += len(outputs)
+
+    def format_stats(self) -> str:
+        """将处理统计格式化为日志文本"""
+        return (f"{self.stats['sources']} icons -> {self.stats['variants']} variants "
+                f"({', '.join(get_variant_dir(s, f) for s in self.sizes for f in self.filters)}), "
+                f"{self.stats['failed']} failed, {self.processes} processes")
+
+
+def open_variant_processor(output_dir: str = None):
+    """
+    按ITEM_CONFIG['VARIANTS']创建派生尺寸处理器，未启用时返回None
+
+    Args:
+        output_dir: 派生版本的根目录，默认为ITEM_CONFIG['PATHS']['VARIANTS']
+    """
+    variants = ITEM_CONFIG['VARIANTS']
+    if not variants['ENABLED']:
+        return None
+    return VariantProcessor(
+        output_dir or ITEM_CONFIG['PATHS']['VARIANTS'],
+        variants['SIZES'], variants['FILTERS'], variants['PROCESSES'])
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+from config import COMMON_CONFIG
+
+# 内容寻址模式下保存去重后图片的目录和文件名->摘要清单
+BLOBS_DIR = '.blobs'
+MANIFEST_FILE = 'manifest.json'
+# 下载中的临时文件后缀
+PARTIAL_SUFFIX = '.part'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class ImageStore:
+    """
+    图片保存
+
+    plain模式: 图片按文件名直接写入目录（原有行为）
+    content模式: 图片按内容的SHA-256摘要只保存一份到 .blobs/ 目录，
+        再根据LINK_MODE为每个文件名创建硬链接('hardlink')，或只记录到清单('manifest')。
+    content模式会在目录下的 manifest.json 中记录 文件名 -> 摘要；plain模式的目录中只有图片。
+    """
+
+    def __init__(self, directory: str, mode: str = None, link_mode: str = None):
+        file_config = COMMON_CONFIG['FILE_HANDLING']
+        self.directory = directory
+        self.mode = mode or file_config['STORE_MODE']
+        self.link_mode = link_mode or file_config['LINK_MODE']
+        if self.mode not in ('plain', 'content'):
+            raise ValueError(f"未知的图片保存模式: {self.mode}")
+        if self.link_mode not in ('hardlink', 'manifest'):
+            raise ValueError(f"未知的链接模式: {self.link_mode}")
+
+        self.blobs_dir = os.path.join(directory, BLOBS_DIR)
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self.stats = {'written': 0, 'deduplicated': 0, 'bytes_saved': 0}
+        self._lock = threading.Lock()
+        self._manifest = self._load_manifest()
+        self._dirty = False
+
+    def _load_manifest(self) -> dict:
+        if self.mode == 'plain' or not os.path.exists(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"Ignoring unreadable manifest {self.manifest_path}: {str(e)}")
+            return {}
+
+    def blob_path(self, digest: str, ext: str = '.png') -> str:
+        return os.path.join(self.blobs_dir, digest[:2], f"{digest}{ext}")
+
+    def exists(self, file_path: str) -> bool:
+        """
+        判断文件名是否已被占用，manifest模式下图片不在目录中，需要同时查清单
+        """
+        if os.path.exists(file_path):
+            return True
+        if self.mode == 'content' and self.link_mode == 'manifest':
+            with self._lock:
+                return os.path.basename(file_path) in self._manifest
+        return False
+
+    def names(self) -> list:
+        """
+        获取只记录在清单中、目录里没有实际文件的文件名（manifest模式）
+        """
+        if self.mode == 'content' and self.link_mode == 'manifest':
+            with self._lock:
+                return list(self._manifest)
+        return []
+
+    def path_of(self, filename: str) -> str:
+        """获取文件名对应图片在磁盘上的实际路径，manifest模式下为内容文件的路径"""
+        if self.mode == 'content' and self.link_mode == 'manifest':
+            digest = self.digest_of(filename)
+            if digest is not None:
+                return self.blob_path(digest, os.path.splitext(filename)[1])
+        return os.path.join(self.directory, filename)
+
+    def digest_of(self, filename: str):
+        """获取文件名对应的内容摘要，没有记录时返回None"""
+        with self._lock:
+            return self._manifest.get(filename)
+
+    def save(self, data: bytes, filename: str) -> dict:
+        """
+        保存图片内容
+
+        Args:
+            data: 图片的二进制内容
+            filename: 文件名，例如 'Cape.png'
+
+        Returns:
+            dict: {'sha256': 摘要, 'size': 字节数, 'deduplicated': 是否复用了已有内容}
+        """
+        return self.save_stream([data], filename, len(data))
+
+    def save_stream(self, chunks, filename: str, expected_length: int = None) -> dict:
+        """
+        将分块的图片内容流式写入临时文件，校验通过后再原子地重命名为最终文件，
+        中途失败不会留下不完整的图片
+
+        Args:
+            chunks: 可迭代的二进制块，例如 response.iter_content(CHUNK_SIZE)
+            filename: 文件名，例如 'Cape.png'
+            expected_length: 期望的字节数（Content-Length），None表示不校验长度
+
+        Returns:
+            dict: {'sha256': 摘要, 'size': 字节数, 'deduplicated': 是否复用了已有内容}
+
+        Raises:
+            ValueError: 内容长度不符或不是有效的PNG
+        """
+        file_path = os.path.join(self.directory, filename)
+        ext = os.path.splitext(filename)[1]
+        if self.mode == 'plain':
+            tmp_dir = self.directory
+        else:
+            tmp_dir = self.blobs_dir
+            os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, f".{filename}.{threading.get_ident()}{PARTIAL_SUFFIX}")
+
+        sha256 = hashlib.sha256()
+        size = 0
+        head = b''
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if len(head) < len(PNG_SIGNATURE):
+                        head += chunk[:len(PNG_SIGNATURE) - len(head)]
+                    sha256.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            if expected_length is not None and size != expected_length:
+                raise ValueError(
+                    f"incomplete body: got {size} of {expected_length} bytes")
+            if ext.lower() == '.png' and head != PNG_SIGNATURE:
+                raise ValueError("response is not a PNG image")
+
+            digest = sha256.hexdigest()
+            deduplicated = False
+            if self.mode == 'plain':
+                os.replace(tmp_path, file_path)
+            else:
+                blob = self.blob_path(digest, ext)
+                if os.path.exists(blob):
+                    deduplicated = True
+                    os.remove(tmp_path)
+                else:
+                    os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    os.replace(tmp_path, blob)
+                if self.link_mode == 'hardlink':
+                    _link(blob, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._manifest[filename] = digest
+            self._dirty = True
+            if deduplicated:
+                self.stats['deduplicated'] += 1
+                self.stats['bytes_saved'] += size
+            else:
+                self.stats['written'] += 1
+
+        return {'sha256': digest, 'size': size, 'deduplicated': deduplicated}
+
+    def import_file(self, source_path: str, filename: str, digest: str = None) -> dict:
+        """
+        导入其他目录中已下载的图片，plain模式下优先创建硬链接，不复制内容
+
+        Args:
+            source_path: 图片文件的路径
+            filename: 在当前目录中使用的文件名
+            digest: 已知的内容摘要，None表示读取文件计算
+
+        Returns:
+            dict: 与save_stream相同
+        """
+        if self.mode != 'plain':
+            with open(source_path, 'rb') as f:
+                chunks = iter(lambda: f.read(COMMON_CONFIG['REQUEST']['CHUNK_SIZE']), b'')
+                return self.save_stream(chunks, filename)
+
+        if digest is None:
+            sha256 = hashlib.sha256()
+            with open(source_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(COMMON_CONFIG['REQUEST']['CHUNK_SIZE']), b''):
+                    sha256.update(chunk)
+            digest = sha256.hexdigest()
+        file_path = os.path.join(self.directory, filename)
+        tmp_path = os.path.join(self.directory, f".{filename}.{threading.get_ident()}{PARTIAL_SUFFIX}")
+        try:
+            try:
+                os.link(source_path, tmp_path)
+            except OSError:
+                shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._manifest[filename] = digest
+            self._dirty = True
+            self.stats['written'] += 1
+        return {'sha256': digest, 'size': os.path.getsize(file_path), 'deduplicated': False}
+
+    def cleanup_partials(self) -> int:
+        """
+        删除上次运行中断时留下的临时文件
+
+        Returns:
+            int: 删除的文件数
+        """
+        removed = 0
+        for directory in (self.directory, self.blobs_dir):
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.') and entry.name.endswith(PARTIAL_SUFFIX):
+                        os.remove(entry.path)
+                        removed += 1
+        if removed:
+            logging.info(f"Removed {removed} partial downloads from {self.directory}")
+        return removed
+
+    def close(self):
+        """将文件名->摘要清单写入磁盘，plain模式不写清单"""
+        with self._lock:
+            if not self._dirty or self.mode == 'plain':
+                return
+            tmp_path = f"{self.manifest_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+            self._dirty = False
+
+    def format_stats(self) -> str:
+        """将保存统计格式化为日志文本"""
+        return (f"{self.stats['written']} written, {self.stats['deduplicated']} deduplicated "
+                f"({self.stats['bytes_saved']} bytes saved), mode={self.mode}")
+
+
+def get_expected_length(response):
+    """
+    获取响应体的期望长度，内容经过压缩编码或没有Content-Length时返回None
+    """
+    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    length = response.headers.get('Content-Length')
+    return int(length) if length and length.isdigit() else None
+
+
+def _link(blob: str, file_path: str):
+    """为文件名创建指向内容文件的硬链接，文件系统不支持硬链接时退回复制"""
+    if os.path.exists(file_path):
+        if os.path.samefile(blob, file_path):
+            return
+        os.remove(file_path)
+    try:
+        os.link(blob, file_path)
+    except OSError:
+        shutil.copyfile(blob, file_path)
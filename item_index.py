@@ -0,0 +1,301 @@
+"""
+已下载物品的本地索引
+
+下载结果由结果文件的写线程同时写入SQLite索引，记录每个CMS版本中各物品的名称、isCash、分类、
+图片路径和内容摘要。按ID查找、按名称全文搜索，以及与新的物品列表比较找出尚未下载的物品，
+都只需要查询索引，不需要重新读取各次运行的结果文件。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import ITEM_CONFIG
+from item_list import batched
+from result_sink import iter_jsonl
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    cms_version TEXT NOT NULL,
+    item_id     INTEGER NOT NULL,
+    name        TEXT,
+    is_cash     INTEGER,
+    category    TEXT,
+    path        TEXT NOT NULL,
+    sha256      TEXT,
+    updated_at  REAL NOT NULL,
+    PRIMARY KEY (cms_version, item_id)
+);
+CREATE INDEX IF NOT EXISTS items_by_id ON items (item_id);
+CREATE INDEX IF NOT EXISTS items_by_sha256 ON items (sha256);
+"""
+
+# 名称的全文索引，由触发器与items表保持一致
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    name, content='items', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF name ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+    INSERT INTO items_fts (rowid, name) VALUES (new.rowid, new.name);
+END;
+"""
+
+_COLUMNS = "cms_version, item_id, name, is_cash, category, path, sha256, updated_at"
+
+# 每批写入或查询的物品数
+_BATCH_SIZE = 500
+
+# 多个分片进程同时写入时等待锁的时间(秒)
+_BUSY_TIMEOUT = 30
+
+
+def get_category(api: dict = None) -> str:
+    """根据筛选参数生成分类，例如 Equip/Armor/Cape"""
+    params = (api or ITEM_CONFIG['API'])['PARAMS']
+    parts = [params.get('overallCategoryFilter'), params.get('categoryFilter'),
+             params.get('subCategoryFilter')]
+    return '/'.join(part for part in parts if part)
+
+
+def _to_entry(row) -> dict:
+    return {
+        'cms_version': row[0],
+        'id': row[1],
+        'name': row[2],
+        'isCash': None if row[3] is None else bool(row[3]),
+        'category': row[4],
+        'path': row[5],
+        'sha256': row[6],
+        'updated_at': row[7],
+    }
+
+
+def _to_match_query(text: str) -> str:
+    """将搜索词转换为FTS5查询，每个词按前缀匹配，所有词都要出现"""
+    terms = text.split()
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+class ItemIndex:
+    """
+    基于SQLite的已下载物品索引，以 (CMS版本, 物品ID) 为键
+
+    当前SQLite不支持FTS5时，名称搜索退回为LIKE查询。
+
+    Args:
+        path: 索引文件
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=_BUSY_TIMEOUT, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        try:
+            self._conn.executescript(_FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            logging.warning(f"SQLite FTS5 unavailable, name search falls back to LIKE: {str(e)}")
+            self.fts = False
+        self._conn.commit()
+
+    def add(self, entries):
+        """
+        写入或更新物品
+
+        Args:
+            entries: 可迭代的字典，包含cms_version、id、name、isCash、category、path、sha256
+        """
+        now = time.time()
+        rows = [(entry['cms_version'], entry['id'], entry.get('name'),
+                 None if entry.get('isCash') is None else int(bool(entry['isCash'])),
+                 entry.get('category'), entry['path'], entry.get('sha256'), now)
+                for entry in entries]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT INTO items ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (cms_version, item_id) DO UPDATE SET "
+                "name = excluded.name, is_cash = excluded.is_cash, category = excluded.category, "
+                "path = excluded.path, sha256 = excluded.sha256, updated_at = excluded.updated_at",
+                rows)
+            self._conn.commit()
+
+    def get(self, item_id: int, cms_version: str = None) -> list:
+        """
+        按物品ID查找
+
+        Returns:
+            list: 各CMS版本中的记录，新版本在前
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM items WHERE item_id = ? "
+                "AND (? IS NULL OR cms_version = ?) ORDER BY cms_version DESC",
+                (item_id, cms_version, cms_version)).fetchall()
+        return [_to_entry(row) for row in rows]
+
+    def find_by_hash(self, sha256: str) -> list:
+        """查找内容摘要相同的图标"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM items WHERE sha256 = ? ORDER BY cms_version DESC, item_id",
+                (sha256,)).fetchall()
+        return [_to_entry(row) for row in rows]
+
+    def search(self, text: str, cms_version: str = None, limit: int = 20) -> list:
+        """
+        按名称搜索，每个词按前缀匹配
+
+        Returns:
+            list: 匹配的记录，按相关度排序（不支持FTS5时按物品ID排序）
+        """
+        if not text.split():
+            return []
+        with self._lock:
+            if self.fts:
+                rows = self._conn.execute(
+                    f"SELECT {', '.join('i.' + column for column in _COLUMNS.split(', '))} "
+                    "FROM items_fts JOIN items i ON i.rowid = items_fts.rowid "
+                    "WHERE items_fts MATCH ? AND (? IS NULL OR i.cms_version = ?) "
+                    "ORDER BY items_fts.rank LIMIT ?",
+                    (_to_match_query(text), cms_version, cms_version, limit)).fetchall()
+            else:
+                rows = self._conn.execute(
+                    f"SELECT {_COLUMNS} FROM items WHERE name LIKE ? "
+                    "AND (? IS NULL OR cms_version = ?) ORDER BY item_id LIMIT ?",
+                    (f"%{text.strip()}%", cms_version, cms_version, limit)).fetchall()
+        return [_to_entry(row) for row in rows]
+
+    def missing(self, item_ids, cms_version: str) -> list:
+        """
+        找出索引中指定CMS版本还没有的物品
+
+        Args:
+            item_ids: 可迭代的物品ID，例如新获取的分类列表
+            cms_version: 例如 'CMS/202'
+
+        Returns:
+            list: 没有记录的物品ID，顺序与item_ids相同
+        """
+        ids = list(dict.fromkeys(item_ids))
+        present = set()
+        with self._lock:
+            for batch in batched(ids, _BATCH_SIZE):
+                placeholders = ','.join('?' * len(batch))
+                present.update(row[0] for row in self._conn.execute(
+                    f"SELECT item_id FROM items WHERE cms_version = ? AND item_id IN ({placeholders})",
+                    (cms_version, *batch)))
+        return [item_id for item_id in ids if item_id not in present]
+
+    def summary(self) -> dict:
+        """按CMS版本统计物品数"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT cms_version, COUNT(*) FROM items GROUP BY cms_version "
+                "ORDER BY cms_version").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def to_index_entry(result: dict, cms_version: str, category: str, images_dir: str):
+    """将下载成功的结果转换为索引记录，其他结果返回None"""
+    if result.get('status') != 'success' or not result.get('filename'):
+        return None
+    return {
+        'cms_version': cms_version,
+        'id': result['id'],
+        'name': result.get('name'),
+        'isCash': result.get('isCash'),
+        'category': category,
+        'path': os.path.join(images_dir, result['filename']),
+        'sha256': result.get('sha256'),
+    }
+
+
+class IndexWriter:
+    """
+    结果文件的写线程调用的索引写入器，每批结果中下载成功的物品一次写入索引
+
+    Args:
+        index: ItemIndex，关闭写入器时一并关闭
+        cms_version: 例如 'CMS/202'
+        category: 分类，见get_category
+        images_dir: 图片目录，与文件名拼接为索引中的路径
+    """
+
+    def __init__(self, index: ItemIndex, cms_version: str, category: str, images_dir: str):
+        self.index = index
+        self.cms_version = cms_version
+        self.category = category
+        self.images_dir = images_dir
+
+    def write_batch(self, results: list):
+        entries = (to_index_entry(result, self.cms_version, self.category, self.images_dir)
+                   for result in results)
+        self.index.add(entry for entry in entries if entry is not None)
+
+    def close(self):
+        self.index.close()
+
+
+def open_index_writer(api: dict = None, images_dir: str = None):
+    """
+    按ITEM_CONFIG['INDEX']创建索引写入器，未启用时返回None
+
+    Args:
+        api: 结构与ITEM_CONFIG['API']相同的接口配置，默认使用ITEM_CONFIG['API']
+        images_dir: 图片目录，默认为ITEM_CONFIG['PATHS']['IMAGES']
+    """
+    if not ITEM_CONFIG['INDEX']['ENABLED']:
+        return None
+    from utils import get_api_version
+
+    api = api or ITEM_CONFIG['API']
+    return IndexWriter(ItemIndex(ITEM_CONFIG['PATHS']['INDEX']), get_api_version(api['BASE_URL']),
+                       get_category(api), images_dir or ITEM_CONFIG['PATHS']['IMAGES'])
+
+
+def iter_results_file(path: str):
+    """读取结果文件(.json或.jsonl)中的结果"""
+    if path.endswith('.jsonl'):
+        yield from iter_jsonl(path)
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from json.load(f)
+
+
+def import_results(index: ItemIndex, path: str, category: str, images_dir: str) -> int:
+    """
+    将之前运行的结果文件导入索引，CMS版本从结果中的图标地址解析
+
+    Returns:
+        int: 导入的物品数
+    """
+    from utils import get_api_version
+
+    imported = 0
+    for batch in batched(iter_results_file(path), _BATCH_SIZE):
+        entries = []
+        for result in batch:
+            cms_version = get_api_version(result.get('image_url') or '')
+            entry = to_index_entry(result, cms_version, category, images_dir)
+            if entry is not None:
+                entries.append(entry)
+        index.add(entries)
+        imported += len(entries)
+    return imported
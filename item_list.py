@@ -0,0 +1,145 @@
+import codecs
+import json
+from collections import namedtuple
+
+# 物品的精简记录，只保留下载需要的字段
+ItemRecord = namedtuple('ItemRecord', ['id', 'name', 'is_cash'])
+
+_WHITESPACE = ' \t\r\n'
+
+
+def to_record(item: dict) -> ItemRecord:
+    """将API返回的物品字典转换为精简记录"""
+    return ItemRecord(item['id'], item.get('name'), item.get('isCash', False))
+
+
+class JsonArrayParser:
+    """
+    推入式的JSON数组增量解析器，每次feed一段内容，返回其中已经完整的数组元素
+
+    同步和异步下载都可以使用：
+        parser = JsonArrayParser()
+        for chunk in chunks:
+            for value in parser.feed(chunk):
+                ...
+        parser.close()
+    """
+
+    def __init__(self, encoding: str = 'utf-8'):
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder(encoding)()
+        self._buf = ''
+        self._pos = 0
+        self._started = False
+        self.finished = False
+
+    def feed(self, chunk: bytes, final: bool = False) -> list:
+        """
+        解析新到达的内容
+
+        Args:
+            chunk: 新到达的二进制内容
+            final: 是否为最后一段内容
+
+        Returns:
+            list: 本次解析出的完整元素
+
+        Raises:
+            ValueError: 内容不是JSON数组或格式错误
+        """
+        self._buf = self._buf[self._pos:] + self._text_decoder.decode(chunk, final=final)
+        self._pos = 0
+        values = []
+        buf = self._buf
+
+        while not self.finished:
+            pos = self._pos
+            # 跳过空白和分隔符
+            while pos < len(buf) and (buf[pos] in _WHITESPACE or (self._started and buf[pos] == ',')):
+                pos += 1
+            self._pos = pos
+            if pos >= len(buf):
+                break
+
+            if not self._started:
+                if buf[pos] != '[':
+                    raise ValueError("JSON内容不是数组")
+                self._started = True
+                self._pos = pos + 1
+                continue
+
+            if buf[pos] == ']':
+                self.finished = True
+                break
+
+            try:
+                value, end = self._decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # 元素还不完整，等待后续内容
+                if final:
+                    raise ValueError("JSON数组在元素中间被截断")
+                break
+
+            # 标量值可能正好被截断在缓冲区末尾（例如数字），需要读到后续字符才能确定
+            if end >= len(buf) and not final and not isinstance(value, (dict, list)):
+                break
+            self._pos = end
+            values.append(value)
+
+        return values
+
+    def close(self) -> list:
+        """
+        结束解析
+
+        Returns:
+            list: 剩余的完整元素
+
+        Raises:
+            ValueError: 数组不完整
+        """
+        values = self.feed(b'', final=True)
+        if not self.finished:
+            raise ValueError("JSON数组不完整")
+        return values
+
+
+def iter_json_array(chunks, encoding: str = 'utf-8'):
+    """
+    增量解析顶层为数组的JSON，每解析出一个元素就立即返回，不需要先读完整个响应
+
+    数组结束后仍会把chunks读到末尾，响应体被完整读取后才能写入HTTP缓存、连接才能被复用
+
+    Args:
+        chunks: 可迭代的二进制块，例如 response.iter_content(CHUNK_SIZE)
+        encoding: 内容编码
+
+    Yields:
+        数组中的每个元素
+
+    Raises:
+        ValueError: 内容不是JSON数组或格式错误
+    """
+    parser = JsonArrayParser(encoding)
+    for chunk in chunks:
+        if chunk and not parser.finished:
+            yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def iter_items(chunks, encoding: str = 'utf-8'):
+    """增量解析物品列表，逐个返回精简记录"""
+    for item in iter_json_array(chunks, encoding):
+        yield to_record(item)
+
+
+def batched(iterable, size: int):
+    """将可迭代对象按固定大小分批"""
+    batch = []
+    for value in iterable:
+        batch.append(value)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,180 @@
+"""
+非阻塞的日志：下载线程只把日志记录放入队列，由单独的线程写入日志文件和控制台
+
+单个物品的处理过程记录到 crawler.item 日志器，可以单独设置级别和按物品ID抽样；
+警告和错误总是记录。日志文件可以使用每行一个JSON对象的结构化格式。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import zlib
+from datetime import datetime
+
+from config import COMMON_CONFIG, ITEM_CONFIG
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# 单个物品处理过程的日志器
+item_logger = logging.getLogger('crawler.item')
+
+_lock = threading.Lock()
+_state = {'key': None, 'listener': None, 'handler': None, 'log_file': None, 'atexit': False}
+
+
+class ItemSampler(logging.Filter):
+    """
+    每every个物品只保留一个的处理过程日志，按物品ID选取，同一物品的各条日志同时保留或丢弃
+
+    Args:
+        every: 抽样间隔，1表示全部保留
+    """
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, int(every))
+
+    def filter(self, record) -> bool:
+        if self.every == 1 or record.levelno >= logging.WARNING:
+            return True
+        item_id = getattr(record, 'item_id', None)
+        if item_id is None:
+            return True
+        return zlib.crc32(str(item_id).encode('utf-8')) % self.every == 0
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，包含log_item记录的event、item_id和其他字段"""
+
+    def format(self, record) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key in ('event', 'item_id'):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    队列已满时丢弃WARNING以下的新记录并计数，不阻塞下载线程；
+    警告和错误不丢弃，等待队列有空位后放入
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def log_item(level: int, message: str, item_id, event: str, **fields):
+    """
+    记录单个物品的处理过程
+
+    Args:
+        level: 日志级别，例如 logging.INFO
+        message: 日志文本
+        item_id: 物品（或NPC、地图）ID，用于抽样和结构化输出
+        event: 事件名，例如 'processing'、'saved'、'failed'
+        fields: 结构化输出中的其他字段
+    """
+    if item_logger.isEnabledFor(level):
+        item_logger.log(level, message, extra={'item_id': item_id, 'event': event, 'fields': fields})
+
+
+def _get_settings_key(settings: dict, log_dir: str) -> tuple:
+    return (os.path.abspath(log_dir),
+            json.dumps(settings, sort_keys=True, default=str))
+
+
+def setup_logging(log_dir: str = None) -> str:
+    """
+    初始化日志，重复调用时复用已有的队列和处理器，配置或日志目录变化时才重新创建
+
+    Args:
+        log_dir: 日志目录，默认为ITEM_CONFIG['PATHS']['LOGS']
+
+    Returns:
+        str: 日志文件
+    """
+    settings = COMMON_CONFIG['LOGGING']
+    log_dir = log_dir or ITEM_CONFIG['PATHS']['LOGS']
+    key = _get_settings_key(settings, log_dir)
+    with _lock:
+        if _state['key'] == key:
+            return _state['log_file']
+        _stop()
+
+        os.makedirs(log_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M')
+        log_file = os.path.join(log_dir, f'crawler_{timestamp}.log')
+
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        if settings['FORMAT'] == 'json':
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(settings['CONSOLE_LEVEL'])
+        console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+        handler = DroppingQueueHandler(queue.Queue(settings['QUEUE_SIZE'] or 0))
+        listener = logging.handlers.QueueListener(
+            handler.queue, file_handler, console_handler, respect_handler_level=True)
+        root = logging.getLogger()
+        root.setLevel(settings['LEVEL'])
+        root.addHandler(handler)
+        item_logger.setLevel(settings['ITEM_LEVEL'])
+        for old in [f for f in item_logger.filters if isinstance(f, ItemSampler)]:
+            item_logger.removeFilter(old)
+        item_logger.addFilter(ItemSampler(settings['ITEM_SAMPLE']))
+        listener.start()
+
+        if not _state['atexit']:
+            atexit.register(stop_logging)
+        _state.update(key=key, listener=listener, handler=handler, log_file=log_file, atexit=True)
+
+    logging.info(f"Logging setup complete. Log file: {log_file}")
+    return log_file
+
+
+def _stop():
+    handler = _state['handler']
+    if handler is None:
+        return
+    if handler.dropped:
+        # 停止前放入队列，仍会写入日志文件
+        handler.queue.put(logging.makeLogRecord({
+            'name': 'root', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+            'msg': f"Dropped {handler.dropped} log records because the log queue was full"}))
+    logging.getLogger().removeHandler(handler)
+    _state['listener'].stop()
+    for target in _state['listener'].handlers:
+        target.close()
+    _state.update(key=None, listener=None, handler=None, log_file=None)
+
+
+def stop_logging():
+    """写完队列中剩余的日志并关闭日志文件，进程退出时自动调用"""
+    with _lock:
+        _stop()
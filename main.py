@@ -1,7 +1,10 @@
 import json
 from config import ITEM_CONFIG, NPC_CONFIG, MAP_CONFIG
 import downloader.item_download as item_download
-from utils import setup_logging, parse_maplestory_url_params, detect_config_type
+import downloader.batch_download as batch_download
+import downloader.npc_download as npc_download
+import downloader.map_download as map_download
+from utils import setup_logging, parse_maplestory_url_params, detect_config_type, replace_api_version
 import sys
 import re
 
@@ -10,8 +13,8 @@ def display_menu():
     """显示主菜单"""
     print("\n=== 冒险岛资源下载器 ===")
     print("1. 下载装备")
-    print("2. 下载NPC (Coming soon...)")
-    print("3. 下载地图 (Coming soon...)")
+    print("2. 下载NPC")
+    print("3. 下载地图")
     print("0. 退出")
     return input("请选择一个选项 (0-3): ")
 
@@ -34,6 +37,8 @@ def update_config_from_url():
         # 检测配置类型
         config_type = detect_config_type(url)
         print(f"\n检测到的配置类型: {config_type}")
+        if config_type in ('npc', 'map'):
+            return update_base_url_from_url(NPC_CONFIG if config_type == 'npc' else MAP_CONFIG, url)
 
         # 解析参数
         params, is_cash = parse_maplestory_url_params(url)
@@ -89,6 +94,20 @@ def update_config_from_url():
         return False
 
 
+def update_base_url_from_url(config, url):
+    """NPC和地图链接只决定区服和版本"""
+    base_url = replace_api_version(config['API']['BASE_URL'], url)
+    print(f"\n当前API地址: {config['API']['BASE_URL']}")
+    print(f"新的API地址: {base_url}")
+    confirm = input("\n是否使用新的API地址? (y/n): ").lower()
+    if confirm != 'y':
+        print("配置更新取消")
+        return False
+    config['API']['BASE_URL'] = base_url
+    print("配置更新成功")
+    return True
+
+
 def main():
     setup_logging()
 
@@ -96,7 +115,8 @@ def main():
     print("\n=== 冒险岛资源下载器 ===")
     print("1. 通过URL更新配置")
     print("2. 使用当前配置")
-    config_choice = input("\n请选择一个选项 (1/2): ").strip()
+    print("3. 从URL列表文件批量下载装备")
+    config_choice = input("\n请选择一个选项 (1-3): ").strip()
 
     if config_choice == '1':
         if not update_config_from_url():
@@ -104,6 +124,10 @@ def main():
             if confirm.lower() != 'y':
                 print("\n退出...")
                 sys.exit(0)
+    elif config_choice == '3':
+        url_file = input("请输入URL列表文件路径(每行一个URL): ").strip()
+        batch_download.start_batch_download(url_file)
+        sys.exit(0)
     elif config_choice != '2':
         print("无效的选项")
         sys.exit(1)
@@ -126,15 +150,19 @@ def main():
 
         elif choice == '2':
             print("\n=== NPC Download Selected ===")
-            print("功能尚未实现。")
-            # if display_config(NPC_CONFIG):
-            #     npc_download.start_download()
+            if display_config(NPC_CONFIG):
+                print("\n开始下载NPC...")
+                npc_download.start_download()
+            else:
+                print("下载取消。")
 
         elif choice == '3':
             print("\n=== Map Download Selected ===")
-            print("功能尚未实现。")
-            # if display_config(MAP_CONFIG):
-            #     map_download.start_download()
+            if display_config(MAP_CONFIG):
+                print("\n开始下载地图...")
+                map_download.start_download()
+            else:
+                print("下载取消。")
 
         else:
             print("\n无效的选项。请重试。")
@@ -0,0 +1,409 @@
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+import time
+
+from config import COMMON_CONFIG
+
+# 耗时直方图的分桶上限(秒)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# 下载流程中记录耗时的阶段
+STAGES = {
+    'list_fetch': "物品列表请求到收到响应头",
+    'list_body': "读取并解析物品列表",
+    'queue_wait': "物品提交后等待空闲下载线程",
+    'http_connect': "建立TCP/TLS连接",
+    'http_ttfb': "发出请求到收到响应头（新连接包含建立连接的时间）",
+    'http_body': "读取图标内容",
+    'disk_write': "写入图标文件（不含等待网络的时间）",
+    'sink_append': "结果提交到结果输出器",
+    'sink_flush': "结果输出器批量写入JSON Lines文件",
+    'checkpoint_mark': "更新断点记录",
+    'item_total': "单个物品从开始处理到得到结果",
+}
+
+# 汇总时参与比较、用来判断瓶颈的阶段（item_total与其他阶段重叠，不参与比较）
+BOTTLENECK_STAGES = ('queue_wait', 'http_connect', 'http_ttfb', 'http_body',
+                     'disk_write', 'sink_flush', 'checkpoint_mark')
+
+_registry = None
+_registry_lock = threading.Lock()
+_server = None
+
+
+def _label_key(names, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, '')) for name in names)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return f'{{{pairs}}}'
+
+
+class Counter:
+    """只增不减的计数器，按标签值分别计数"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> dict:
+        """标签值元组 -> 计数"""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value:g}"
+                for key, value in sorted(self.values().items())]
+
+
+class Gauge(Counter):
+    """可以任意设置的瞬时值"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """
+    按分桶统计观测值的直方图，与Prometheus的histogram类型对应
+
+    分位数按桶内线性插值估算，精度取决于分桶
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值元组 -> [各桶计数(最后一个为+Inf), 总和]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self) -> dict:
+        """标签值元组 -> (各桶计数, 总和)"""
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+
+    def quantile(self, counts: list, q: float):
+        """按分桶估算分位数，落在+Inf桶中时返回最大的有限分桶上限"""
+        count = sum(counts)
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound
+        return self.buckets[-1]
+
+    def render(self) -> list:
+        lines = []
+        for key, (counts, total) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                labels = _format_labels(self.labelnames + ('le',), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """一次运行中的所有指标"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = Histogram(
+            'crawler_stage_seconds', "Time spent per download stage", ('stage',))
+        self.bytes = Counter(
+            'crawler_bytes_total', "Response bytes read", ('source',))
+        self.responses = Counter(
+            'crawler_http_responses_total', "HTTP responses by status code", ('status',))
+        self.retries = Counter(
+            'crawler_retries_total', "Request retries by reason", ('reason',))
+        self.cache = Counter(
+            'crawler_http_cache_total', "HTTP cache lookups", ('result',))
+        self.items = Counter(
+            'crawler_items_total', "Item results by status", ('status',))
+        self.sink_queue = Gauge(
+            'crawler_result_queue_depth', "Results waiting for the result sink writer")
+        self.metrics = [self.stages, self.bytes, self.responses, self.retries,
+                        self.cache, self.items, self.sink_queue]
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        lines.append("# HELP crawler_uptime_seconds Seconds since metrics were created")
+        lines.append("# TYPE crawler_uptime_seconds gauge")
+        lines.append(f"crawler_uptime_seconds {time.monotonic() - self.started:.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def stage_summary(self) -> dict:
+        """
+        各阶段的耗时统计
+
+        Returns:
+            dict: 例如 {'http_ttfb': {'count': 120, 'total': 3.2, 'mean': 0.027, 'p50': 0.02, 'p95': 0.08}}
+        """
+        summary = {}
+        for (stage,), (counts, total) in self.stages.snapshot().items():
+            count = sum(counts)
+            summary[stage] = {
+                'count': count,
+                'total': total,
+                'mean': total / count if count else 0.0,
+                'p50': self.stages.quantile(counts, 0.5),
+                'p95': self.stages.quantile(counts, 0.95),
+            }
+        return summary
+
+
+def get_metrics():
+    """获取进程内共享的指标，未启用时返回None"""
+    global _registry
+    if _registry is None and COMMON_CONFIG['METRICS']['ENABLED']:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MetricsRegistry()
+    return _registry
+
+
+def reset_metrics():
+    """丢弃已记录的指标，下次调用get_metrics时重新创建"""
+    global _registry
+    with _registry_lock:
+        _registry = None
+
+
+def observe_stage(stage: str, seconds: float):
+    registry = get_metrics()
+    if registry is not None:
+        registry.stages.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """记录with块的耗时，异常退出时同样记录"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def count(metric: str, amount: float = 1, **labels):
+    """
+    计数器加一
+
+    Args:
+        metric: MetricsRegistry中计数器的属性名，例如 'responses'、'retries'
+    """
+    registry = get_metrics()
+    if registry is not None:
+        getattr(registry, metric).inc(amount, **labels)
+
+
+def set_gauge(metric: str, value: float, **labels):
+    registry = get_metrics()
+    if registry is not None:
+        getattr(registry, metric).set(value, **labels)
+
+
+class ChunkTimer:
+    """
+    包装响应内容的分块迭代器，累计等待网络的时间和读取的字节数
+
+    读取与写文件交替进行时，用总耗时减去elapsed即为写文件本身的耗时。
+    迭代结束时按stage记录累计的等待时间。
+
+    Args:
+        chunks: 分块迭代器，例如 response.iter_content(...)
+        source: 字节数计数器的source标签，例如 'icon'、'list'
+        stage: 迭代结束时记录的阶段，None表示不记录
+    """
+
+    def __init__(self, chunks, source: str, stage: str = None):
+        self._chunks = iter(chunks)
+        self.source = source
+        self.stage = stage
+        self.elapsed = 0.0
+        self.bytes = 0
+        self._registry = get_metrics()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.elapsed += time.perf_counter() - start
+            self._finish()
+            raise
+        self.elapsed += time.perf_counter() - start
+        self.bytes += len(chunk)
+        return chunk
+
+    def _finish(self):
+        if self._registry is None or self.stage is None:
+            return
+        self._registry.stages.observe(self.elapsed, stage=self.stage)
+        self._registry.bytes.inc(self.bytes, source=self.source)
+        self.stage = None
+
+
+def record_download(chunks: ChunkTimer, seconds: float):
+    """记录一次边下载边写文件的耗时，写文件的耗时为总耗时减去等待网络的时间"""
+    registry = get_metrics()
+    if registry is not None:
+        registry.stages.observe(max(0.0, seconds - chunks.elapsed), stage='disk_write')
+
+
+def format_stage_summary(registry=None) -> list:
+    """
+    将各阶段耗时格式化为日志文本，每个阶段一行，最后一行给出累计耗时最多的阶段
+
+    各阶段的总耗时是所有线程耗时之和，用来比较网络、磁盘和结果写入哪一方占用的时间最多
+    """
+    registry = registry or get_metrics()
+    if registry is None:
+        return []
+    summary = registry.stage_summary()
+    lines = []
+    for stage in STAGES:
+        stats = summary.get(stage)
+        if not stats:
+            continue
+        lines.append(
+            f"{stage:<16} {stats['count']:>7} x  mean {stats['mean'] * 1000:8.2f}ms  "
+            f"p50 {stats['p50'] * 1000:8.2f}ms  p95 {stats['p95'] * 1000:8.2f}ms  "
+            f"total {stats['total']:8.2f}s")
+
+    totals = {stage: summary[stage]['total'] for stage in BOTTLENECK_STAGES if stage in summary}
+    overall = sum(totals.values())
+    if overall:
+        busiest = max(totals, key=totals.get)
+        lines.append(f"Most time spent in {busiest} ({totals[busiest] / overall:.0%} of stage time)")
+    return lines
+
+
+def format_counters(registry=None) -> str:
+    """将计数器格式化为一行日志文本"""
+    registry = registry or get_metrics()
+    if registry is None:
+        return ''
+    parts = []
+    for metric in (registry.bytes, registry.responses, registry.retries,
+                   registry.cache, registry.items):
+        values = metric.values()
+        if values:
+            parts.append(f"{metric.name}: " + ', '.join(
+                f"{'/'.join(key)}={value:g}" for key, value in sorted(values.items())))
+    return '; '.join(parts)
+
+
+def log_metrics_summary():
+    """在日志中输出各阶段耗时和计数器"""
+    lines = format_stage_summary()
+    if not lines:
+        return
+    logging.info("Stage timings (summed over all workers):")
+    for line in lines:
+        logging.info(f"  {line}")
+    counters = format_counters()
+    if counters:
+        logging.info(f"Counters: {counters}")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        registry = get_metrics()
+        if self.path.split('?')[0] != '/metrics' or registry is None:
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = None, host: str = None):
+    """
+    在后台线程中以Prometheus文本格式提供 /metrics，未配置端口或已启动时不做任何事
+
+    Returns:
+        ThreadingHTTPServer: 已启动的服务器，未启动时为None
+    """
+    global _server
+    config = COMMON_CONFIG['METRICS']
+    port = port if port is not None else config['PORT']
+    if _server is not None or port is None or get_metrics() is None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host or config['HOST'], port), MetricsHandler)
+    except OSError as e:
+        logging.error(f"✗ Failed to start metrics server on port {port}: {str(e)}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Serving metrics at http://{_server.server_address[0]}:{_server.server_address[1]}/metrics")
+    return _server
+
+
+def stop_metrics_server():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
@@ -0,0 +1,418 @@
+"""
+本地模拟的maplestory.io接口，用于离线测试和调试下载器
+
+用法:
+    python mock_server.py --port 8000 --items 500 --npcs 50 --maps 10
+
+然后将config.py中的BASE_URL改为 http://127.0.0.1:8000/api/CMS/202/item/
+（NPC和地图分别为 .../api/CMS/202/npc/ 和 .../api/CMS/202/map/）
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+ITEM_LIST_PATTERN = re.compile(r'^/api/([^/]+)/([^/]+)/item/?$')
+ITEM_ICON_PATTERN = re.compile(r'^/api/([^/]+)/([^/]+)/item/(\d+)/icon$')
+NPC_LIST_PATTERN = re.compile(r'^/api/([^/]+)/([^/]+)/npc/?$')
+NPC_PATTERN = re.compile(r'^/api/([^/]+)/([^/]+)/npc/(\d+)$')
+NPC_FRAME_PATTERN = re.compile(r'^/api/([^/]+)/([^/]+)/npc/(\d+)/render/([^/]+)/(\d+)$')
+MAP_LIST_PATTERN = re.compile(r'^/api/([^/]+)/([^/]+)/map/?$')
+MAP_RENDER_PATTERN = re.compile(r'^/api/([^/]+)/([^/]+)/map/(\d+)/(render|minimap)$')
+RANGE_PATTERN = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+def _png(width: int, height: int, pixels: bytes, level: int = 6) -> bytes:
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        body = tag + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(pixels, level)) + chunk(b'IEND', b''))
+
+
+def make_png(width: int, height: int, rgba: tuple) -> bytes:
+    """生成纯色的PNG图片，不依赖Pillow"""
+    row = b'\x00' + bytes(rgba) * width
+    return _png(width, height, row * height)
+
+
+def make_noise_png(width: int, height: int, seed: int) -> bytes:
+    """生成随机像素的PNG图片，几乎无法压缩，用来模拟体积很大的地图"""
+    rng = random.Random(seed)
+    row_bytes = width * 4
+    pixels = b''.join(b'\x00' + rng.getrandbits(row_bytes * 8).to_bytes(row_bytes, 'little')
+                      for _ in range(height))
+    return _png(width, height, pixels, 1)
+
+
+class MockCatalog:
+    """
+    模拟的物品目录
+
+    模拟多个CMS版本时，base_version之后的每个版本新增added_per_version个物品，
+    并有churn比例的已有物品被修改（requiredLevel和图标随之变化）
+
+    Args:
+        items: 物品数量
+        unique_icons: 不同图标的数量，小于物品数时多个物品共用同一个图标
+        duplicate_names: 不同名称的数量，小于物品数时会出现重名物品
+        first_id: 第一个物品的ID
+        base_version: 物品数量为items的CMS版本
+        added_per_version: 之后每个版本新增的物品数
+        churn: 之后每个版本中被修改的物品比例
+        npcs: NPC数量
+        frames: 每个NPC的stand动作的最大帧数，其他动作的帧数由此推算
+        maps: 地图数量
+        map_size: 地图图片的边长（像素），每张地图约 map_size^2 * 4 字节
+    """
+
+    def __init__(self, items: int = 100, unique_icons: int = None, duplicate_names: int = None,
+                 first_id: int = 1102000, base_version: int = 202, added_per_version: int = 0,
+                 churn: float = 0.0, npcs: int = 0, frames: int = 4, maps: int = 0,
+                 map_size: int = 512):
+        self.count = items
+        self.unique_icons = unique_icons or items
+        self.duplicate_names = duplicate_names or items
+        self.first_id = first_id
+        self.base_version = base_version
+        self.added_per_version = added_per_version
+        self.churn = churn
+        self.npcs = npcs
+        self.frames = frames
+        self.first_npc_id = 9000000
+        self.maps = maps
+        self.map_size = map_size
+        self.first_map_id = 100000000
+        self._maps = {}
+        self._icons = {}
+        self._lock = threading.Lock()
+
+    def count_for(self, version: int = None) -> int:
+        """指定版本的物品数量"""
+        steps = max(0, (version or self.base_version) - self.base_version)
+        return self.count + self.added_per_version * steps
+
+    def revision(self, index: int, version: int = None) -> int:
+        """物品在指定版本中的修订号，即最近一次被修改的版本距base_version的版本数，从未修改时为0"""
+        for step in range(max(0, (version or self.base_version) - self.base_version), 0, -1):
+            roll = hashlib.md5(f"{index}:{step}".encode()).digest()[0] / 256
+            if roll < self.churn:
+                return step
+        return 0
+
+    def item(self, index: int, version: int = None) -> dict:
+        return {
+            'id': self.first_id + index,
+            'name': f"Mock Cape {index % self.duplicate_names}",
+            'isCash': index % 2 == 0,
+            'requiredJobs': ['Beginner'],
+            'requiredLevel': 10 * self.revision(index, version),
+            'typeInfo': {'overallCategory': 'Equip', 'category': 'Armor', 'subCategory': 'Cape'}
+        }
+
+    def item_list(self, version: int = None) -> bytes:
+        return json.dumps([self.item(i, version)
+                           for i in range(self.count_for(version))]).encode('utf-8')
+
+    def has_item(self, item_id: int, version: int = None) -> bool:
+        return 0 <= item_id - self.first_id < self.count_for(version)
+
+    def icon(self, item_id: int, resize: int = 1, version: int = None) -> bytes:
+        index = item_id - self.first_id
+        key = (index % self.unique_icons, resize, self.revision(index, version))
+        with self._lock:
+            png = self._icons.get(key)
+            if png is None:
+                seed = hashlib.md5(f"{key[0]}:{key[2]}".encode()).digest()
+                size = 32 * max(1, resize)
+                png = make_png(size, size, (seed[0], seed[1], seed[2], 255))
+                self._icons[key] = png
+        return png
+
+    def npc(self, index: int) -> dict:
+        return {
+            'id': self.first_npc_id + index,
+            'name': f"Mock NPC {index}",
+            'framebooks': {
+                'stand': 1 + index % max(1, self.frames),
+                'say': max(1, self.frames // 2),
+                'eye': 2,
+            },
+        }
+
+    def npc_list(self) -> bytes:
+        return json.dumps([{'id': self.first_npc_id + i, 'name': f"Mock NPC {i}"}
+                           for i in range(self.npcs)]).encode('utf-8')
+
+    def npc_frame(self, npc_id: int, animation: str, frame: int):
+        """NPC某个动作的一帧，NPC、动作或帧不存在时返回None"""
+        index = npc_id - self.first_npc_id
+        if not 0 <= index < self.npcs:
+            return None
+        if not 0 <= frame < self.npc(index)['framebooks'].get(animation, 0):
+            return None
+        seed = hashlib.md5(f"npc:{index}:{animation}:{frame}".encode()).digest()
+        return make_png(48, 64, (seed[0], seed[1], seed[2], 255))
+
+    def map_list(self) -> bytes:
+        return json.dumps([{'id': self.first_map_id + i, 'name': f"Mock Map {i}",
+                            'streetName': 'Mock Street'}
+                           for i in range(self.maps)]).encode('utf-8')
+
+    def map_render(self, map_id: int, kind: str = 'render'):
+        """地图的完整图片或小地图，地图不存在时返回None"""
+        index = map_id - self.first_map_id
+        if not 0 <= index < self.maps:
+            return None
+        size = self.map_size if kind == 'render' else max(1, self.map_size // 8)
+        key = (index, kind)
+        with self._lock:
+            png = self._maps.get(key)
+            if png is None:
+                png = make_noise_png(size, size, index)
+                self._maps[key] = png
+        return png
+
+
+class FaultConfig:
+    """
+    模拟接口的延迟和故障注入
+
+    Args:
+        latency: 每个请求的基础延迟(秒)
+        jitter: 在基础延迟上随机增加的最大延迟(秒)
+        error_rate: 返回500的请求比例
+        throttle_rate: 返回429的请求比例
+        retry_after: 429响应中Retry-After的秒数，None表示不发送该头
+        seed: 随机数种子，相同的种子得到相同的故障序列
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 1, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def decide(self) -> tuple:
+        """
+        决定下一个请求的延迟和注入的状态码
+
+        Returns:
+            tuple: (延迟秒数, 状态码)，不注入故障时状态码为None
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter else self.latency
+            roll = self._random.random()
+            if roll < self.throttle_rate:
+                self.stats['throttled'] += 1
+                return delay, 429
+            if roll < self.throttle_rate + self.error_rate:
+                self.stats['errors'] += 1
+                return delay, 500
+            return delay, None
+
+
+class MockServer(ThreadingHTTPServer):
+    # 默认的监听队列只有5，数百个并发连接时会丢弃SYN导致连接超时
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    catalog = None
+    faults = None
+    # 是否支持Range请求
+    ranges = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body: bytes, content_type: str):
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        match = RANGE_PATTERN.match(self.headers.get('Range', '')) if self.ranges else None
+        if_range = self.headers.get('If-Range')
+        if match and (if_range is None or if_range == etag):
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(body) - 1, len(body) - 1)
+            if start > end:
+                self.send_error_status(416, {'Content-Range': f"bytes */{len(body)}"})
+                return
+            self.send_response(206)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(body)}")
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body[start:end + 1])
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        if self.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_status(self, status: int, headers: dict = None):
+        body = json.dumps({'status': status}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if self.faults is not None:
+            delay, status = self.faults.decide()
+            if delay:
+                time.sleep(delay)
+            if status == 429 and self.faults.retry_after is not None:
+                self.send_error_status(429, {'Retry-After': f"{self.faults.retry_after:g}"})
+                return
+            if status is not None:
+                self.send_error_status(status)
+                return
+
+        match = ITEM_LIST_PATTERN.match(url.path)
+        if match:
+            version = int(match.group(2)) if match.group(2).isdigit() else None
+            self.send_body(self.catalog.item_list(version), 'application/json; charset=utf-8')
+            return
+
+        match = ITEM_ICON_PATTERN.match(url.path)
+        version = int(match.group(2)) if match and match.group(2).isdigit() else None
+        if match and self.catalog.has_item(int(match.group(3)), version):
+            resize = int(query.get('resize', ['1'])[0])
+            self.send_body(self.catalog.icon(int(match.group(3)), resize, version), 'image/png')
+            return
+
+        if NPC_LIST_PATTERN.match(url.path):
+            self.send_body(self.catalog.npc_list(), 'application/json; charset=utf-8')
+            return
+
+        match = NPC_PATTERN.match(url.path)
+        if match and 0 <= int(match.group(3)) - self.catalog.first_npc_id < self.catalog.npcs:
+            npc = self.catalog.npc(int(match.group(3)) - self.catalog.first_npc_id)
+            self.send_body(json.dumps(npc).encode('utf-8'), 'application/json; charset=utf-8')
+            return
+
+        if MAP_LIST_PATTERN.match(url.path):
+            self.send_body(self.catalog.map_list(), 'application/json; charset=utf-8')
+            return
+
+        match = MAP_RENDER_PATTERN.match(url.path)
+        render = match and self.catalog.map_render(int(match.group(3)), match.group(4))
+        if render:
+            self.send_body(render, 'image/png')
+            return
+
+        match = NPC_FRAME_PATTERN.match(url.path)
+        frame = match and self.catalog.npc_frame(
+            int(match.group(3)), match.group(4), int(match.group(5)))
+        if frame:
+            self.send_body(frame, 'image/png')
+            return
+
+        self.send_error_status(404)
+
+
+def start_server(catalog: MockCatalog, host: str = '127.0.0.1', port: int = 0,
+                 handler=MockHandler, faults: FaultConfig = None) -> MockServer:
+    """
+    在后台线程中启动模拟服务器
+
+    Args:
+        catalog: 模拟的物品目录
+        host: 监听地址
+        port: 监听端口，0表示随机选择
+        handler: 请求处理类
+        faults: 延迟和故障注入配置，None表示不注入
+
+    Returns:
+        MockServer: 已启动的服务器，server.server_address[1]为实际端口，用完调用shutdown()
+    """
+    handler_class = type('BoundMockHandler', (handler,), {'catalog': catalog, 'faults': faults})
+    server = MockServer((host, port), handler_class)
+    thread = threading.Thread(target=server.serve_forever, name='mock-server', daemon=True)
+    thread.start()
+    return server
+
+
+def base_url(server: MockServer, region: str = 'CMS', version: int = 202) -> str:
+    """获取模拟服务器对应的物品API地址"""
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/api/{region}/{version}/item/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的maplestory.io接口")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--items', type=int, default=100, help="物品数量")
+    parser.add_argument('--unique-icons', type=int, default=None, help="不同图标的数量")
+    parser.add_argument('--unique-names', type=int, default=None, help="不同名称的数量")
+    parser.add_argument('--added-per-version', type=int, default=0,
+                        help="CMS版本202之后每个版本新增的物品数")
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help="CMS版本202之后每个版本中被修改的物品比例")
+    parser.add_argument('--npcs', type=int, default=0, help="NPC数量")
+    parser.add_argument('--frames', type=int, default=4, help="每个NPC的stand动作的最大帧数")
+    parser.add_argument('--maps', type=int, default=0, help="地图数量")
+    parser.add_argument('--map-size', type=int, default=512, help="地图图片的边长(像素)")
+    parser.add_argument('--no-ranges', action='store_true', help="不支持Range请求")
+    parser.add_argument('--latency', type=float, default=0.0, help="每个请求的延迟(秒)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="随机增加的最大延迟(秒)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回500的比例")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="返回429的比例")
+    parser.add_argument('--retry-after', type=float, default=1, help="429响应的Retry-After(秒)")
+    args = parser.parse_args()
+
+    catalog = MockCatalog(args.items, args.unique_icons, args.unique_names,
+                          added_per_version=args.added_per_version, churn=args.churn,
+                          npcs=args.npcs, frames=args.frames, maps=args.maps,
+                          map_size=args.map_size)
+    faults = FaultConfig(args.latency, args.jitter, args.error_rate,
+                         args.throttle_rate, args.retry_after)
+    handler_class = type('BoundMockHandler', (MockHandler,),
+                         {'catalog': catalog, 'faults': faults, 'ranges': not args.no_ranges})
+    server = MockServer((args.host, args.port), handler_class)
+    print(f"Mock API listening on {base_url(server)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
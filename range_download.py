@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from config import COMMON_CONFIG
+from utils import safe_request
+from image_store import PNG_SIGNATURE
+from metrics import ChunkTimer, record_download
+
+# 未完成的分块下载保存在图片目录下的这个子目录中，不会被ImageStore.cleanup_partials删除
+RANGES_DIR = '.ranges'
+STATE_SUFFIX = '.json'
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+class ContentChangedError(ValueError):
+    """分块下载过程中服务器上的文件发生了变化，已下载的块不能再使用"""
+
+
+def parse_content_range(value):
+    """
+    解析Content-Range响应头
+
+    Returns:
+        tuple: (起始位置, 结束位置, 总长度)，总长度未知时为None；无法解析时返回None
+    """
+    match = _CONTENT_RANGE.match((value or '').strip())
+    if not match:
+        return None
+    total = None if match.group(3) == '*' else int(match.group(3))
+    return int(match.group(1)), int(match.group(2)), total
+
+
+def get_validator(response):
+    """用于If-Range的校验值，只使用强ETag，没有时使用Last-Modified"""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+class RangeDownload:
+    """
+    按字节范围分块下载一个大文件
+
+    各块由不同的线程同时请求，内容边读取边写入临时文件中对应的偏移位置，
+    内存中每块只保留一个读取缓冲，文件不需要在内存中拼接或解码。
+    已完成的块记录在临时文件旁的状态文件中，中断后重新运行只下载缺少的块。
+    服务器不支持Range时退回为整个文件流式下载。
+
+    Args:
+        url: 下载地址
+        directory: 临时文件所在目录
+        filename: 最终的文件名
+        chunk_size: 每块的字节数
+        source: 指标中字节数的来源标签
+    """
+
+    def __init__(self, url: str, directory: str, filename: str, chunk_size: int,
+                 source: str = 'range'):
+        self.url = url
+        self.source = source
+        self.part_path = os.path.join(directory, f"{filename}.part")
+        self.state_path = f"{self.part_path}{STATE_SUFFIX}"
+        self.chunk_size = max(1, int(chunk_size))
+        self.total = None
+        self.validator = None
+        self.done = set()
+        self.resumed = 0
+        # 任意一块发现文件已变化后，其余的块不再请求
+        self.changed = False
+        self._lock = threading.Lock()
+
+    @property
+    def chunks(self) -> int:
+        if self.total is None:
+            return 0
+        return max(1, -(-self.total // self.chunk_size))
+
+    @property
+    def complete(self) -> bool:
+        return self.total is not None and len(self.done) >= self.chunks
+
+    def pending(self) -> list:
+        """尚未下载的块"""
+        return [index for index in range(self.chunks) if index not in self.done]
+
+    def load(self) -> bool:
+        """
+        读取上次中断时的状态，地址或分块大小不同、或临时文件不完整时丢弃
+
+        Returns:
+            bool: 是否可以继续上次的下载
+        """
+        if not os.path.exists(self.state_path):
+            return False
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable range state {self.state_path}: {str(e)}")
+            state = None
+        if (not state or state.get('url') != self.url or state.get('chunk_size') != self.chunk_size
+                or not os.path.exists(self.part_path)
+                or os.path.getsize(self.part_path) != state.get('total')):
+            self.discard()
+            return False
+        self.total = state['total']
+        self.validator = state.get('validator')
+        self.done = set(state.get('done', []))
+        self.resumed = len(self.done)
+        return True
+
+    def _save(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'url': self.url, 'total': self.total, 'chunk_size': self.chunk_size,
+                       'validator': self.validator, 'done': sorted(self.done)}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def mark_done(self, index: int):
+        """记录已完成的块，写入状态文件"""
+        with self._lock:
+            self.done.add(index)
+            self._save()
+
+    def discard(self):
+        """删除临时文件和状态文件"""
+        for path in (self.part_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.total = None
+        self.validator = None
+        self.done = set()
+
+    def range_of(self, index: int) -> tuple:
+        start = index * self.chunk_size
+        return start, min(self.total, start + self.chunk_size) - 1
+
+    def start(self, response):
+        """
+        用第一块的206响应确定文件大小并创建临时文件，同时写入第一块
+
+        Raises:
+            ValueError: 响应没有可用的Content-Range
+        """
+        content_range = parse_content_range(response.headers.get('Content-Range'))
+        if content_range is None or content_range[2] is None or content_range[0] != 0:
+            response.close()
+            raise ValueError("response has no usable Content-Range")
+        self.total = content_range[2]
+        self.validator = get_validator(response)
+        os.makedirs(os.path.dirname(self.part_path), exist_ok=True)
+        with open(self.part_path, 'wb') as f:
+            f.truncate(self.total)
+        self._write(response, 0)
+        self.mark_done(0)
+
+    def fetch(self, index: int) -> int:
+        """
+        下载一块并写入临时文件
+
+        Returns:
+            int: 块序号
+
+        Raises:
+            ContentChangedError: 服务器上的文件已变化
+            ValueError: 请求失败或内容长度不符
+        """
+        if self.changed:
+            raise ContentChangedError("file changed on server")
+        start, end = self.range_of(index)
+        headers = {'Range': f"bytes={start}-{end}"}
+        if self.validator:
+            headers['If-Range'] = self.validator
+        response = safe_request(self.url, stream=True, headers=headers)
+        if response is None:
+            raise ValueError("Network error during fetch")
+        content_range = parse_content_range(response.headers.get('Content-Range'))
+        if response.status_code != 206 or content_range is None or content_range[2] != self.total:
+            response.close()
+            self.changed = True
+            raise ContentChangedError("file changed on server")
+        if content_range[:2] != (start, end):
+            response.close()
+            raise ValueError(f"unexpected Content-Range {response.headers.get('Content-Range')}")
+        self._write(response, index)
+        return index
+
+    def _write(self, response, index: int):
+        start, end = self.range_of(index)
+        chunks = ChunkTimer(response.iter_content(COMMON_CONFIG['REQUEST']['CHUNK_SIZE']),
+                            self.source, 'http_body')
+        began = time.perf_counter()
+        size = 0
+        with response, open(self.part_path, 'r+b') as f:
+            f.seek(start)
+            for chunk in chunks:
+                if size + len(chunk) > end - start + 1:
+                    raise ValueError(f"chunk {index} is longer than requested")
+                f.write(chunk)
+                size += len(chunk)
+        record_download(chunks, time.perf_counter() - began)
+        if size != end - start + 1:
+            raise ValueError(f"incomplete chunk {index}: got {size} of {end - start + 1} bytes")
+
+    def check_png(self):
+        """
+        Raises:
+            ValueError: 拼接完成的文件不是PNG
+        """
+        with open(self.part_path, 'rb') as f:
+            if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+                raise ValueError("downloaded file is not a PNG image")
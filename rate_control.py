@@ -0,0 +1,280 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import partial
+
+from config import COMMON_CONFIG
+
+# 表示服务器过载、需要降速的状态码
+THROTTLE_STATUSES = (429, 503)
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_max_workers() -> int:
+    """
+    获取下载线程数，启用自适应并发时取自适应并发的上限
+    """
+    adaptive = COMMON_CONFIG['ADAPTIVE']
+    if adaptive['ENABLED']:
+        return max(1, int(adaptive['MAX_CONCURRENCY']))
+    return max(1, int(COMMON_CONFIG['CONCURRENT']['MAX_WORKERS']))
+
+
+def parse_retry_after(value):
+    """
+    解析Retry-After响应头
+
+    Args:
+        value: 秒数（例如'120'）或HTTP日期
+
+    Returns:
+        float: 需要等待的秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """
+    根据服务器反馈自适应调整的并发与速率控制器
+
+    并发上限按AIMD调整：请求正常且延迟低于目标时每完成一轮（当前上限个请求）加1，
+    遇到429/503或延迟超过目标时乘以DECREASE_FACTOR。
+    请求速率由令牌桶限制：遇到429/503时速率上限同样按比例下降，之后随成功请求逐步恢复。
+    服务器返回Retry-After时，所有请求暂停到指定时间后再发出。
+    """
+
+    def __init__(self, min_concurrency: int, max_concurrency: int, initial_concurrency: int,
+                 max_rate=None, min_rate: float = 1.0, target_latency: float = 2.0,
+                 decrease_factor: float = 0.5):
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = max_rate
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+
+        self.in_flight = 0
+        self.stats = {'requests': 0, 'throttled': 0, 'increases': 0, 'decreases': 0}
+        self._cond = threading.Condition()
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latency = None
+        self._completions = deque()
+
+    def _refill(self, now: float):
+        if self.rate is None:
+            return
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """等待直到并发数、令牌桶和Retry-After都允许发出请求"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = None
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self.in_flight >= int(self.limit):
+                    wait = 1.0
+                elif self.rate is not None and self._tokens < 1.0:
+                    wait = (1.0 - self._tokens) / self.rate
+                else:
+                    break
+                self._cond.wait(wait)
+            self.in_flight += 1
+            if self.rate is not None:
+                self._tokens -= 1.0
+            self.stats['requests'] += 1
+
+    def release(self, latency: float, status=None, retry_after=None):
+        """
+        请求完成后根据结果调整并发和速率
+
+        Args:
+            latency: 请求耗时(秒)
+            status: HTTP状态码，网络错误时为None
+            retry_after: 服务器要求等待的秒数
+        """
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            self._completions.append(now)
+            while self._completions and now - self._completions[0] > 10:
+                self._completions.popleft()
+            self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+
+            if status in THROTTLE_STATUSES:
+                self.stats['throttled'] += 1
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+                    logging.warning(
+                        f"Rate control: server sent {status} with Retry-After={retry_after:.1f}s, pausing requests")
+                self._decrease(now, f"server returned {status}", throttle_rate=True)
+            elif status is None or self._latency > self.target_latency:
+                reason = "network error" if status is None else \
+                    f"latency {self._latency:.2f}s above target {self.target_latency:.2f}s"
+                self._decrease(now, reason)
+            else:
+                self._increase()
+            self._cond.notify_all()
+
+    def _decrease(self, now: float, reason: str, throttle_rate: bool = False):
+        # 同一次拥塞只降一次：距上次下降不足一个平均延迟（至少1秒）时忽略
+        if now - self._last_decrease < max(1.0, self._latency or 0.0):
+            return
+        self._last_decrease = now
+        old_limit = self.limit
+        self.limit = max(float(self.min_concurrency), self.limit * self.decrease_factor)
+        message = f"Rate control: {reason}, concurrency {old_limit:.1f} -> {self.limit:.1f}"
+
+        if throttle_rate:
+            old_rate = self.rate
+            if self.rate is None:
+                observed = len(self._completions) / 10.0
+                self.rate = max(self.min_rate, observed * self.decrease_factor)
+            else:
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._tokens = min(self._tokens, 1.0)
+            old_text = 'unlimited' if old_rate is None else f"{old_rate:.1f}"
+            message += f", rate {old_text} -> {self.rate:.1f} req/s"
+
+        self.stats['decreases'] += 1
+        logging.warning(message)
+
+    def _increase(self):
+        old_limit = int(self.limit)
+        if self.limit < self.max_concurrency:
+            # 每完成约一轮请求并发上限加1
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            if int(self.limit) > old_limit:
+                self.stats['increases'] += 1
+                logging.info(f"Rate control: concurrency {old_limit} -> {int(self.limit)}")
+        if self.rate is not None:
+            # 每秒约恢复1 req/s，没有配置上限时恢复到足够高后取消速率限制
+            self.rate += 1.0 / max(self.rate, 1.0)
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+            elif self.rate > self.max_concurrency / max(self._latency or 0.001, 0.001):
+                self.rate = None
+                logging.info("Rate control: request rate ceiling lifted")
+
+    @contextmanager
+    def slot(self):
+        """
+        获取一个请求名额，with块结束时自动按耗时归还
+
+        调用方在feedback中写入'response'（以stream=True发出的请求的响应）时，
+        名额等到响应内容读完或响应关闭后才归还，下载内容期间仍计入并发；耗时仍按with块计算
+
+        Yields:
+            dict: 调用方可在其中写入'status'、'retry_after'和'response'
+        """
+        self.acquire()
+        feedback = {'status': None, 'retry_after': None, 'response': None}
+        start = time.monotonic()
+        try:
+            yield feedback
+        except BaseException:
+            feedback['response'] = None
+            raise
+        finally:
+            release = partial(self.release, time.monotonic() - start,
+                              feedback['status'], feedback['retry_after'])
+            response = feedback['response']
+            if response is None:
+                release()
+            else:
+                response.raw = _SlotHoldingReader(response.raw, release)
+
+    def format_stats(self) -> str:
+        """将控制器状态格式化为日志文本"""
+        rate = 'unlimited' if self.rate is None else f"{self.rate:.1f} req/s"
+        return (f"concurrency {int(self.limit)} (range {self.min_concurrency}-{self.max_concurrency}), "
+                f"rate {rate}, {self.stats['throttled']} throttled of {self.stats['requests']} requests, "
+                f"{self.stats['increases']} increases, {self.stats['decreases']} decreases")
+
+
+class _SlotHoldingReader:
+    """包装流式响应的原始数据流，内容读到末尾或响应关闭时归还请求名额，只归还一次"""
+
+    def __init__(self, raw, release):
+        self._raw = raw
+        self._release = release
+
+    def _release_slot(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    def stream(self, amt=None, decode_content=None):
+        try:
+            yield from self._raw.stream(amt, decode_content=decode_content)
+        finally:
+            self._release_slot()
+
+    def read(self, amt=None, decode_content=True):
+        chunk = self._raw.read(amt, decode_content=decode_content)
+        if not chunk:
+            self._release_slot()
+        return chunk
+
+    def close(self):
+        try:
+            self._raw.close()
+        finally:
+            self._release_slot()
+
+    def release_conn(self):
+        try:
+            self._raw.release_conn()
+        finally:
+            self._release_slot()
+
+
+def get_limiter():
+    """
+    获取进程内共享的自适应控制器，未启用时返回None
+    """
+    global _limiter
+    adaptive = COMMON_CONFIG['ADAPTIVE']
+    if not adaptive['ENABLED']:
+        return None
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = AdaptiveLimiter(
+                    adaptive['MIN_CONCURRENCY'], adaptive['MAX_CONCURRENCY'],
+                    adaptive['INITIAL_CONCURRENCY'], adaptive['MAX_RATE'],
+                    adaptive['MIN_RATE'], adaptive['TARGET_LATENCY'],
+                    adaptive['DECREASE_FACTOR'])
+    return _limiter
+
+
+def format_limiter_stats() -> str:
+    """将共享控制器的状态格式化为日志文本"""
+    if _limiter is None:
+        return "disabled"
+    return _limiter.format_stats()
@@ -0,0 +1,158 @@
+import os
+import shutil
+
+from config import ITEM_CONFIG
+from downloader.engine import PooledPostProcessor
+
+# 支持的输出格式和对应的扩展名，png为无损优化后的PNG
+OUTPUT_FORMATS = {'png': '.png', 'webp': '.webp', 'avif': '.avif'}
+
+
+def check_formats(formats):
+    """
+    检查输出格式是否受当前安装的Pillow支持
+
+    Raises:
+        ValueError: 未知的格式，或Pillow缺少对应的编码器
+    """
+    unknown = [name for name in formats if name not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f"未知的输出格式: {', '.join(unknown)}")
+    if not formats:
+        raise ValueError("没有配置输出格式")
+
+    from PIL import features
+    if 'webp' in formats and not features.check('webp'):
+        raise ValueError("当前Pillow不支持WebP")
+    if 'avif' in formats and not _has_avif():
+        raise ValueError("当前Pillow不支持AVIF，需要Pillow>=11.3或安装pillow-avif-plugin")
+
+
+def _has_avif() -> bool:
+    try:
+        # 旧版本Pillow通过插件注册AVIF编码器
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    from PIL import features, Image
+    return features.check('avif') or 'AVIF' in Image.SAVE
+
+
+def _save(image, path: str, fmt: str, options: dict):
+    if fmt == 'png':
+        image.save(path, format='PNG', optimize=True)
+    elif fmt == 'webp':
+        if options['WEBP_LOSSLESS']:
+            image.save(path, format='WEBP', lossless=True, quality=100, method=6)
+        else:
+            image.save(path, format='WEBP', quality=options['WEBP_QUALITY'], method=6)
+    else:
+        image.save(path, format='AVIF', quality=options['AVIF_QUALITY'])
+
+
+def recompress_image(source_path: str, filename: str, output_dir: str, formats, options: dict) -> dict:
+    """
+    将一个图标保存为各个输出格式，在工作进程中执行
+
+    无损优化后的PNG不比原图小时直接使用原图；比原图新的已有输出直接跳过，重复运行时只处理新下载或更新过的图标
+
+    Args:
+        source_path: 原图路径
+        filename: 图标文件名，输出文件使用相同的文件名和各格式的扩展名
+        output_dir: 输出的根目录，每种格式一个子目录
+        formats: 输出格式，例如 ['png', 'webp']
+        options: 编码参数，结构与ITEM_CONFIG['RECOMPRESS']相同
+
+    Returns:
+        dict: {'source': 原图字节数, 格式: {'path': 相对output_dir的路径, 'size': 字节数}}
+    """
+    if 'avif' in formats:
+        _has_avif()
+    from PIL import Image
+
+    source_stat = os.stat(source_path)
+    base = os.path.splitext(filename)[0]
+    outputs = {'source': source_stat.st_size}
+    image = None
+    try:
+        for fmt in formats:
+            relative = os.path.join(fmt, f"{base}{OUTPUT_FORMATS[fmt]}")
+            path = os.path.join(output_dir, relative)
+            if not (os.path.exists(path) and os.stat(path).st_mtime >= source_stat.st_mtime):
+                if image is None:
+                    image = Image.open(source_path)
+                    image.load()
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                try:
+                    _save(image, tmp_path, fmt, options)
+                    if fmt == 'png' and os.path.getsize(tmp_path) >= source_stat.st_size:
+                        shutil.copyfile(source_path, tmp_path)
+                    os.replace(tmp_path, path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+            outputs[fmt] = {'path': relative, 'size': os.path.getsize(path)}
+    finally:
+        if image is not None:
+            image.close()
+    return outputs
+
+
+class RecompressProcessor(PooledPostProcessor):
+    """
+    在进程池中对下载好的图标做无损PNG优化或转换为WebP/AVIF，压缩不占用下载线程的CPU
+
+    输出目录下的 manifest.json 记录每个图标原图和各格式的字节数，
+    最终的JSON结果文件中下载成功的物品也在recompressed字段中记录同样的内容。
+
+    Args:
+        output_dir: 输出的根目录
+        formats: 输出格式
+        options: 编码参数，结构与ITEM_CONFIG['RECOMPRESS']相同
+        processes: 进程数，None表示CPU核数
+    """
+
+    action = 'recompress'
+    result_field = 'recompressed'
+
+    def __init__(self, output_dir: str, formats, options: dict, processes: int = None):
+        check_formats(formats)
+        self.formats = list(formats)
+        self.options = {key: options[key] for key in ('WEBP_LOSSLESS', 'WEBP_QUALITY', 'AVIF_QUALITY')}
+        self.stats = {'images': 0, 'failed': 0, 'source_bytes': 0}
+        self.stats.update({f"{fmt}_bytes": 0 for fmt in self.formats})
+        super().__init__(output_dir, recompress_image, (self.formats, self.options), processes)
+
+    def record(self, outputs: dict):
+        self.stats['images'] += 1
+        self.stats['source_bytes'] += outputs['source']
+        for fmt in self.formats:
+            self.stats[f"{fmt}_bytes"] += outputs[fmt]['size']
+
+    def format_stats(self) -> str:
+        """将处理统计格式化为日志文本，给出各格式相对原图的大小"""
+        source = self.stats['source_bytes']
+        sizes = []
+        for fmt in self.formats:
+            size = self.stats[f"{fmt}_bytes"]
+            ratio = f" ({(size - source) / source:+.1%})" if source else ''
+            sizes.append(f"{fmt} {size} bytes{ratio}")
+        return (f"{self.stats['images']} images, source {source} bytes -> {', '.join(sizes)}, "
+                f"{self.stats['failed']} failed, {self.processes} processes")
+
+
+def open_recompress_processor(output_dir: str = None):
+    """
+    按ITEM_CONFIG['RECOMPRESS']创建重新压缩处理器，未启用时返回None
+
+    Args:
+        output_dir: 输出的根目录，默认为ITEM_CONFIG['PATHS']['RECOMPRESSED']
+    """
+    recompress = ITEM_CONFIG['RECOMPRESS']
+    if not recompress['ENABLED']:
+        return None
+    return RecompressProcessor(
+        output_dir or ITEM_CONFIG['PATHS']['RECOMPRESSED'],
+        recompress['FORMATS'], recompress, recompress['PROCESSES'])
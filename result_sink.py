@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from config import COMMON_CONFIG
+from metrics import stage_timer, set_gauge
+
+_STOP = object()
+
+
+def get_jsonl_filename(json_file: str) -> str:
+    """根据结果JSON文件名得到对应的JSON Lines文件名"""
+    base, _ = os.path.splitext(json_file)
+    return f"{base}.jsonl"
+
+
+def iter_jsonl(jsonl_file: str):
+    """
+    逐行读取JSON Lines文件中的记录，跳过损坏的行（例如进程中断时写了一半的最后一行）
+    """
+    with open(jsonl_file, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(
+                    f"Skipping corrupt line {line_no} in {jsonl_file}")
+
+
+def write_json_array(records, json_file: str) -> int:
+    """
+    将记录流式写成JSON数组文件，格式与json.dump(indent=2)的输出一致
+
+    Args:
+        records: 可迭代的记录
+        json_file: 输出文件名
+
+    Returns:
+        int: 写入的记录数
+    """
+    count = 0
+    tmp_file = f"{json_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write('[\n' if count == 0 else ',\n')
+            text = json.dumps(record, ensure_ascii=False, indent=2)
+            f.write('\n'.join('  ' + line for line in text.split('\n')))
+            count += 1
+        f.write('\n]' if count else '[]')
+    os.replace(tmp_file, json_file)
+    return count
+
+
+class ResultSink:
+    """
+    追加写入的结果输出器
+
+    结果记录先进入队列，由独立的写线程按批次追加到JSON Lines文件，
+    并按配置的时间间隔执行fsync。调用方只需put记录，不会被磁盘I/O阻塞。
+    listeners中的每个对象在写线程中依次收到每批记录(write_batch)，输出器关闭时一并关闭(close)，
+    例如物品索引。
+    """
+
+    def __init__(self, jsonl_file: str, batch_size: int = None, fsync_interval: float = None,
+                 listeners=None):
+        sink_config = COMMON_CONFIG['RESULT_SINK']
+        self.jsonl_file = jsonl_file
+        self.batch_size = batch_size or sink_config['BATCH_SIZE']
+        self.fsync_interval = (fsync_interval if fsync_interval is not None
+                               else sink_config['FSYNC_INTERVAL'])
+        self.written = 0
+        self.listeners = [listener for listener in (listeners or []) if listener is not None]
+        self._queue = queue.Queue()
+        self._closed = False
+        self._file = open(jsonl_file, 'w', encoding='utf-8')
+        self._last_fsync = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run, name='result-sink', daemon=True)
+        self._thread.start()
+
+    def write(self, record: dict):
+        """提交一条结果记录"""
+        if self._closed:
+            raise RuntimeError("ResultSink is closed")
+        self._queue.put(record)
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is _STOP:
+                break
+            batch = [record]
+            stop = False
+            # 尽量攒满一批再写，减少write调用次数
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                    break
+                batch.append(record)
+            set_gauge('sink_queue', self._queue.qsize())
+            with stage_timer('sink_flush'):
+                self._write_batch(batch)
+            if stop:
+                break
+        self._sync()
+
+    def _write_batch(self, batch):
+        try:
+            self._file.write(''.join(
+                json.dumps(record, ensure_ascii=False) + '\n' for record in batch))
+            self._file.flush()
+            self.written += len(batch)
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._sync()
+        except Exception as e:
+            logging.error(f"✗ Error writing results to {self.jsonl_file}: {str(e)}")
+        for listener in self.listeners:
+            try:
+                listener.write_batch(batch)
+            except Exception as e:
+                logging.error(f"✗ Error passing results to {type(listener).__name__}: {str(e)}")
+
+    def _sync(self):
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except (OSError, ValueError) as e:
+            logging.error(f"✗ Error syncing {self.jsonl_file}: {str(e)}")
+        self._last_fsync = time.monotonic()
+
+    def close(self):
+        """写完队列中剩余的记录并关闭文件"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._file.close()
+        for listener in self.listeners:
+            listener.close()
+
+    def finalize(self, json_file: str, annotate=None) -> int:
+        """
+        关闭输出器，并将JSON Lines结果转换为原有的JSON数组格式
+
+        Args:
+            json_file: 目标JSON文件名，例如 cape_result_20241104_120000.json
+            annotate: 写入JSON文件前补充单个记录的函数，返回补充后的记录；
+                      用于写入下载后处理才得到的字段，JSON Lines文件保持不变
+
+        Returns:
+            int: 写入JSON文件的记录数
+        """
+        self.close()
+        records = iter_jsonl(self.jsonl_file)
+        if annotate is not None:
+            records = map(annotate, records)
+        return write_json_array(records, json_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
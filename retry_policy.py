@@ -0,0 +1,269 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from config import COMMON_CONFIG
+from metrics import count
+
+# 可以重试的HTTP状态码，其余非2xx状态码直接视为失败
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# 单次响应的处理结果，见RetryPolicy.judge_status
+OUTCOME_SUCCESS = 'success'
+OUTCOME_FAIL = 'fail'
+OUTCOME_RETRY = 'retry'
+
+# 熔断器状态
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+class RetryBudget:
+    """
+    全局重试预算
+
+    每个新请求存入ratio个令牌，每次重试消耗1个，令牌数不超过上限。
+    上游整体故障时重试很快耗尽预算，避免所有线程同时反复重试形成重试风暴。
+    """
+
+    def __init__(self, ratio: float, min_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max(min_tokens, 1.0)
+        self._tokens = self.max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """
+    单个主机的熔断器
+
+    连续失败达到阈值后熔断，熔断期间的请求直接失败；
+    超过重置时间后进入半开状态，放行一个探测请求，成功则恢复，失败则继续熔断。
+    """
+
+    def __init__(self, host: str, failure_threshold: int, reset_timeout: float):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """判断当前是否允许向该主机发出请求"""
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = CIRCUIT_HALF_OPEN
+                self._probing = False
+                logging.info(f"Circuit for {self.host} half-open, sending a probe request")
+            # 半开状态只放行一个探测请求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CIRCUIT_CLOSED:
+                logging.info(f"Circuit for {self.host} closed")
+            self.state = CIRCUIT_CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == CIRCUIT_HALF_OPEN or (
+                    self.state == CIRCUIT_CLOSED and self._failures >= self.failure_threshold):
+                self.state = CIRCUIT_OPEN
+                self._opened_at = time.monotonic()
+                logging.error(
+                    f"Circuit for {self.host} opened after {self._failures} consecutive failures, "
+                    f"failing fast for {self.reset_timeout}s")
+
+
+class RetryPolicy:
+    """
+    统一的请求重试策略：带抖动的指数退避 + 全局重试预算 + 按主机的熔断器
+    """
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float,
+                 budget_ratio: float, budget_min: float,
+                 failure_threshold: int, reset_timeout: float):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = RetryBudget(budget_ratio, budget_min)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stats = {'retries': 0, 'budget_exhausted': 0, 'circuit_rejected': 0}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker_for(self, url: str) -> CircuitBreaker:
+        host = urlparse(url).netloc
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(host, self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+            return breaker
+
+    def backoff(self, attempt: int) -> float:
+        """
+        第attempt次失败后的等待时间（full jitter）
+
+        Args:
+            attempt: 已失败的次数，从0开始
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def should_retry(self, attempt: int, breaker: CircuitBreaker) -> bool:
+        """
+        判断失败后是否还能重试，会消耗重试预算
+
+        Args:
+            attempt: 已失败的次数，从0开始
+            breaker: 目标主机的熔断器
+        """
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if not breaker.allow():
+            with self._lock:
+                self.stats['circuit_rejected'] += 1
+            return False
+        if not self.budget.try_spend():
+            with self._lock:
+                self.stats['budget_exhausted'] += 1
+            logging.warning("Retry budget exhausted, not retrying")
+            return False
+        with self._lock:
+            self.stats['retries'] += 1
+        return True
+
+    def reject(self):
+        """记录一次因熔断被直接拒绝的请求"""
+        with self._lock:
+            self.stats['circuit_rejected'] += 1
+
+    def admit(self, url: str):
+        """
+        请求开始前检查目标主机的熔断器，并为重试预算存入令牌
+
+        同步的safe_request和异步引擎的async_request共用，保证两者的重试行为一致
+
+        Returns:
+            CircuitBreaker: 目标主机的熔断器，熔断中直接失败时返回None
+        """
+        breaker = self.breaker_for(url)
+        if not breaker.allow():
+            self.reject()
+            logging.error(f"Circuit open for {breaker.host}, failing fast: {url}")
+            return None
+        self.budget.deposit()
+        return breaker
+
+    def judge_status(self, breaker: CircuitBreaker, url: str, status: int) -> str:
+        """
+        根据响应状态码决定成功、直接失败还是重试
+
+        Returns:
+            str: OUTCOME_SUCCESS、OUTCOME_FAIL或OUTCOME_RETRY
+        """
+        if 200 <= status < 300:
+            breaker.record_success()
+            return OUTCOME_SUCCESS
+        if status not in RETRYABLE_STATUSES:
+            # 服务器正常响应了请求，只是请求本身无效，不影响熔断器
+            breaker.record_success()
+            logging.error(f"HTTP {status} for {url}, not retrying")
+            return OUTCOME_FAIL
+        return OUTCOME_RETRY
+
+    def retry_delay(self, attempt: int, breaker: CircuitBreaker, url: str, error: str,
+                    status: int = None, retry_after: float = None):
+        """
+        记录一次失败（网络错误或可重试的状态码），决定是否重试
+
+        Args:
+            attempt: 已失败的次数，从0开始
+            breaker: 目标主机的熔断器
+            url: 请求地址，用于日志
+            error: 失败原因，用于日志
+            status: 响应状态码，网络错误时为None
+            retry_after: 服务器要求的等待秒数，退避时间不小于该值
+
+        Returns:
+            float: 重试前需要等待的秒数，不再重试时返回None
+        """
+        # 429只表示请求过快，主机本身可用，不计入熔断
+        if status != 429:
+            breaker.record_failure()
+        if not self.should_retry(attempt, breaker):
+            logging.error(f"Failed after {attempt + 1} attempts: {error} ({url})")
+            return None
+
+        count('retries', reason=status or 'network')
+        delay = self.backoff(attempt)
+        if retry_after:
+            delay = max(delay, retry_after)
+        logging.warning(
+            f"Attempt {attempt + 1} failed: {error}. Retrying in {delay:.1f} seconds...")
+        return delay
+
+    def format_stats(self) -> str:
+        """将重试统计格式化为日志文本"""
+        with self._lock:
+            open_hosts = [host for host, breaker in self._breakers.items()
+                          if breaker.state != CIRCUIT_CLOSED]
+        text = (f"{self.stats['retries']} retries, {self.stats['budget_exhausted']} denied by budget, "
+                f"{self.stats['circuit_rejected']} rejected by circuit breaker")
+        if open_hosts:
+            text += f", open circuits: {', '.join(open_hosts)}"
+        return text
+
+
+def get_retry_policy() -> RetryPolicy:
+    """获取进程内共享的重试策略"""
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                request = COMMON_CONFIG['REQUEST']
+                breaker = COMMON_CONFIG['CIRCUIT_BREAKER']
+                _policy = RetryPolicy(
+                    request['MAX_RETRIES'], request['RETRY_DELAY'], request['MAX_RETRY_DELAY'],
+                    request['RETRY_BUDGET_RATIO'], request['RETRY_BUDGET_MIN'],
+                    breaker['FAILURE_THRESHOLD'], breaker['RESET_TIMEOUT'])
+    return _policy
+
+
+def format_retry_stats() -> str:
+    """将共享重试策略的统计格式化为日志文本"""
+    if _policy is None:
+        return "no requests"
+    return _policy.format_stats()
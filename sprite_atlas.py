@@ -0,0 +1,460 @@
+import bisect
+from collections import namedtuple
+import json
+import logging
+import mmap
+import os
+import struct
+
+from config import ITEM_CONFIG
+from result_sink import iter_jsonl
+
+# 图集目录中的文件
+INDEX_FILE = 'atlas.idx'
+STATE_FILE = 'atlas.json'
+PAGE_PATTERN = 'atlas_{page:03d}'
+
+# 索引文件格式（小端）:
+#   头部:     magic(8s) 版本(I) 记录数(I) 图集页数(I) 页表偏移(I) 名称区偏移(I)
+#   记录:     按物品ID升序，物品ID(q) 页号(H) x(H) y(H) 宽(H) 高(H) 名称偏移(I) 名称长度(H)
+#   页表:     每页 宽(H) 高(H)，已删除的页宽高为0
+#   名称区:   UTF-8编码的物品名称
+# 每页的像素以未压缩的RGBA逐行保存在 atlas_<页号>.rgba 中，可以直接内存映射读取
+INDEX_MAGIC = b'MSATLAS\x00'
+INDEX_VERSION = 1
+_HEADER = struct.Struct('<8sIIIII')
+_RECORD = struct.Struct('<qHHHHHIH')
+_PAGE = struct.Struct('<HH')
+
+# 单个图标的来源：物品ID、名称、图片路径、内容签名（sha256，没有时为文件大小和修改时间）
+AtlasSource = namedtuple('AtlasSource', ['item_id', 'name', 'path', 'signature'])
+# 索引中的单条记录
+AtlasEntry = namedtuple('AtlasEntry', ['item_id', 'page', 'x', 'y', 'width', 'height', 'name'])
+
+
+class ShelfPacker:
+    """
+    货架式装箱：图标按高度从高到低依次放入，每层货架从左到右排列，放不下时在下方开新的一层
+
+    同一分类的图标尺寸接近，货架算法的空间利用率已经足够，且速度快、结果稳定
+    """
+
+    def __init__(self, max_size: int, padding: int):
+        self.max_size = max_size
+        self.padding = padding
+        self.width = 0
+        self.height = 0
+        self._shelves = []  # [y, 高度, 下一个x]
+
+    def add(self, width: int, height: int):
+        """
+        放入一个图标
+
+        Returns:
+            tuple: 放入的位置 (x, y)，放不下时返回None
+        """
+        w = width + self.padding
+        h = height + self.padding
+        for shelf in self._shelves:
+            if h <= shelf[1] and shelf[2] + w <= self.max_size:
+                position = (shelf[2], shelf[0])
+                shelf[2] += w
+                self._grow(position, width, height)
+                return position
+
+        y = self._shelves[-1][0] + self._shelves[-1][1] if self._shelves else 0
+        if y + h > self.max_size or w > self.max_size:
+            return None
+        self._shelves.append([y, h, w])
+        self._grow((0, y), width, height)
+        return (0, y)
+
+    def _grow(self, position, width, height):
+        self.width = max(self.width, position[0] + width)
+        self.height = max(self.height, position[1] + height)
+
+
+def signature_of(path: str, sha256: str = None) -> str:
+    """图标内容的签名，用于判断增量重建时图标是否变化"""
+    if sha256:
+        return sha256
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def source_from_result(result: dict, store):
+    """
+    根据单个物品的下载结果找到图片文件，文件不存在或下载未成功时返回None
+
+    Args:
+        result: 写入结果文件的单个物品结果
+        store: 图片所在目录的ImageStore
+    """
+    status = result.get('status')
+    if status == 'success':
+        filename = result['filename']
+    elif status == 'skipped' and result.get('name'):
+        # 跳过的物品使用目录中已有的同名图片
+        filename = f"{result['name']}.png"
+    else:
+        return None
+    path = store.path_of(filename)
+    if not os.path.exists(path):
+        return None
+    return AtlasSource(int(result['id']), result.get('name') or '', path,
+                       signature_of(path, result.get('sha256')))
+
+
+def iter_checkpoint_sources(checkpoint, store):
+    """从断点记录中读取所有下载成功的图标"""
+    for result in checkpoint.iter_results():
+        source = source_from_result(result, store)
+        if source is not None:
+            yield source
+
+
+def iter_result_sources(results_file: str, store):
+    """从结果文件（.json或.jsonl）中读取所有下载成功的图标"""
+    if results_file.endswith('.jsonl'):
+        results = iter_jsonl(results_file)
+    else:
+        with open(results_file, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+    for result in results:
+        source = source_from_result(result, store)
+        if source is not None:
+            yield source
+
+
+def _load_state(directory: str) -> dict:
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {'pages': {}}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"Ignoring unreadable atlas state {path}, rebuilding: {str(e)}")
+        return {'pages': {}}
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def page_path(directory: str, page: int, ext: str = '.rgba') -> str:
+    return os.path.join(directory, PAGE_PATTERN.format(page=page) + ext)
+
+
+class AtlasBuilder:
+    """
+    将图标打包为若干张图集，并生成按物品ID二分查找的索引
+
+    增量重建：atlas.json记录每页包含的图标和签名，只有新增、删除或内容变化的图标所在的页
+    （以及接收新图标的最后一页）会重新排布和写入，其余页保持不变
+
+    Args:
+        directory: 图集输出目录
+        max_size: 单页图集的最大边长
+        padding: 图标之间的间距
+        write_png: 是否同时保存PNG格式的图集，便于查看
+    """
+
+    def __init__(self, directory: str, max_size: int = 2048, padding: int = 1, write_png: bool = True):
+        self.directory = directory
+        self.max_size = max_size
+        self.padding = padding
+        self.write_png = write_png
+        self.stats = {'icons': 0, 'pages': 0, 'rebuilt': 0, 'added': 0, 'changed': 0, 'removed': 0}
+
+    def build(self, sources) -> dict:
+        """
+        Args:
+            sources: 可迭代的AtlasSource，同一物品ID只保留最后一个
+
+        Returns:
+            dict: 统计信息
+        """
+        from PIL import Image
+
+        os.makedirs(self.directory, exist_ok=True)
+        sources = {source.item_id: source for source in sources}
+        state = _load_state(self.directory)
+        if state.get('max_size') != self.max_size or state.get('padding') != self.padding:
+            state = {'pages': {}}
+
+        # 页号 -> {物品ID: {'name', 'path', 'signature', 'rect': [x, y, w, h]}}
+        pages = {int(page): {int(item_id): member for item_id, member in members.items()}
+                 for page, members in state['pages'].items()}
+        known = {item_id for members in pages.values() for item_id in members}
+        dirty = set()
+        placed = set()
+
+        for page, members in pages.items():
+            if not os.path.exists(page_path(self.directory, page)):
+                dirty.add(page)
+            for item_id in list(members):
+                source = sources.get(item_id)
+                if source is None:
+                    del members[item_id]
+                    dirty.add(page)
+                    self.stats['removed'] += 1
+                elif source.signature != members[item_id]['signature']:
+                    del members[item_id]
+                    dirty.add(page)
+                    self.stats['changed'] += 1
+                else:
+                    members[item_id]['path'] = source.path
+                    placed.add(item_id)
+
+        pending = {}
+        for item_id, source in sources.items():
+            if item_id in placed:
+                continue
+            if item_id not in known:
+                self.stats['added'] += 1
+            with Image.open(source.path) as image:
+                size = image.size
+            pending[item_id] = {'name': source.name, 'path': source.path,
+                                'signature': source.signature, 'rect': [0, 0, size[0], size[1]]}
+
+        # 新图标优先放入需要重建的页和最后一页，仍放不下的开新页
+        candidates = sorted(dirty)
+        if pages and pending:
+            last = max(pages)
+            if last not in dirty:
+                candidates.append(last)
+        for page in candidates:
+            if page not in pages:
+                continue
+            before = set(pages[page])
+            pages[page], pending = self._pack_page(pages[page], pending)
+            if set(pages[page]) != before:
+                dirty.add(page)
+
+        next_page = max(pages) + 1 if pages else 0
+        while pending:
+            members, pending = self._pack_page({}, pending)
+            if not members:
+                item_id = next(iter(pending))
+                logging.error(
+                    f"Icon of item {item_id} does not fit into a {self.max_size}px atlas, skipping")
+                del pending[item_id]
+                continue
+            pages[next_page] = members
+            dirty.add(next_page)
+            next_page += 1
+
+        for page in sorted(dirty):
+            members = pages.get(page)
+            if members:
+                self._render_page(Image, page, members)
+                self.stats['rebuilt'] += 1
+            else:
+                pages.pop(page, None)
+                for ext in ('.rgba', '.png'):
+                    if os.path.exists(page_path(self.directory, page, ext)):
+                        os.remove(page_path(self.directory, page, ext))
+
+        self._write_index(pages)
+        state = {
+            'max_size': self.max_size,
+            'padding': self.padding,
+            'pages': {str(page): {str(item_id): member for item_id, member in members.items()}
+                      for page, members in sorted(pages.items())}
+        }
+        _write_atomic(os.path.join(self.directory, STATE_FILE),
+                      json.dumps(state, ensure_ascii=False).encode('utf-8'))
+        self.stats['icons'] = sum(len(members) for members in pages.values())
+        self.stats['pages'] = len(pages)
+        return self.stats
+
+    def _pack_page(self, members: dict, pending: dict):
+        """
+        重新排布一页：已有图标和待放入的图标一起按高度从高到低装箱
+
+        Returns:
+            tuple: (这一页的图标, 放不下的图标)
+        """
+        packer = ShelfPacker(self.max_size, self.padding)
+        candidates = list(members.items()) + list(pending.items())
+        candidates.sort(key=lambda entry: (-entry[1]['rect'][3], -entry[1]['rect'][2], entry[0]))
+        packed = {}
+        rest = {}
+        for item_id, member in candidates:
+            width, height = member['rect'][2:]
+            position = packer.add(width, height)
+            if position is None:
+                rest[item_id] = member
+                continue
+            member['rect'] = [position[0], position[1], width, height]
+            packed[item_id] = member
+        return packed, rest
+
+    def _render_page(self, Image, page: int, members: dict):
+        width = max(m['rect'][0] + m['rect'][2] for m in members.values())
+        height = max(m['rect'][1] + m['rect'][3] for m in members.values())
+        atlas = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        for member in members.values():
+            with Image.open(member['path']) as icon:
+                atlas.paste(icon.convert('RGBA'), tuple(member['rect'][:2]))
+        _write_atomic(page_path(self.directory, page), atlas.tobytes())
+        if self.write_png:
+            tmp_path = page_path(self.directory, page, '.png.tmp')
+            atlas.save(tmp_path, format='PNG')
+            os.replace(tmp_path, page_path(self.directory, page, '.png'))
+
+    def _write_index(self, pages: dict):
+        records = sorted((item_id, page, member)
+                         for page, members in pages.items() for item_id, member in members.items())
+        page_count = max(pages) + 1 if pages else 0
+        names = bytearray()
+        body = bytearray()
+        for item_id, page, member in records:
+            name = member['name'].encode('utf-8')[:0xffff]
+            body += _RECORD.pack(item_id, page, *member['rect'], len(names), len(name))
+            names += name
+
+        page_table = bytearray()
+        for page in range(page_count):
+            members = pages.get(page)
+            if members:
+                width = max(m['rect'][0] + m['rect'][2] for m in members.values())
+                height = max(m['rect'][1] + m['rect'][3] for m in members.values())
+            else:
+                width = height = 0
+            page_table += _PAGE.pack(width, height)
+
+        page_offset = _HEADER.size + len(body)
+        names_offset = page_offset + len(page_table)
+        header = _HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(records), page_count,
+                              page_offset, names_offset)
+        _write_atomic(os.path.join(self.directory, INDEX_FILE),
+                      bytes(header) + bytes(body) + bytes(page_table) + bytes(names))
+
+    def format_stats(self) -> str:
+        """将构建统计格式化为日志文本"""
+        return (f"{self.stats['icons']} icons in {self.stats['pages']} pages, "
+                f"{self.stats['rebuilt']} pages rebuilt ({self.stats['added']} added, "
+                f"{self.stats['changed']} changed, {self.stats['removed']} removed)")
+
+
+class AtlasIndex:
+    """
+    通过内存映射读取图集索引和像素，按物品ID二分查找，不需要打开单个图标文件
+
+        with AtlasIndex('cape_atlas') as atlas:
+            entry = atlas.lookup(1102000)
+            pixels = atlas.read_pixels(entry)   # entry.width * entry.height * 4 字节的RGBA
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._file = open(os.path.join(directory, INDEX_FILE), 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.page_count, self._page_offset, self._names_offset = \
+            _HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            self.close()
+            raise ValueError(f"不是有效的图集索引: {directory}")
+        self._pages = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _item_id_at(self, position: int) -> int:
+        return struct.unpack_from('<q', self._map, _HEADER.size + position * _RECORD.size)[0]
+
+    def _entry_at(self, position: int) -> AtlasEntry:
+        item_id, page, x, y, width, height, name_offset, name_length = _RECORD.unpack_from(
+            self._map, _HEADER.size + position * _RECORD.size)
+        start = self._names_offset + name_offset
+        name = self._map[start:start + name_length].decode('utf-8', errors='replace')
+        return AtlasEntry(item_id, page, x, y, width, height, name)
+
+    def lookup(self, item_id: int):
+        """按物品ID查找图标所在的页和位置，不存在时返回None"""
+        position = bisect.bisect_left(_IdView(self), item_id)
+        if position < self.count and self._item_id_at(position) == item_id:
+            return self._entry_at(position)
+        return None
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self._entry_at(position)
+
+    def page_size(self, page: int) -> tuple:
+        return _PAGE.unpack_from(self._map, self._page_offset + page * _PAGE.size)
+
+    def _page_map(self, page: int):
+        page_map = self._pages.get(page)
+        if page_map is None:
+            with open(page_path(self.directory, page), 'rb') as f:
+                page_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._pages[page] = page_map
+        return page_map
+
+    def read_pixels(self, entry: AtlasEntry) -> bytes:
+        """读取图标的RGBA像素，按行排列"""
+        page_width = self.page_size(entry.page)[0]
+        page_map = self._page_map(entry.page)
+        stride = page_width * 4
+        row_size = entry.width * 4
+        rows = []
+        for row in range(entry.y, entry.y + entry.height):
+            start = row * stride + entry.x * 4
+            rows.append(page_map[start:start + row_size])
+        return b''.join(rows)
+
+    def close(self):
+        for page_map in self._pages.values():
+            page_map.close()
+        self._pages.clear()
+        self._map.close()
+        self._file.close()
+
+
+class _IdView:
+    """让bisect直接在索引记录上按物品ID二分查找"""
+
+    def __init__(self, index: AtlasIndex):
+        self._index = index
+
+    def __len__(self) -> int:
+        return self._index.count
+
+    def __getitem__(self, position: int) -> int:
+        return self._index._item_id_at(position)
+
+
+def build_configured_atlas(store, checkpoint=None, results_file: str = None, output_dir: str = None):
+    """
+    按ITEM_CONFIG['ATLAS']构建图集，优先使用断点记录中的全部下载结果，未启用断点续传时使用结果文件
+
+    Args:
+        store: 图标所在目录的ImageStore
+        checkpoint: 断点记录
+        results_file: 结果文件
+        output_dir: 图集的输出目录，默认为ITEM_CONFIG['PATHS']['ATLAS']
+    """
+    atlas = ITEM_CONFIG['ATLAS']
+    output_dir = output_dir or ITEM_CONFIG['PATHS']['ATLAS']
+    builder = AtlasBuilder(output_dir, atlas['MAX_SIZE'], atlas['PADDING'], atlas['PNG'])
+    if checkpoint is not None:
+        sources = iter_checkpoint_sources(checkpoint, store)
+    elif results_file is not None:
+        sources = iter_result_sources(results_file, store)
+    else:
+        raise ValueError("构建图集需要断点记录或结果文件")
+    builder.build(sources)
+    logging.info(f"Atlas: {builder.format_stats()} -> {output_dir}")
+    return builder
@@ -0,0 +1,67 @@
+"""
+测试共用的fixture：每个测试在临时目录中运行，使用本地模拟接口，结束后恢复配置和进程内共享的对象
+"""
+import copy
+
+import pytest
+
+import config
+import http_cache
+import http_client
+import log_queue
+import metrics
+import rate_control
+import retry_policy
+from mock_server import MockCatalog, base_url, start_server
+
+_CONFIG_NAMES = ('COMMON_CONFIG', 'ITEM_CONFIG', 'NPC_CONFIG', 'MAP_CONFIG')
+
+
+def reset_shared_state():
+    """丢弃进程内共享的会话、缓存、重试策略、自适应控制器和指标"""
+    http_client.close_session()
+    http_cache._cache = None
+    rate_control._limiter = None
+    retry_policy._policy = None
+    metrics.reset_metrics()
+
+
+@pytest.fixture(autouse=True)
+def isolated_run(tmp_path, monkeypatch):
+    """在临时目录中运行，测试中修改的配置在结束后恢复"""
+    monkeypatch.chdir(tmp_path)
+    saved = {name: copy.deepcopy(getattr(config, name)) for name in _CONFIG_NAMES}
+    config.COMMON_CONFIG['REQUEST']['RETRY_DELAY'] = 0.01
+    config.COMMON_CONFIG['REQUEST']['MAX_RETRY_DELAY'] = 0.05
+    config.COMMON_CONFIG['REQUEST']['TIMEOUT'] = 5
+    config.COMMON_CONFIG['HTTP_CACHE']['ENABLED'] = False
+    config.ITEM_CONFIG['API']['isCash'] = None
+    reset_shared_state()
+    yield tmp_path
+    log_queue.stop_logging()
+    reset_shared_state()
+    for name, value in saved.items():
+        current = getattr(config, name)
+        current.clear()
+        current.update(value)
+
+
+@pytest.fixture
+def start_mock():
+    """
+    启动模拟接口，返回 start(catalog=None, faults=None) -> 物品API地址，
+    同时把ITEM_CONFIG['API']['BASE_URL']指向该地址
+    """
+    servers = []
+
+    def start(catalog: MockCatalog = None, faults=None, **catalog_options) -> str:
+        server = start_server(catalog or MockCatalog(**catalog_options), faults=faults)
+        servers.append(server)
+        url = base_url(server)
+        config.ITEM_CONFIG['API']['BASE_URL'] = url
+        return url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from checkpoint import CheckpointStore
+from config import COMMON_CONFIG, ITEM_CONFIG
+from downloader.async_engine import StreamTransport, fetch_and_process_items_async, get_transport
+from mock_server import FaultConfig
+from retry_policy import get_retry_policy
+
+
+@pytest.fixture(params=['stream', 'aiohttp'])
+def transport_name(request):
+    if request.param == 'aiohttp':
+        pytest.importorskip('aiohttp')
+    return request.param
+
+
+def run_engine(transport_name: str, concurrency: int = 4):
+    """按指定的传输层运行一次asyncio引擎，返回 (是否成功, 传输层)"""
+    COMMON_CONFIG['CONCURRENT']['ASYNC_TRANSPORT'] = transport_name
+    COMMON_CONFIG['CONCURRENT']['ASYNC_CONCURRENCY'] = concurrency
+    transport = get_transport()
+    return asyncio.run(fetch_and_process_items_async(transport)), transport
+
+
+def downloaded_files() -> list:
+    return sorted(name for name in os.listdir(ITEM_CONFIG['PATHS']['IMAGES']) if name.endswith('.png'))
+
+
+def test_downloads_all_items(start_mock, transport_name):
+    start_mock(items=40)
+
+    ok, transport = run_engine(transport_name)
+
+    assert ok
+    assert len(downloaded_files()) == 40
+    assert transport.stats['requests'] == 41
+
+
+def test_retries_server_errors_and_throttling(start_mock, transport_name):
+    COMMON_CONFIG['REQUEST']['MAX_RETRIES'] = 10
+    COMMON_CONFIG['REQUEST']['RETRY_BUDGET_MIN'] = 1000
+    COMMON_CONFIG['CIRCUIT_BREAKER']['FAILURE_THRESHOLD'] = 1000
+    faults = FaultConfig(error_rate=0.2, throttle_rate=0.1, retry_after=0, seed=1)
+    start_mock(items=40, faults=faults)
+
+    ok, _ = run_engine(transport_name)
+
+    assert ok
+    assert len(downloaded_files()) == 40
+    assert faults.stats['errors'] > 0 and faults.stats['throttled'] > 0
+    assert get_retry_policy().stats['retries'] == faults.stats['errors'] + faults.stats['throttled']
+
+
+def test_resumes_only_unfinished_items(start_mock, transport_name):
+    COMMON_CONFIG['REQUEST']['MAX_RETRIES'] = 1
+    COMMON_CONFIG['CIRCUIT_BREAKER']['FAILURE_THRESHOLD'] = 1000
+    # 第一次运行不重试，部分图标请求失败；这个种子的第一个请求（物品列表）不会失败
+    faults = FaultConfig(error_rate=0.3, seed=2)
+    start_mock(items=40, faults=faults)
+    run_engine(transport_name)
+    first = set(downloaded_files())
+    assert 0 < len(first) < 40
+
+    requests_before = faults.stats['requests']
+    faults.error_rate = 0.0
+    ok, transport = run_engine(transport_name)
+
+    assert ok
+    assert len(downloaded_files()) == 40
+    # 断点记录中已有物品列表，第二次运行只请求失败的图标
+    assert faults.stats['requests'] - requests_before == 40 - len(first)
+    assert transport.stats['requests'] == 40 - len(first)
+
+
+def test_stream_transport_reuses_connections(start_mock):
+    start_mock(items=60)
+
+    ok, transport = run_engine('stream', concurrency=4)
+
+    assert ok
+    assert len(downloaded_files()) == 60
+    assert transport.stats['requests'] == 61
+    # 列表请求加上同时进行的4个请求
+    assert transport.stats['connections'] <= 5
+
+
+def test_stream_response_released_before_last_chunk(start_mock):
+    url = start_mock(items=3)
+
+    async def run():
+        transport = StreamTransport(limit=4, timeout=5)
+        try:
+            for item_id in (1102000, 1102001, 1102002):
+                response = await transport.get(f"{url}{item_id}/icon")
+                assert response.status == 200
+                # 读到一块后不再继续迭代，连接也应已放回连接池
+                async for _ in response.iter_chunks(1 << 20):
+                    break
+                response.close()
+            return transport.stats
+        finally:
+            await transport.close()
+
+    stats = asyncio.run(run())
+    assert stats == {'requests': 3, 'connections': 1}
+
+
+def test_checkpoint_queries_run_off_the_event_loop(start_mock, monkeypatch):
+    start_mock(items=30)
+    calls = []
+
+    def recording(name):
+        method = getattr(CheckpointStore, name)
+
+        def wrapper(self, *args, **kwargs):
+            calls.append((name, threading.current_thread() is threading.main_thread()))
+            return method(self, *args, **kwargs)
+        return wrapper
+
+    for name in ('start_run', 'begin_item_list', 'append_item_list', 'select_items',
+                 'complete_item_list', 'mark', 'finish_runs'):
+        monkeypatch.setattr(CheckpointStore, name, recording(name))
+
+    ok, _ = run_engine('stream')
+
+    assert ok
+    assert {name for name, _ in calls} >= {'start_run', 'begin_item_list', 'select_items', 'finish_runs'}
+    # 事件循环运行在主线程中，断点记录的读写都不应在主线程中执行
+    assert not [name for name, on_loop in calls if on_loop]
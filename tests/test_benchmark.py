@@ -0,0 +1,53 @@
+import json
+
+import benchmark
+
+
+def record(key: str, commit: str, items_per_sec: float, p95: float) -> dict:
+    return {'key': key, 'commit': commit, 'label': None,
+            'metrics': {'items_per_sec': items_per_sec, 'latency_p95_ms': p95, 'peak_rss_mb': 50}}
+
+
+def write_results(path: str, records: list):
+    with open(path, 'w', encoding='utf-8') as f:
+        for item in records:
+            f.write(json.dumps(item) + '\n')
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 50) == 50
+    assert benchmark.percentile(values, 99) == 99
+    assert benchmark.percentile([], 50) is None
+
+
+def test_run_records_download_and_sink_scenarios():
+    argv = ['--results', 'results.jsonl', 'run', '--items', '30', '--workers', '2',
+            '--latency', '0', '--sink', '20']
+    assert benchmark.main(argv) == 0
+
+    records = benchmark.load_results('results.jsonl')
+    by_kind = {item['scenario']['kind']: item for item in records}
+    assert set(by_kind) == {'download', 'sink-update-json', 'sink-stream'}
+    download = by_kind['download']['metrics']
+    assert download['ok'] and download['statuses'] == {'success': 30}
+    # 列表请求加上每个物品一次图标请求
+    assert download['server']['requests'] == 31
+    assert download['items_per_sec'] > 0 and download['latency_p95_ms'] is not None
+    for kind in ('sink-update-json', 'sink-stream'):
+        assert by_kind[kind]['metrics']['items'] == 20
+
+
+def test_compare_flags_regressions(capsys):
+    key = 'download/thread/items=500/workers=3/latency=0.01/errors=0/throttle=0'
+    write_results('results.jsonl', [record(key, 'a', 100, 10), record(key, 'b', 98, 10.5)])
+    assert benchmark.main(['--results', 'results.jsonl', 'compare']) == 0
+
+    write_results('results.jsonl', [record(key, 'a', 100, 10), record(key, 'b', 80, 10)])
+    assert benchmark.main(['--results', 'results.jsonl', 'compare']) == 1
+    assert 'REGRESSION' in capsys.readouterr().out
+
+    # 按标签或提交选择基准
+    write_results('results.jsonl', [record(key, 'a', 70, 10), record(key, 'b', 100, 10),
+                                    record(key, 'c', 80, 10)])
+    assert benchmark.main(['--results', 'results.jsonl', 'compare', '--baseline', 'a']) == 0
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+
+from checkpoint import STATUS_FAILED, STATUS_SUCCESS, CheckpointStore, new_counts
+from config import COMMON_CONFIG, ITEM_CONFIG
+from downloader.engine import load_list
+from downloader.item_download import start_download
+
+MAX_ATTEMPTS = 3
+
+
+def select(checkpoint, counts=None) -> list:
+    """按load_list获取列表并筛选出需要处理的物品"""
+    records, _ = load_list(checkpoint, ITEM_CONFIG['API'])
+    return checkpoint.select_items(list(records), MAX_ATTEMPTS, counts)
+
+
+def mark(checkpoint, items, status: str):
+    for item in items:
+        checkpoint.mark({'id': item.id, 'name': item.name, 'status': status})
+
+
+def test_unfinished_run_resumes_and_finished_run_starts_over(start_mock):
+    start_mock(items=20)
+    checkpoint = CheckpointStore('checkpoint.db', 'CMS/202', 1)
+    selected = select(checkpoint)
+    assert len(selected) == 20
+    mark(checkpoint, selected[:15], STATUS_SUCCESS)
+    mark(checkpoint, selected[15:17], STATUS_FAILED)
+    checkpoint.close()
+
+    # 任务未结束，重启后只处理未完成和失败的物品
+    checkpoint = CheckpointStore('checkpoint.db', 'CMS/202', 1)
+    counts = new_counts()
+    remaining = select(checkpoint, counts)
+    assert [item.id for item in remaining] == [item.id for item in selected[15:]]
+    assert counts[STATUS_SUCCESS] == 15 and counts[STATUS_FAILED] == 2
+    mark(checkpoint, remaining, STATUS_SUCCESS)
+    assert len(checkpoint.finish_runs(MAX_ATTEMPTS)) == 1
+    checkpoint.close()
+
+    # 任务已结束，同一CMS版本的下一次运行重新筛选所有物品
+    checkpoint = CheckpointStore('checkpoint.db', 'CMS/202', 1)
+    assert len(select(checkpoint)) == 20
+    checkpoint.close()
+
+
+def test_run_with_pending_items_is_not_finished(start_mock):
+    start_mock(items=10)
+    checkpoint = CheckpointStore('checkpoint.db', 'CMS/202', 1)
+    selected = select(checkpoint)
+    mark(checkpoint, selected[:9], STATUS_SUCCESS)
+    assert checkpoint.finish_runs(MAX_ATTEMPTS) == []
+    checkpoint.close()
+
+    checkpoint = CheckpointStore('checkpoint.db', 'CMS/202', 1)
+    assert [item.id for item in select(checkpoint)] == [selected[9].id]
+    checkpoint.close()
+
+
+def test_fresh_ignores_unfinished_run(start_mock):
+    start_mock(items=10)
+    checkpoint = CheckpointStore('checkpoint.db', 'CMS/202', 1)
+    mark(checkpoint, select(checkpoint)[:5], STATUS_SUCCESS)
+    checkpoint.close()
+
+    COMMON_CONFIG['CHECKPOINT']['FRESH'] = True
+    checkpoint = CheckpointStore('checkpoint.db', 'CMS/202', 1)
+    assert len(select(checkpoint)) == 10
+    checkpoint.close()
+
+
+def test_completed_download_is_repeated_on_next_run(start_mock):
+    start_mock(items=12)
+    assert start_download()
+    images = ITEM_CONFIG['PATHS']['IMAGES']
+    names = sorted(os.listdir(images))
+    assert len(names) == 12
+
+    for name in names:
+        os.remove(os.path.join(images, name))
+    assert start_download()
+    assert sorted(os.listdir(images)) == names
+
+
+def test_old_checkpoint_is_migrated(start_mock):
+    start_mock(items=5)
+    conn = sqlite3.connect('checkpoint.db')
+    conn.execute(
+        "CREATE TABLE runs (run_key TEXT PRIMARY KEY, cms_version TEXT NOT NULL, "
+        "params TEXT NOT NULL, complete INTEGER NOT NULL DEFAULT 0, fetched_at REAL NOT NULL)")
+    conn.execute("INSERT INTO runs VALUES ('old', 'CMS/202', '{}', 1, 0)")
+    conn.commit()
+    conn.close()
+
+    checkpoint = CheckpointStore('checkpoint.db', 'CMS/202', 1)
+    selected = select(checkpoint)
+    assert len(selected) == 5
+    mark(checkpoint, selected, STATUS_SUCCESS)
+    assert len(checkpoint.finish_runs(MAX_ATTEMPTS)) == 1
+    checkpoint.close()
@@ -0,0 +1,51 @@
+import copy
+import json
+import os
+
+from config import ITEM_CONFIG
+from downloader import delta_download
+from downloader.delta_download import CHANGES_PREFIX, get_version_dir, start_delta_download
+from mock_server import MockCatalog
+
+
+def test_second_version_links_unchanged_icons(start_mock):
+    url = start_mock(MockCatalog(items=30, added_per_version=5, churn=0.2))
+    paths = copy.deepcopy(ITEM_CONFIG['PATHS'])
+    output_dir = ITEM_CONFIG['PATHS']['DELTA_OUTPUT']
+
+    assert start_delta_download()
+    ITEM_CONFIG['API']['BASE_URL'] = url.replace('/202/', '/203/')
+    assert start_delta_download()
+
+    # 版本目录通过参数传递，不修改全局配置
+    assert ITEM_CONFIG['PATHS'] == paths
+    version_dir = get_version_dir(output_dir, 'CMS/203')
+    report_name = next(name for name in os.listdir(version_dir) if name.startswith(CHANGES_PREFIX))
+    with open(os.path.join(version_dir, report_name), 'r', encoding='utf-8') as f:
+        counts = json.load(f)['counts']
+    assert counts['added'] == 5
+    assert counts['linked'] == counts['unchanged'] > 0
+    assert counts['downloaded'] == counts['added'] + counts['changed']
+    images_dir = os.path.join(version_dir, os.path.basename(paths['IMAGES']))
+    assert len(os.listdir(images_dir)) == 35
+
+
+def test_relinked_items_missing_from_previous_version_are_counted_once(start_mock, monkeypatch):
+    url = start_mock(MockCatalog(items=20))
+    output_dir = ITEM_CONFIG['PATHS']['DELTA_OUTPUT']
+    assert start_delta_download()
+
+    # 旧版本中丢失的图标需要重新下载，但在断点统计中只计一次
+    old_images = os.path.join(get_version_dir(output_dir, 'CMS/202'),
+                              os.path.basename(ITEM_CONFIG['PATHS']['IMAGES']))
+    for name in sorted(os.listdir(old_images))[:4]:
+        os.remove(os.path.join(old_images, name))
+    logged = []
+    monkeypatch.setattr(delta_download, 'log_checkpoint_counts', logged.append)
+    ITEM_CONFIG['API']['BASE_URL'] = url.replace('/202/', '/203/')
+    assert start_delta_download()
+
+    assert logged[0]['pending'] == 20
+    version_dir = get_version_dir(output_dir, 'CMS/203')
+    images_dir = os.path.join(version_dir, os.path.basename(ITEM_CONFIG['PATHS']['IMAGES']))
+    assert len(os.listdir(images_dir)) == 20
@@ -0,0 +1,19 @@
+from checkpoint import CheckpointStore
+from config import ITEM_CONFIG
+from downloader.engine import load_list
+
+
+def test_resumed_list_is_filtered_like_a_fresh_one(start_mock):
+    start_mock(items=20)
+    api = ITEM_CONFIG['API']
+    checkpoint = CheckpointStore('checkpoint.db', 'CMS/202', 1)
+    try:
+        records, _ = load_list(checkpoint, api)
+        fresh = [record.id for record in records]
+        assert len(fresh) == 20
+
+        # 列表已完整保存且物品都未完成，第二次复用断点记录中的列表
+        records, _ = load_list(checkpoint, api, lambda record: record.id % 4 == 0)
+        assert [record.id for record in records] == [item_id for item_id in fresh if item_id % 4 == 0]
+    finally:
+        checkpoint.close()
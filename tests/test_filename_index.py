@@ -0,0 +1,44 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from config import ITEM_CONFIG
+from downloader.item_download import start_download
+from filename_index import FilenameIndex
+from mock_server import MockCatalog
+
+
+def test_existing_files_are_indexed_and_renamed():
+    os.makedirs('images')
+    for name in ('Cape.png', 'Cape (1).png', '.Cape.png.1.part'):
+        open(os.path.join('images', name), 'wb').close()
+
+    names = FilenameIndex('images', strategy='rename', pattern='{name} ({index}){ext}')
+    assert len(names) == 2
+    assert names.reserve('Cape') == ('Cape (2).png', True)
+    assert names.reserve('Hat') == ('Hat.png', False)
+    names.release('Hat.png')
+    assert 'Hat.png' not in names
+
+
+def test_skip_and_overwrite_strategies():
+    names = FilenameIndex('images', extra_names=['Cape.png'], strategy='skip')
+    assert names.reserve('Cape') == (None, True)
+    names = FilenameIndex('images', extra_names=['Cape.png'], strategy='overwrite')
+    assert names.reserve('Cape') == ('Cape.png', True)
+    assert not names.claim('Cape.png')
+    assert names.claim('Hat.png')
+
+
+def test_concurrent_reservations_get_distinct_names():
+    names = FilenameIndex('images', strategy='rename', pattern='{name}_{index}{ext}')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        reserved = list(executor.map(lambda _: names.reserve('Cape')[0], range(200)))
+    assert len(set(reserved)) == 200
+    assert 'Cape.png' in reserved and 'Cape_199.png' in reserved
+
+
+def test_items_with_same_name_are_saved_under_distinct_files(start_mock):
+    start_mock(MockCatalog(items=24, duplicate_names=4))
+    assert start_download()
+    files = os.listdir(ITEM_CONFIG['PATHS']['IMAGES'])
+    assert len(files) == len(set(files)) == 24
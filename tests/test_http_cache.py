@@ -0,0 +1,78 @@
+import os
+
+import requests
+
+from config import COMMON_CONFIG
+from http_cache import HttpCache, get_http_cache
+from mock_server import FaultConfig
+from utils import safe_request
+
+
+def icon_url(base: str, index: int) -> str:
+    return f"{base}{1102000 + index}/icon"
+
+
+def test_not_modified_is_served_from_cache(start_mock):
+    faults = FaultConfig()
+    url = icon_url(start_mock(items=3, faults=faults), 0)
+    COMMON_CONFIG['HTTP_CACHE']['ENABLED'] = True
+
+    first = safe_request(url)
+    assert not getattr(first, 'from_cache', False)
+    second = safe_request(url)
+    assert second.from_cache and second.content == first.content
+    streamed = safe_request(url, stream=True)
+    assert b''.join(streamed.iter_content(1024)) == first.content
+
+    assert faults.stats['requests'] == 3
+    stats = get_http_cache().stats
+    assert stats['hits'] == 2 and stats['misses'] == 1 and stats['stores'] == 1
+
+
+def test_least_recently_used_entries_are_evicted(start_mock):
+    base = start_mock(items=3)
+    responses = [requests.get(icon_url(base, index)) for index in range(3)]
+    sizes = [len(response.content) for response in responses]
+    keys = [HttpCache.make_key(response.url) for response in responses]
+
+    cache = HttpCache('cache', sum(sizes) - 1)
+    for key, response in zip(keys, responses):
+        cache.store(key, response)
+    assert cache.lookup(keys[0]) is None
+    assert not os.path.exists(cache.body_path(keys[0]))
+    assert cache.lookup(keys[1]) and cache.lookup(keys[2])
+    assert cache.stats['evictions'] == 1
+    cache.close()
+
+    # 上限调小后重新打开时先淘汰超出的部分
+    cache = HttpCache('cache', sizes[2])
+    assert cache.lookup(keys[1]) is None
+    assert cache.lookup(keys[2])['size'] == sizes[2]
+    cache.close()
+
+
+def test_entry_evicted_during_revalidation_is_refetched(start_mock):
+    faults = FaultConfig()
+    url = icon_url(start_mock(items=1, faults=faults), 0)
+    COMMON_CONFIG['HTTP_CACHE']['ENABLED'] = True
+    expected = safe_request(url).content
+
+    cache = get_http_cache()
+    lookup = cache.lookup
+
+    def lookup_then_evict(key):
+        # 模拟其他线程在条件请求发出后淘汰了这个条目
+        entry = lookup(key)
+        os.remove(cache.body_path(key))
+        return entry
+
+    cache.lookup = lookup_then_evict
+    try:
+        response = safe_request(url)
+    finally:
+        del cache.lookup
+    assert response.content == expected
+    assert not getattr(response, 'from_cache', False)
+    # 一次条件请求得到304，一次不带条件的请求重新下载
+    assert faults.stats['requests'] == 3
+    assert os.path.exists(cache.body_path(cache.make_key(url)))
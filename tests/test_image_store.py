@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+from config import COMMON_CONFIG, ITEM_CONFIG
+from downloader.item_download import start_download
+from image_store import BLOBS_DIR, MANIFEST_FILE, PARTIAL_SUFFIX, ImageStore
+from mock_server import MockCatalog, make_png
+
+
+def blob_files(directory: str) -> list:
+    blobs = os.path.join(directory, BLOBS_DIR)
+    return [name for _, _, names in os.walk(blobs) for name in names]
+
+
+def test_content_mode_stores_each_icon_once(start_mock):
+    start_mock(MockCatalog(items=20, unique_icons=5))
+    COMMON_CONFIG['FILE_HANDLING']['STORE_MODE'] = 'content'
+    assert start_download()
+
+    images = ITEM_CONFIG['PATHS']['IMAGES']
+    names = sorted(name for name in os.listdir(images) if name.endswith('.png'))
+    assert len(names) == 20
+    assert len(blob_files(images)) == 5
+    with open(os.path.join(images, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert sorted(manifest) == names
+
+    store = ImageStore(images)
+    for name in names:
+        # 每个文件名都是指向内容文件的硬链接
+        assert os.path.samefile(os.path.join(images, name), store.blob_path(manifest[name]))
+
+
+def test_manifest_mode_keeps_names_only_in_manifest(start_mock):
+    start_mock(MockCatalog(items=12, unique_icons=3))
+    COMMON_CONFIG['FILE_HANDLING'].update({'STORE_MODE': 'content', 'LINK_MODE': 'manifest'})
+    assert start_download()
+
+    images = ITEM_CONFIG['PATHS']['IMAGES']
+    assert not [name for name in os.listdir(images) if name.endswith('.png')]
+    store = ImageStore(images)
+    assert len(store.names()) == 12
+    for name in store.names():
+        assert store.exists(os.path.join(images, name))
+        with open(store.path_of(name), 'rb') as f:
+            assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+
+def test_plain_mode_writes_no_manifest():
+    store = ImageStore('images', 'plain')
+    os.makedirs('images')
+    store.save(make_png(2, 2, (1, 2, 3, 255)), 'a.png')
+    store.close()
+    assert os.listdir('images') == ['a.png']
+
+
+@pytest.mark.parametrize('mode', ['plain', 'content'])
+def test_failed_write_leaves_no_partial_file(mode):
+    os.makedirs('images')
+    store = ImageStore('images', mode)
+    data = make_png(2, 2, (1, 2, 3, 255))
+    with pytest.raises(ValueError):
+        store.save_stream([data], 'short.png', len(data) + 1)
+    with pytest.raises(ValueError):
+        store.save(b'not a png', 'bad.png')
+    assert not [name for name in os.listdir('images') if name.endswith('.png')]
+    assert not [name for name in blob_files('images') if name.endswith(PARTIAL_SUFFIX)]
+
+
+def test_cleanup_removes_partials_from_interrupted_run():
+    os.makedirs(os.path.join('images', BLOBS_DIR))
+    leftovers = [os.path.join('images', f".a.png.1{PARTIAL_SUFFIX}"),
+                 os.path.join('images', BLOBS_DIR, f".b.png.2{PARTIAL_SUFFIX}")]
+    for path in leftovers:
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+    with open(os.path.join('images', 'kept.png'), 'wb') as f:
+        f.write(b'kept')
+
+    assert ImageStore('images', 'content').cleanup_partials() == 2
+    assert not any(os.path.exists(path) for path in leftovers)
+    assert os.path.exists(os.path.join('images', 'kept.png'))
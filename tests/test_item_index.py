@@ -0,0 +1,80 @@
+import pytest
+
+import item_index
+from config import ITEM_CONFIG
+from downloader.item_download import start_download
+from item_index import ItemIndex
+from mock_server import MockCatalog
+
+ENTRIES = [
+    {'cms_version': 'CMS/202', 'id': 3, 'name': 'Blue Cape', 'isCash': False, 'path': 'a/3.png'},
+    {'cms_version': 'CMS/202', 'id': 1, 'name': 'Red Cape', 'isCash': True, 'path': 'a/1.png'},
+    {'cms_version': 'CMS/202', 'id': 2, 'name': 'Red Hat', 'path': 'a/2.png'},
+    {'cms_version': 'CMS/201', 'id': 1, 'name': 'Red Cape', 'path': 'b/1.png'},
+]
+
+
+@pytest.fixture(params=['fts', 'like'])
+def index(request, monkeypatch):
+    """分别使用FTS5和LIKE搜索的索引"""
+    if request.param == 'like':
+        # 创建全文索引失败时退回为LIKE查询
+        monkeypatch.setattr(item_index, '_FTS_SCHEMA',
+                            "CREATE VIRTUAL TABLE items_fts USING no_such_module(name);")
+    index = ItemIndex('index.db')
+    assert index.fts == (request.param == 'fts')
+    index.add(ENTRIES)
+    yield index
+    index.close()
+
+
+def keys(entries: list) -> list:
+    return [(entry['cms_version'], entry['id']) for entry in entries]
+
+
+def test_search_matches_every_term(index):
+    assert keys(index.search('red cape', 'CMS/202')) == [('CMS/202', 1)]
+    assert sorted(keys(index.search('Red', 'CMS/202'))) == [('CMS/202', 1), ('CMS/202', 2)]
+    assert sorted(keys(index.search('Red Cape'))) == [('CMS/201', 1), ('CMS/202', 1)]
+    assert index.search('   ') == []
+    assert index.search('Green') == []
+    assert len(index.search('Cape', limit=1)) == 1
+
+
+def test_search_treats_quotes_as_text(index):
+    index.add([{'cms_version': 'CMS/202', 'id': 4, 'name': 'The "Cape"', 'path': 'a/4.png'}])
+    # 引号不会破坏FTS5查询语法
+    assert ('CMS/202', 4) in keys(index.search('"Cape"', 'CMS/202'))
+    assert keys(index.search('The "Cape', 'CMS/202')) == [('CMS/202', 4)]
+
+
+def test_renamed_items_are_found_by_new_name(index):
+    index.add([dict(ENTRIES[0], name='Green Cape')])
+    assert index.search('Blue') == []
+    assert keys(index.search('Green')) == [('CMS/202', 3)]
+    assert index.get(3)[0]['name'] == 'Green Cape'
+
+
+def test_lookup_by_id_and_missing(index):
+    assert keys(index.get(1)) == [('CMS/202', 1), ('CMS/201', 1)]
+    assert index.get(1, 'CMS/201')[0]['path'] == 'b/1.png'
+    assert index.get(1)[0]['isCash'] is True and index.get(2)[0]['isCash'] is None
+    assert index.missing([5, 1, 4, 5, 2], 'CMS/202') == [5, 4]
+    assert index.summary() == {'CMS/201': 1, 'CMS/202': 3}
+
+
+def test_download_writes_successful_items_to_index(start_mock):
+    start_mock(MockCatalog(items=20, duplicate_names=10))
+    assert start_download()
+
+    downloaded = ItemIndex(ITEM_CONFIG['PATHS']['INDEX'])
+    try:
+        assert downloaded.summary() == {'CMS/202': 20}
+        first = downloaded.get(1102000)[0]
+        assert first['category'] == 'Equip/Armor/Cape' and first['sha256']
+        # 重名物品都能搜到
+        assert sorted(keys(downloaded.search('Mock Cape 3'))) == [
+            ('CMS/202', 1102003), ('CMS/202', 1102013)]
+        assert downloaded.missing(range(1102018, 1102022), 'CMS/202') == [1102020, 1102021]
+    finally:
+        downloaded.close()
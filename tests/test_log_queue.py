@@ -0,0 +1,26 @@
+import logging
+import queue
+import threading
+
+from log_queue import DroppingQueueHandler
+
+
+def make_record(level: int, message: str):
+    return logging.makeLogRecord({'levelno': level, 'levelname': logging.getLevelName(level),
+                                  'msg': message})
+
+
+def test_full_queue_drops_only_records_below_warning():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.handle(make_record(logging.INFO, 'first'))
+    handler.handle(make_record(logging.INFO, 'dropped'))
+    assert handler.dropped == 1
+
+    # 警告等待队列有空位，不被丢弃
+    sender = threading.Thread(target=handler.handle, args=(make_record(logging.WARNING, 'kept'),))
+    sender.start()
+    assert handler.queue.get(timeout=5).getMessage() == 'first'
+    sender.join(timeout=5)
+    assert not sender.is_alive()
+    assert handler.queue.get(timeout=5).getMessage() == 'kept'
+    assert handler.dropped == 1
@@ -0,0 +1,69 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+from config import COMMON_CONFIG
+from downloader.item_download import start_download
+from mock_server import MockCatalog
+
+
+def test_histogram_quantile_and_render():
+    histogram = metrics.Histogram('t_seconds', "test", ('stage',), buckets=(0.1, 1))
+    for value in (0.05, 0.05, 0.5, 5):
+        histogram.observe(value, stage='a')
+    (counts, total), = histogram.snapshot().values()
+    assert counts == [2, 1, 1] and total == pytest.approx(5.6)
+    assert histogram.quantile(counts, 0.5) == pytest.approx(0.1)
+    # 落在+Inf桶中时返回最大的有限分桶上限
+    assert histogram.quantile(counts, 1.0) == 1
+    assert histogram.render() == [
+        't_seconds_bucket{stage="a",le="0.1"} 2',
+        't_seconds_bucket{stage="a",le="1"} 3',
+        't_seconds_bucket{stage="a",le="+Inf"} 4',
+        't_seconds_sum{stage="a"} 5.600000',
+        't_seconds_count{stage="a"} 4',
+    ]
+
+
+def test_disabled_metrics_record_nothing():
+    COMMON_CONFIG['METRICS']['ENABLED'] = False
+    with metrics.stage_timer('disk_write'):
+        metrics.count('items', status='success')
+    assert metrics.get_metrics() is None
+    assert metrics.format_stage_summary() == [] and metrics.format_counters() == ''
+
+
+def test_download_records_stages_and_counters(start_mock):
+    start_mock(MockCatalog(items=20))
+    assert start_download()
+
+    registry = metrics.get_metrics()
+    summary = registry.stage_summary()
+    assert summary['list_fetch']['count'] == 1
+    for stage in ('http_ttfb', 'http_body', 'disk_write', 'item_total'):
+        assert summary[stage]['count'] >= 20
+    assert summary['item_total']['count'] == 20
+    assert registry.items.values() == {('success',): 20}
+    assert registry.responses.values()[('200',)] == 21
+    assert registry.bytes.values()[('icon',)] > 0
+    assert metrics.format_stage_summary()[-1].startswith('Most time spent in ')
+
+
+def test_metrics_endpoint_serves_prometheus_text():
+    metrics.count('retries', reason='timeout')
+    server = metrics.start_metrics_server(port=0)
+    assert server is not None
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            body = response.read().decode('utf-8')
+        assert '# TYPE crawler_stage_seconds histogram' in body
+        assert 'crawler_retries_total{reason="timeout"} 1' in body
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/other")
+        assert error.value.code == 404
+    finally:
+        metrics.stop_metrics_server()
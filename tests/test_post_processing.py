@@ -0,0 +1,41 @@
+import glob
+import json
+import os
+
+from config import ITEM_CONFIG
+from downloader.item_download import start_download
+from icon_variants import get_variant_dir
+
+
+def read_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, 'manifest.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_variants_and_recompression_run_after_download(start_mock):
+    start_mock(items=6)
+    ITEM_CONFIG['VARIANTS'].update({'ENABLED': True, 'SIZES': [1, 2], 'PROCESSES': 2})
+    ITEM_CONFIG['RECOMPRESS'].update({'ENABLED': True, 'FORMATS': ['png', 'webp'], 'PROCESSES': 2})
+
+    assert start_download()
+
+    icons = sorted(name for name in os.listdir(ITEM_CONFIG['PATHS']['IMAGES']) if name.endswith('.png'))
+    assert len(icons) == 6
+    variants = read_manifest(ITEM_CONFIG['PATHS']['VARIANTS'])
+    assert sorted(variants) == icons
+    for filename, outputs in variants.items():
+        assert outputs == [os.path.join(get_variant_dir(scale, 'nearest'), filename) for scale in (1, 2)]
+    recompressed = read_manifest(ITEM_CONFIG['PATHS']['RECOMPRESSED'])
+    assert sorted(recompressed) == icons
+    for filename, sizes in recompressed.items():
+        source = os.path.getsize(os.path.join(ITEM_CONFIG['PATHS']['IMAGES'], filename))
+        assert sizes['source'] == source
+        # 无损优化后的PNG不会比原图大
+        assert sizes['png']['size'] <= source
+        assert os.path.exists(os.path.join(ITEM_CONFIG['PATHS']['RECOMPRESSED'], sizes['webp']['path']))
+
+    # 最终的JSON结果文件中每个下载成功的物品也带有重新压缩前后的大小
+    json_filename, = glob.glob(f"{ITEM_CONFIG['PATHS']['JSON_BASE']}_*.json")
+    with open(json_filename, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    assert {result['filename']: result['recompressed'] for result in results} == recompressed
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from config import COMMON_CONFIG
+from rate_control import AdaptiveLimiter, get_limiter, parse_retry_after
+from utils import safe_request
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('120') == 120.0
+    assert parse_retry_after('Thu, 01 Jan 1970 00:00:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_concurrency_grows_when_fast_and_halves_when_throttled():
+    limiter = AdaptiveLimiter(1, 4, 2, target_latency=1.0)
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(0.01, 200)
+    assert int(limiter.limit) == 4
+    assert limiter.rate is None
+
+    limiter.acquire()
+    limiter.release(0.01, 429)
+    assert limiter.limit == 2.0
+    # 被限流后开始限制速率
+    assert limiter.rate is not None
+    assert limiter.stats['throttled'] == 1 and limiter.stats['decreases'] == 1
+
+
+def test_retry_after_pauses_new_requests():
+    limiter = AdaptiveLimiter(1, 4, 2)
+    limiter.acquire()
+    limiter.release(0.01, 503, retry_after=0.2)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+    limiter.release(0.01, 200)
+
+
+def test_acquire_waits_for_a_free_slot():
+    limiter = AdaptiveLimiter(1, 1, 1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def second():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not acquired.wait(0.1)
+    limiter.release(0.01, 200)
+    assert acquired.wait(2)
+    thread.join()
+    assert limiter.in_flight == 1
+
+
+def test_streamed_response_holds_slot_until_body_is_read(start_mock):
+    url = f"{start_mock(items=2)}1102000/icon"
+    COMMON_CONFIG['ADAPTIVE']['ENABLED'] = True
+    limiter = get_limiter()
+
+    response = safe_request(url)
+    assert response.content and limiter.in_flight == 0
+
+    response = safe_request(url, stream=True)
+    assert limiter.in_flight == 1
+    assert b''.join(response.iter_content(16))
+    assert limiter.in_flight == 0
+
+    # 没有读完就关闭的响应同样归还名额，且只归还一次
+    response = safe_request(url, stream=True)
+    assert limiter.in_flight == 1
+    response.close()
+    response.close()
+    assert limiter.in_flight == 0
+
+
+def test_streamed_response_through_cache_releases_slot(start_mock):
+    url = f"{start_mock(items=2)}1102000/icon"
+    COMMON_CONFIG['ADAPTIVE']['ENABLED'] = True
+    COMMON_CONFIG['HTTP_CACHE']['ENABLED'] = True
+    limiter = get_limiter()
+
+    with safe_request(url, stream=True) as response:
+        assert limiter.in_flight == 1
+        body = b''.join(response.iter_content(16))
+    assert limiter.in_flight == 0
+    cached = safe_request(url, stream=True)
+    assert limiter.in_flight == 0
+    assert cached.from_cache and b''.join(cached.iter_content(16)) == body
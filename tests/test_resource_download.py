@@ -0,0 +1,39 @@
+import glob
+import json
+import os
+
+from config import MAP_CONFIG, NPC_CONFIG
+from downloader import map_download, npc_download
+
+
+def read_results(json_base: str) -> list:
+    json_filename, = glob.glob(f"{json_base}_*.json")
+    with open(json_filename, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_npc_download_saves_all_frames(start_mock):
+    url = start_mock(items=1, npcs=3, frames=2)
+    NPC_CONFIG['API']['BASE_URL'] = url.replace('/item/', '/npc/')
+
+    assert npc_download.start_download()
+
+    results = read_results(NPC_CONFIG['PATHS']['JSON_BASE'])
+    assert sorted(result['status'] for result in results) == ['success'] * 3
+    frames = sum(result['frames'] for result in results)
+    assert frames > 0
+    assert len(os.listdir(NPC_CONFIG['PATHS']['IMAGES'])) == frames
+
+
+def test_map_download_in_chunks(start_mock):
+    url = start_mock(items=1, maps=2, map_size=256)
+    MAP_CONFIG['API']['BASE_URL'] = url.replace('/item/', '/map/')
+    MAP_CONFIG['CHUNKS']['SIZE_MB'] = 64 / 1024
+
+    assert map_download.start_download()
+
+    results = read_results(MAP_CONFIG['PATHS']['JSON_BASE'])
+    assert [result['status'] for result in results] == ['success'] * 2
+    assert all(result['chunks'] > 1 for result in results)
+    images = sorted(name for name in os.listdir(MAP_CONFIG['PATHS']['IMAGES']) if name.endswith('.png'))
+    assert images == sorted(f"{result['id']}.png" for result in results)
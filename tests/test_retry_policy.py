@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+import http_client
+from config import COMMON_CONFIG
+from mock_server import FaultConfig
+from retry_policy import (
+    CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, CircuitBreaker, RetryPolicy, get_retry_policy
+)
+from utils import safe_request
+
+
+def test_breaker_opens_and_lets_one_probe_through():
+    breaker = CircuitBreaker('host', failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    # 探测请求结束前不放行其他请求
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_circuit():
+    breaker = CircuitBreaker('host', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+
+
+def test_retry_budget_limits_retries():
+    policy = RetryPolicy(max_attempts=5, base_delay=0, max_delay=0, budget_ratio=0, budget_min=2,
+                         failure_threshold=100, reset_timeout=1)
+    breaker = policy.breaker_for('http://host/a')
+    assert policy.retry_delay(0, breaker, 'http://host/a', 'error') is not None
+    assert policy.retry_delay(1, breaker, 'http://host/a', 'error') is not None
+    assert policy.retry_delay(2, breaker, 'http://host/a', 'error') is None
+    assert policy.stats == {'retries': 2, 'budget_exhausted': 1, 'circuit_rejected': 0}
+
+
+def test_server_errors_are_retried_up_to_max_attempts(start_mock):
+    faults = FaultConfig(error_rate=1.0)
+    url = start_mock(items=1, faults=faults)
+    assert safe_request(url) is None
+    assert faults.stats['requests'] == COMMON_CONFIG['REQUEST']['MAX_RETRIES']
+
+
+def test_client_errors_are_not_retried(start_mock):
+    faults = FaultConfig()
+    url = start_mock(items=1, faults=faults)
+    assert safe_request(f"{url}0/icon") is None
+    assert faults.stats['requests'] == 1
+
+
+def test_probe_raising_unexpected_error_releases_probe(start_mock):
+    COMMON_CONFIG['CIRCUIT_BREAKER'].update({'FAILURE_THRESHOLD': 1, 'RESET_TIMEOUT': 0.05})
+    url = start_mock(items=1)
+    breaker = get_retry_policy().breaker_for(url)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    session = http_client.get_session()
+
+    def broken_get(*args, **kwargs):
+        raise RuntimeError("broken")
+
+    session.get = broken_get
+    try:
+        with pytest.raises(RuntimeError):
+            safe_request(url)
+    finally:
+        del session.get
+    assert breaker.state == CIRCUIT_OPEN
+
+    # 异常退出的探测请求计为失败，重置时间过后可以再次探测并恢复
+    time.sleep(0.06)
+    assert safe_request(url) is not None
+    assert breaker.state == CIRCUIT_CLOSED
@@ -0,0 +1,82 @@
+import copy
+import json
+import os
+
+import cli
+import http_cache
+from config import COMMON_CONFIG, ITEM_CONFIG
+from downloader.shard_download import (
+    MERGE_MANIFEST_FILE, get_shard_dir, load_shard_manifests, start_shard_download
+)
+from result_sink import iter_jsonl
+from utils import get_shard
+
+
+def write_config(base: str) -> str:
+    overrides = {
+        'ITEM_CONFIG': {'API': {'BASE_URL': base, 'isCash': None}},
+        'COMMON_CONFIG': {'REQUEST': {'RETRY_DELAY': 0.01}, 'HTTP_CACHE': {'ENABLED': False}},
+    }
+    with open('shard_config.json', 'w', encoding='utf-8') as f:
+        json.dump(overrides, f)
+    return 'shard_config.json'
+
+
+def shard_results(manifest: dict) -> list:
+    results = []
+    for name in manifest['results']:
+        results.extend(iter_jsonl(os.path.join(manifest['directory'], name)))
+    return results
+
+
+def test_local_shard_processes_cover_every_item_once(start_mock):
+    shards = 3
+    config_file = write_config(start_mock(items=45))
+    all_ids = set(range(1102000, 1102045))
+
+    # 每个分片在单独的进程中运行，全部结束后在当前进程中合并
+    assert cli.main(['shard', '--shards', str(shards), '--config', config_file]) == cli.EXIT_OK
+
+    output_dir = ITEM_CONFIG['PATHS']['SHARD_OUTPUT']
+    manifests = load_shard_manifests(output_dir)
+    assert [manifest['shard'] for manifest in manifests] == list(range(shards))
+    seen = set()
+    for manifest in manifests:
+        assert manifest['ok']
+        ids = {result['id'] for result in shard_results(manifest)}
+        assert ids and not ids & seen
+        assert all(get_shard(item_id, shards) == manifest['shard'] for item_id in ids)
+        seen |= ids
+    assert seen == all_ids
+
+    with open(os.path.join(output_dir, MERGE_MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        merge_manifest = json.load(f)
+    assert merge_manifest['merged_shards'] == list(range(shards))
+    assert merge_manifest['counts'] == {'success': 45}
+
+    merged_file = os.path.join(output_dir, merge_manifest['results'])
+    with open(merged_file, 'r', encoding='utf-8') as f:
+        merged = json.load(f)
+    assert [result['id'] for result in merged] == sorted(all_ids)
+    images_dir = os.path.join(output_dir, os.path.basename(ITEM_CONFIG['PATHS']['IMAGES']))
+    assert sorted(os.listdir(images_dir)) == sorted(result['filename'] for result in merged)
+
+
+def test_shard_paths_do_not_change_global_config(start_mock):
+    start_mock(items=20)
+    COMMON_CONFIG['HTTP_CACHE']['ENABLED'] = True
+    # 分片开始前已经创建的共享缓存不应被分片继续使用
+    assert http_cache.get_http_cache().directory == COMMON_CONFIG['HTTP_CACHE']['DIRECTORY']
+    paths = copy.deepcopy(ITEM_CONFIG['PATHS'])
+    common = copy.deepcopy(COMMON_CONFIG)
+
+    assert start_shard_download(1, 2)
+
+    assert ITEM_CONFIG['PATHS'] == paths
+    assert COMMON_CONFIG == common
+    shard_dir = get_shard_dir(paths['SHARD_OUTPUT'], 1, 2)
+    images = os.listdir(os.path.join(shard_dir, os.path.basename(paths['IMAGES'])))
+    assert 0 < len(images) < 20
+    assert not os.path.exists(paths['IMAGES'])
+    assert os.path.exists(os.path.join(shard_dir, common['HTTP_CACHE']['DIRECTORY'], 'index.db'))
+    assert http_cache.get_http_cache().directory == common['HTTP_CACHE']['DIRECTORY']
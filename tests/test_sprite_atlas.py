@@ -0,0 +1,78 @@
+import glob
+import os
+
+import pytest
+
+from config import ITEM_CONFIG
+from downloader.item_download import start_download
+from image_store import ImageStore
+from mock_server import MockCatalog
+from sprite_atlas import AtlasBuilder, AtlasIndex, ShelfPacker, iter_result_sources
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def test_shelf_packer_places_icons_without_overlap():
+    packer = ShelfPacker(max_size=10, padding=1)
+    rects = []
+    for width, height in [(4, 4), (4, 3), (3, 4), (4, 4)]:
+        x, y = packer.add(width, height)
+        rects.append((x, y, width, height))
+    for i, (x1, y1, w1, h1) in enumerate(rects):
+        assert x1 + w1 <= 10 and y1 + h1 <= 10
+        for x2, y2, w2, h2 in rects[i + 1:]:
+            assert x1 + w1 <= x2 or x2 + w2 <= x1 or y1 + h1 <= y2 or y2 + h2 <= y1
+    assert packer.add(11, 1) is None
+    assert packer.add(2, 2) is None
+
+
+def test_shelf_packer_reports_full_page():
+    packer = ShelfPacker(max_size=8, padding=0)
+    assert [packer.add(4, 4) for _ in range(4)] == [(0, 0), (4, 0), (0, 4), (4, 4)]
+    assert packer.add(4, 4) is None
+    assert (packer.width, packer.height) == (8, 8)
+
+
+def test_atlas_index_returns_downloaded_pixels(start_mock):
+    start_mock(MockCatalog(items=30))
+    ITEM_CONFIG['API']['ICON_RESIZE'] = 1
+    ITEM_CONFIG['ATLAS'].update({'ENABLED': True, 'MAX_SIZE': 128, 'PNG': False})
+    assert start_download()
+
+    images = ITEM_CONFIG['PATHS']['IMAGES']
+    with AtlasIndex(ITEM_CONFIG['PATHS']['ATLAS']) as atlas:
+        assert len(atlas) == 30
+        # 页边长较小，图标分布在多页中
+        assert len({entry.page for entry in atlas}) > 1
+        for entry in atlas:
+            assert atlas.lookup(entry.item_id) == entry
+            with Image.open(os.path.join(images, f"{entry.name}.png")) as icon:
+                assert (entry.width, entry.height) == icon.size
+                assert atlas.read_pixels(entry) == icon.convert('RGBA').tobytes()
+        assert atlas.lookup(1) is None
+
+
+def test_rebuild_only_touches_changed_pages(start_mock):
+    start_mock(MockCatalog(items=20))
+    ITEM_CONFIG['API']['ICON_RESIZE'] = 1
+    assert start_download()
+    results_file = sorted(glob.glob(f"{ITEM_CONFIG['PATHS']['JSON_BASE']}_*.json"))[-1]
+    store = ImageStore(ITEM_CONFIG['PATHS']['IMAGES'])
+
+    first = AtlasBuilder('atlas', max_size=128, write_png=False)
+    first.build(iter_result_sources(results_file, store))
+    assert first.stats['added'] == 20 and first.stats['pages'] > 1
+
+    again = AtlasBuilder('atlas', max_size=128, write_png=False)
+    again.build(iter_result_sources(results_file, store))
+    assert again.stats['rebuilt'] == 0
+
+    # 删除一个图标只重建它所在的页
+    sources = list(iter_result_sources(results_file, store))
+    removed = AtlasBuilder('atlas', max_size=128, write_png=False)
+    removed.build(sources[1:])
+    assert removed.stats['removed'] == 1
+    assert 0 < removed.stats['rebuilt'] < removed.stats['pages']
+    with AtlasIndex('atlas') as atlas:
+        assert len(atlas) == 19
+        assert atlas.lookup(sources[0].item_id) is None
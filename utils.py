@@ -1,18 +1,16 @@
 import os
 import logging
-import json
-import base64
-from PIL import Image
-import io
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import hashlib
 import time
+from contextlib import nullcontext
 from datetime import datetime
 from config import COMMON_CONFIG, ITEM_CONFIG
+from log_queue import setup_logging  # noqa: F401  各下载器从utils导入
 from urllib.parse import urlparse, parse_qs, unquote
 import re
 
+# requests、Pillow等较重的依赖在用到的函数中再导入，只查看状态的命令行调用不需要加载它们
+
 # URL参数与API参数的映射关系
 PARAM_MAPPINGS = {
     # 网站URL参数: API参数
@@ -66,7 +64,6 @@ def parse_maplestory_url_params(url: str) -> tuple[dict, bool]:
             key: unquote(value[0])
             for key, value in parse_qs(parsed_url.query).items()
         }
-        print(query_params)
         # 检查是否为商城物品
         is_cash = None  # 默认为None，表示URL中没有指定cash参数
         if 'cash' in query_params:
@@ -98,28 +95,78 @@ def ensure_directory(directory):
         logging.info(f"Created directory: {directory}")
 
 
-def get_json_filename():
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    return f"{ITEM_CONFIG['PATHS']['JSON_BASE']}_{timestamp}.json"
+def get_api_version(base_url: str) -> str:
+    """
+    从API地址中解析区服和版本
+
+    Args:
+        base_url: 例如 https://maplestory.io/api/CMS/202/item/
+
+    Returns:
+        str: 例如 'CMS/202'，无法解析时返回'unknown'
+    """
+    match = re.search(r'/api/([^/]+/[^/]+)/', base_url)
+    return match.group(1) if match else 'unknown'
+
+
+def get_icon_resize(api: dict = None):
+    """
+    获取请求图标时使用的resize参数，启用本地派生尺寸时只按原始尺寸请求一次
+
+    Args:
+        api: 结构与ITEM_CONFIG['API']相同的接口配置，默认使用ITEM_CONFIG['API']
+    """
+    if ITEM_CONFIG['VARIANTS']['ENABLED']:
+        return 1
+    return (api or ITEM_CONFIG['API'])['ICON_RESIZE']
+
+
+def get_shard(item_id, shards: int) -> int:
+    """
+    按物品ID的哈希值确定物品所属的分片，不依赖Python的hash()，不同进程和机器上结果相同
+
+    Args:
+        item_id: 物品ID
+        shards: 分片总数
+    """
+    digest = hashlib.blake2b(str(item_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+
+def replace_api_version(base_url: str, url: str) -> str:
+    """
+    将API地址中的区服和版本替换为maplestory.wiki链接中的区服和版本，链接中没有时原样返回
 
+    Args:
+        base_url: 例如 https://maplestory.io/api/CMS/202/npc/
+        url: 例如 https://maplestory.wiki/GMS/250/npc
+    """
+    match = re.search(r'maplestory\.wiki/([^/]+)/(\d+)(?:/|$)', url)
+    if not match:
+        return base_url
+    return re.sub(r'/api/[^/]+/[^/]+/', f'/api/{match.group(1)}/{match.group(2)}/', base_url)
 
-def setup_logging():
-    if not os.path.exists(ITEM_CONFIG['PATHS']['LOGS']):
-        os.makedirs(ITEM_CONFIG['PATHS']['LOGS'])
 
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M')
-    log_file = os.path.join(
-        ITEM_CONFIG['PATHS']['LOGS'], f'crawler_{timestamp}.log')
+def get_item_api(url: str, params: dict, is_cash) -> dict:
+    """
+    根据wiki链接生成结构与ITEM_CONFIG['API']相同的接口配置，API地址中的区服和版本与链接保持一致
+
+    Args:
+        url: maplestory.wiki链接
+        params: parse_maplestory_url_params解析出的参数
+        is_cash: parse_maplestory_url_params解析出的isCash，为None时沿用ITEM_CONFIG中的配置
+    """
+    return {
+        'BASE_URL': replace_api_version(ITEM_CONFIG['API']['BASE_URL'], url),
+        'PARAMS': params,
+        'isCash': ITEM_CONFIG['API']['isCash'] if is_cash is None else is_cash,
+        'ICON_RESIZE': ITEM_CONFIG['API']['ICON_RESIZE']
+    }
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file, encoding='utf-8'),
-            logging.StreamHandler()
-        ]
-    )
-    logging.info(f"Logging setup complete. Log file: {log_file}")
+
+def get_json_filename(json_base: str = None):
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f"{json_base or ITEM_CONFIG['PATHS']['JSON_BASE']}_{timestamp}.json"
 
 
 def save_base64_image(base64_str, filename):
@@ -133,6 +180,10 @@ def save_base64_image(base64_str, filename):
     Returns:
         None
     """
+    import base64
+    import io
+    from PIL import Image
+
     if ',' in base64_str:
         base64_str = base64_str.split(',')[1]
     image_data = base64.b64decode(base64_str)
@@ -140,13 +191,14 @@ def save_base64_image(base64_str, filename):
     image.save(filename)
 
 
-def get_unique_filename(name: str, original_ext: str = '.png') -> str:
+def get_unique_filename(name: str, original_ext: str = '.png', exists=os.path.exists) -> str:
     """
     根据配置策略获取唯一的文件名
 
     Args:
         name: 原始文件名（不含扩展名）
         original_ext: 文件扩展名，默认为.png
+        exists: 判断文件路径是否已被占用的函数，默认为os.path.exists
 
     Returns:
         str: 最终的文件名（包含扩展名）
@@ -158,7 +210,7 @@ def get_unique_filename(name: str, original_ext: str = '.png') -> str:
         ITEM_CONFIG['PATHS']['IMAGES'], f"{base_name}{ext}")
 
     # 如果文件不存在，直接返回原始名称
-    if not os.path.exists(file_path):
+    if not exists(file_path):
         return f"{base_name}{ext}"
 
     # 根据策略处理重复文件
@@ -177,83 +229,119 @@ def get_unique_filename(name: str, original_ext: str = '.png') -> str:
                 ext=ext
             )
             file_path = os.path.join(ITEM_CONFIG['PATHS']['IMAGES'], new_name)
-            if not os.path.exists(file_path):
+            if not exists(file_path):
                 return new_name
             index += 1
 
     return None  # 默认返回None
 
 
-def update_json_file(item_data, json_file=None):
-    if json_file is None:
-        json_file = get_json_filename()
+def safe_request(url, params=None, stream=False, headers=None):
+    """
+    发送GET请求，按统一的重试策略处理失败
 
-    try:
-        existing_data = []
-        if os.path.exists(json_file):
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    if content.strip():
-                        existing_data = json.loads(content)
-            except json.JSONDecodeError:
-                logging.warning(
-                    "Existing JSON file is invalid or empty, starting fresh")
-                existing_data = []
+    网络错误和408/429/5xx会按带抖动的指数退避重试，重试受全局预算和按主机的熔断器限制；
+    其余非2xx状态码不重试，直接视为失败。
 
-        existing_data.append(item_data)
+    Args:
+        url: 请求地址
+        params: 查询参数
+        stream: 是否流式读取响应内容
+        headers: 额外的请求头，例如Range；带额外请求头的请求不使用本地缓存
 
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(existing_data, f, ensure_ascii=False, indent=2)
+    Returns:
+        requests.Response: 成功(2xx)的响应，失败时返回None
+    """
+    import requests
+    from http_client import get_session, record_request
+    from http_cache import get_http_cache
+    from metrics import count, observe_stage
+    from rate_control import get_limiter, parse_retry_after, THROTTLE_STATUSES
+    from retry_policy import get_retry_policy, OUTCOME_FAIL, OUTCOME_SUCCESS
+
+    session = get_session()
+    policy = get_retry_policy()
+    breaker = policy.admit(url)
+    if breaker is None:
+        return None
 
-        # logging.info(f"✓ Successfully updated {json_file}")
-    except Exception as e:
-        logging.error(f"✗ Error updating JSON file: {str(e)}")
-        logging.error(f"Attempting to save current item separately...")
-
-        try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            backup_file = f'maplestory-img_backup_{
-                item_data["id"]}_{timestamp}.json'
-            with open(backup_file, 'w', encoding='utf-8') as f:
-                json.dump([item_data], f, ensure_ascii=False, indent=2)
-            logging.info(f"✓ Saved item to backup file: {backup_file}")
-        except Exception as backup_error:
-            logging.error(f"✗ Failed to save backup: {str(backup_error)}")
-
-
-def create_session():
-    session = requests.Session()
-    retries = Retry(
-        total=5,
-        backoff_factor=1,
-        status_forcelist=[500, 502, 503, 504, 408, 429],
-    )
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
-
-
-def safe_request(url, params=None):
-    session = create_session()
-
-    for attempt in range(COMMON_CONFIG['REQUEST']['MAX_RETRIES']):
-        try:
+    # 有本地缓存时发送条件请求，304直接使用缓存内容
+    cache = get_http_cache() if not headers else None
+    cache_key = cache_entry = None
+    if cache is not None:
+        cache_key = cache.make_key(url, params)
+        cache_entry = cache.lookup(cache_key)
+        headers = cache.conditional_headers(cache_entry)
+
+    # 启用自适应并发时，由控制器决定何时发出请求，并根据结果调整并发和速率
+    limiter = get_limiter()
+
+    def send(request_headers):
+        record_request()
+        retry_after = None
+        slot = limiter.slot() if limiter is not None else nullcontext({})
+        with slot as feedback:
+            sent = time.perf_counter()
             response = session.get(
-                url, params=params, timeout=COMMON_CONFIG['REQUEST']['TIMEOUT'])
-            return response
-        except (requests.exceptions.ChunkedEncodingError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.ReadTimeout) as e:
-            if attempt == COMMON_CONFIG['REQUEST']['MAX_RETRIES'] - 1:
-                logging.error(f"Failed after {
-                              COMMON_CONFIG['REQUEST']['MAX_RETRIES']} attempts: {str(e)}")
+                url, params=params, headers=request_headers, stream=stream,
+                timeout=COMMON_CONFIG['REQUEST']['TIMEOUT'])
+            observe_stage('http_ttfb', time.perf_counter() - sent)
+            feedback['status'] = response.status_code
+            if stream and 200 <= response.status_code < 300:
+                # 流式读取的内容读完或响应关闭后才归还名额，并发数包含正在下载内容的请求
+                feedback['response'] = response
+            if response.status_code in THROTTLE_STATUSES:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                feedback['retry_after'] = retry_after
+        count('responses', status=response.status_code)
+        return response, retry_after
+
+    # 未处理的异常也计为一次失败，半开状态下的探测请求异常退出时不会一直占用探测名额
+    try:
+        for attempt in range(policy.max_attempts):
+            status = None
+            try:
+                response, retry_after = send(headers)
+                status = response.status_code
+                if status == 304 and cache_entry is not None:
+                    breaker.record_success()
+                    cached = cache.hit(cache_entry, response, stream=stream)
+                    if cached is not None:
+                        count('cache', result='hit')
+                        return cached
+                    # 条件请求期间缓存内容被其他线程淘汰，立即改为不带条件的请求
+                    logging.info(f"Cached body evicted during revalidation, refetching {url}")
+                    cache_entry = None
+                    headers = {}
+                    response, retry_after = send(headers)
+                    status = response.status_code
+                outcome = policy.judge_status(breaker, url, status)
+                if outcome == OUTCOME_SUCCESS:
+                    if cache is not None:
+                        count('cache', result='miss')
+                        cache.store(cache_key, response, stream=stream)
+                    return response
+
+                response.close()
+                if outcome == OUTCOME_FAIL:
+                    return None
+                error = f"HTTP {status}"
+
+            except (requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                error = str(e)
+
+            # 启用自适应并发时，Retry-After由控制器统一暂停所有请求
+            delay = policy.retry_delay(attempt, breaker, url, error, status,
+                                       retry_after if limiter is None else None)
+            if delay is None:
                 return None
-            logging.warning(f"Attempt {attempt + 1} failed: {str(e)}. Retrying in {
-                            COMMON_CONFIG['REQUEST']['RETRY_DELAY']} seconds...")
-            time.sleep(COMMON_CONFIG['REQUEST']['RETRY_DELAY'])
-    return None
+            time.sleep(delay)
+        return None
+    except BaseException:
+        breaker.record_failure()
+        raise
 
 
 def detect_config_type(url: str) -> str: